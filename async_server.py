@@ -0,0 +1,392 @@
+#!/usr/bin/python3
+
+"""Asynchronous search server: answers queries from an asyncio event loop, with deadlines.
+
+Usage: ./async_server.py [port] [--threads=N]
+
+    POST /search    body = {"query": "your query", "k": 10, "timeout": 200, ...}
+    GET  /search?query=your+query&k=10&timeout=200&...
+
+with the other parameters of search_server.py. Both return
+{"results": [{"doc_id": .., "score": .., "title": .., "url": ..}, ...], "partial": false}.
+/complete answers as in search_server.py, from the loop: the completions are precomputed.
+
+A QueryService answers the queries of the loop:
+
+* the query is parsed in the loop, or by a pool of N threads if it has wildcards or fuzzy
+  words to expand;
+* the posting lists of the terms of a query missing from the posting list cache (their
+  impact tiers in impact mode) are read and decoded at the same time by the threads of the
+  pool (the reads release the GIL), from the arrival of the query, and a term being read
+  for another query is not read again;
+* a query identical to a query still being answered (same key in the result cache) waits
+  for its results instead of being answered again;
+* at most MAX_RUNNING queries are ranked at the same time, the others wait for their turn
+  and no more than MAX_WAITING queries wait (503 beyond);
+* every query has a deadline, "timeout" milliseconds after its arrival (DEFAULT_TIMEOUT
+  by default). A query still waiting for its turn then is ranked right away, and the
+  posting lists not read by then are left out, "partial": true. A request waiting for an identical query
+  with a later deadline is ranked with the posting lists read by its own deadline. A
+  boolean query cannot be matched without all its posting lists, its partial results are
+  empty. Partial results are not cached.
+"""
+
+import asyncio
+import json
+import math
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+import rankings
+import search
+import search_server
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8766
+# threads reading the posting lists and ranking the queries
+DEFAULT_THREADS = 8
+# queries answered at the same time, and waiting for their turn
+MAX_RUNNING = 8
+MAX_WAITING = 1000
+# seconds from the arrival of a query to its deadline, when the request sets none
+DEFAULT_TIMEOUT = 1.0
+# largest size of a request header, in bytes
+MAX_HEADER = 1 << 16
+
+class Overloaded(Exception):
+    """Raised when too many queries are waiting for their turn."""
+
+def remaining(deadline, loop):
+    """Return the seconds left until @deadline (a time of @loop), None if there is none."""
+    if deadline is None:
+        return None
+    return max(0.0, deadline - loop.time())
+
+class QueryService:
+    """Answers the queries of an asyncio event loop with @index, reading the posting lists \
+with @threads threads. To be used from the thread of the loop only."""
+
+    def __init__(self, index, threads=DEFAULT_THREADS, max_running=MAX_RUNNING, \
+        max_waiting=MAX_WAITING):
+        self.index = index
+        self.executor = ThreadPoolExecutor(threads)
+        self.running = asyncio.Semaphore(max_running)
+        self.max_waiting = max_waiting
+        self.waiting = 0
+        # type(in_flight) == { result cache key: (asyncio.Task of (results, complete),
+        # deadline of the task) }
+        self.in_flight = {}
+        # type(reads) == { (impact tiers?, term): asyncio.Future of the read of the posting
+        # list of term, or of its impact tiers }
+        self.reads = {}
+        self.reload_lock = asyncio.Lock()
+        # number of queries answered by an identical query in flight, and partial results
+        self.coalesced = 0
+        self.partial = 0
+
+    async def current_index(self):
+        """Return the up to date index, loading it again if build_index.py changed it."""
+        if self.index.current_version() != self.index.version:
+            async with self.reload_lock:
+                if self.index.current_version() != self.index.version:
+                    # queries in progress keep using the old index
+                    loop = asyncio.get_running_loop()
+                    self.index = await loop.run_in_executor(self.executor, search.Index, \
+                        self.index.shard)
+                    self.in_flight = {}
+                    self.reads = {}
+        return self.index
+
+    async def search(self, query_string, k, mode="exact", ranking=None, doc_filter=None, \
+        timeout=None):
+        """Return (results, complete) for @query_string, same arguments and results as \
+search.search, complete = False if they are partial because the deadline @timeout seconds \
+from now (none if None) was reached. Raise ValueError if the query is not valid and \
+Overloaded if too many queries are waiting."""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        if ranking is None:
+            ranking = rankings.Cosine()
+        index = await self.current_index()
+        if "*" in query_string or "~" in query_string:
+            # the expansion of the wildcards and fuzzy words reads the term dictionaries
+            (query_freq, query) = await loop.run_in_executor(self.executor, \
+                search.parse_query, query_string, index)
+        else:
+            (query_freq, query) = search.parse_query(query_string, index)
+        if len(query_freq) == 0:
+            return ([], True)
+        key = search.result_key(query_freq, query, k, mode, ranking, doc_filter)
+        result = index.result_cache.get(key)
+        if result is not None:
+            return (list(result), True)
+
+        if key in self.in_flight:
+            (task, task_deadline) = self.in_flight[key]
+            self.coalesced += 1
+        else:
+            task = loop.create_task(self.answer(index, key, query_freq, query, k, mode, \
+                ranking, doc_filter, deadline))
+            task_deadline = deadline
+            in_flight = self.in_flight
+            in_flight[key] = (task, deadline)
+            # the index may have been reloaded since, with new queries in flight
+            task.add_done_callback(lambda done: in_flight.pop(key) \
+                if in_flight.get(key, (None, None))[0] is done else None)
+        # the task returns by its deadline (plus the time to rank), a request with an earlier
+        # deadline stops waiting then and is ranked with the posting lists read so far, the task
+        # goes on for the others
+        timeout = None
+        if deadline is not None and (task_deadline is None or deadline < task_deadline):
+            timeout = remaining(deadline, loop)
+        try:
+            (result, complete) = await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            (result, complete) = await self.answer(index, key, query_freq, query, k, mode, \
+                ranking, doc_filter, loop.time())
+        if not complete:
+            self.partial += 1
+        return (list(result), complete)
+
+    async def answer(self, index, key, query_freq, query, k, mode, ranking, doc_filter, \
+        deadline):
+        """Return (results, complete) of the query @query_freq, @query (see \
+search.parse_query) with key @key in the result cache, ranked in its turn with the posting \
+lists of its terms read by then, or at @deadline if the turn has not come, with those read \
+by @deadline. The reads start right away."""
+        loop = asyncio.get_running_loop()
+        if self.waiting >= self.max_waiting:
+            raise Overloaded("too many queries waiting")
+        # with the posting lists of the excluded terms
+        terms = set(query_freq.keys())
+        if query is not None:
+            terms.update(term for (term, excluded) in search.node_terms(query))
+        # get_top_k_impact reads the postings tier by tier, the query weights need the df only
+        impact = mode == "impact" and ranking.name == "cosine" and query is None and \
+            (doc_filter is None or doc_filter.is_empty())
+        fetching = loop.create_task(self.fetch(index, terms, deadline, impact))
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.running.acquire(), remaining(deadline, loop))
+            turn = True
+        except asyncio.TimeoutError:
+            # past its deadline the query is ranked right away
+            turn = False
+        finally:
+            self.waiting -= 1
+        try:
+            filtered = None
+            if doc_filter is not None and not doc_filter.is_empty():
+                filtered = await loop.run_in_executor(self.executor, index.filter_doc_ids, \
+                    doc_filter)
+            if filtered is not None and len(filtered) == 0:
+                fetching.cancel()
+                index.result_cache.put(key, ())
+                return ((), True)
+            (posting_list, pending) = await fetching
+            # with the lists read while waiting for the turn
+            for read in pending:
+                if read.done():
+                    posting_list.update(read.result())
+            complete = all(read.done() for read in pending)
+            if not complete:
+                if query is not None:
+                    return ((), False)
+                query_freq = dict((term, freq) for term, freq in query_freq.items() \
+                    if term in posting_list)
+                if len(query_freq) == 0:
+                    return ((), False)
+            result = tuple(await loop.run_in_executor(self.executor, rank, query_freq, query, \
+                posting_list, filtered, k, index, mode, ranking))
+            if complete:
+                index.result_cache.put(key, result)
+            return (result, complete)
+        finally:
+            if turn:
+                self.running.release()
+
+    async def fetch(self, index, terms, deadline, impact=False):
+        """Return (posting lists of @terms read by @deadline, reads of the others), with the \
+impact tiers of the terms read instead and (df, [], []) as posting lists if @impact (see \
+search.search). The lists in the posting list cache are taken right away, the others are \
+read by the threads of the pool at the same time, or by the read of another query in \
+progress, and the reads not done by @deadline are returned as they are (they go on and fill \
+the posting list cache for the next queries)."""
+        loop = asyncio.get_running_loop()
+        posting_list = {}
+        reads = []
+        for term in terms:
+            entry = None if impact else index.posting_cache.get(term)
+            if entry is not None:
+                posting_list[term] = entry
+                continue
+            read = self.reads.get((impact, term))
+            if read is None:
+                read = loop.run_in_executor(self.executor, read_impact_tiers if impact \
+                    else read_posting_list, index, term)
+                reads_of_index = self.reads
+                reads_of_index[(impact, term)] = read
+                read.add_done_callback(lambda done, key=(impact, term): \
+                    reads_of_index.pop(key, None))
+            reads.append(read)
+        if len(reads) == 0:
+            return (posting_list, [])
+        (done, pending) = await asyncio.wait(reads, timeout=remaining(deadline, loop))
+        for read in done:
+            posting_list.update(read.result())
+        return (posting_list, list(pending))
+
+    def close(self):
+        """Stop the threads of the pool."""
+        self.executor.shutdown(wait=False)
+
+def read_posting_list(index, term):
+    """Return { @term: posting list } of @term in @index, {} if it does not occur (see \
+search.Index.get_posting_lists). Executed by the threads of the pool of a QueryService."""
+    return index.get_posting_lists([term])
+
+def read_impact_tiers(index, term):
+    """Read the impact tiers of @term in @index into the posting list cache (see \
+search.Index.get_impact_tiers), return { @term: (df, [], []) }, {} if it does not occur. \
+Executed by the threads of the pool of a QueryService."""
+    stats = index.term_stats(term)
+    if stats is None:
+        return {}
+    index.get_impact_tiers(term)
+    return {term: (stats[0], [], [])}
+
+def rank(query_freq, query, posting_list, filtered, k, index, mode, ranking):
+    """Return the results of the query @query_freq, @query with the posting lists \
+@posting_list, keeping only the posts @filtered (None = every post), as in search.search. \
+Executed by the threads of the pool of a QueryService."""
+    matches = search.filter_matches(search.match_query(query, posting_list, index), filtered)
+    return search.rank(query_freq, posting_list, k, index, mode, ranking, matches)
+
+def parse_timeout(params):
+    """Return the seconds of the "timeout" (milliseconds) of the request parameters @params, \
+raise ValueError if it is not valid."""
+    timeout = params.get("timeout", DEFAULT_TIMEOUT * 1000)
+    # float() raises TypeError for null and accepts true
+    if isinstance(timeout, bool) or not isinstance(timeout, (int, float, str)):
+        raise ValueError("timeout must be a number")
+    try:
+        timeout = float(timeout)
+    except ValueError:
+        raise ValueError("timeout must be a number")
+    if not math.isfinite(timeout) or timeout <= 0:
+        raise ValueError("timeout must be a positive number")
+    return timeout / 1000
+
+async def read_request(reader):
+    """Return (method, path, params) of the HTTP request read from @reader, raise \
+ValueError if it is not valid."""
+    header = await reader.readuntil(b"\r\n\r\n")
+    if len(header) > MAX_HEADER:
+        raise ValueError("request header too large")
+    lines = header.decode("latin-1").split("\r\n")
+    (method, target, version) = lines[0].split(" ")
+    headers = {}
+    for line in lines[1 : ]:
+        (name, sep, value) = line.partition(":")
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    url = urlparse(target)
+    if method == "POST":
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+        params = json.loads(body.decode("utf-8"))
+        if not isinstance(params, dict):
+            raise ValueError("request body must be a JSON object")
+    else:
+        params = dict((key, values[0]) for key, values in parse_qs(url.query).items())
+    return (method, url.path, params)
+
+async def send_json(writer, status, body):
+    """Send @body encoded as JSON with HTTP status @status and close the connection."""
+    reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error", \
+        503: "Service Unavailable"}
+    data = json.dumps(body).encode("utf-8")
+    writer.write(("HTTP/1.1 " + str(status) + " " + reasons[status] + "\r\n" + \
+        "Content-Type: application/json\r\nContent-Length: " + str(len(data)) + "\r\n" + \
+        "Connection: close\r\n\r\n").encode("latin-1") + data)
+    await writer.drain()
+    writer.close()
+
+async def handle(service, reader, writer):
+    """Answer the request of the connection @reader, @writer with @service."""
+    try:
+        (method, path, params) = await read_request(reader)
+        if path == "/complete":
+            (query_string, k) = search_server.parse_complete_request(params)
+        elif path != "/search":
+            await send_json(writer, 404, {"error": "unknown path " + path})
+            return
+        else:
+            (query_string, k, mode, ranking, doc_filter) = search_server.parse_request(params)
+            timeout = parse_timeout(params)
+    except (ValueError, TypeError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) \
+        as e:
+        await send_json(writer, 400, {"error": str(e)})
+        return
+    if path == "/complete":
+        try:
+            index = await service.current_index()
+            completions = search.autocomplete(query_string, index, k)
+        except ValueError as e:
+            await send_json(writer, 400, {"error": str(e)})
+            return
+        except Exception as e:
+            await send_json(writer, 500, {"error": repr(e)})
+            return
+        await send_json(writer, 200, search_server.format_completions(completions))
+        return
+    try:
+        (result, complete) = await service.search(query_string, k, mode, ranking, doc_filter, \
+            timeout)
+    except ValueError as e:
+        # a phrase query on an index without positions
+        await send_json(writer, 400, {"error": str(e)})
+        return
+    except Overloaded as e:
+        await send_json(writer, 503, {"error": str(e)})
+        return
+    except Exception as e:
+        await send_json(writer, 500, {"error": repr(e)})
+        return
+    body = search_server.format_results(result)
+    body["partial"] = not complete
+    await send_json(writer, 200, body)
+
+async def serve(index, host=DEFAULT_HOST, port=DEFAULT_PORT, threads=DEFAULT_THREADS):
+    """Answer queries on @host:@port with the resident @index until interrupted."""
+    service = QueryService(index, threads)
+    server = await asyncio.start_server(lambda reader, writer: handle(service, reader, \
+        writer), host, port, limit=MAX_HEADER)
+    print("Serving on http://" + host + ":" + str(port) + "/search")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--threads=")]
+    threads = DEFAULT_THREADS
+    for arg in sys.argv[1:]:
+        if arg.startswith("--threads=") and arg[len("--threads="):].isdigit():
+            threads = max(1, int(arg[len("--threads="):]))
+    if len(args) > 1 or (len(args) == 1 and not args[0].isdigit()):
+        print("Usage: ./async_server.py [port] [--threads=N]")
+        sys.exit(1)
+    port = int(args[0]) if len(args) == 1 else DEFAULT_PORT
+    try:
+        index = search.Index()
+    except:
+        print("Error! Index not constructed. Execute build_index.py to search")
+        sys.exit(1)
+    try:
+        asyncio.run(serve(index, port=port, threads=threads))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/python3
+
+"""Batch search: answers many queries in one run, reading every posting list only once.
+
+Usage: ./batch_search.py [queries_file] [--k=10] [--mode=exact|wand|impact] [--workers=N]
+                         [--ranking=cosine|bm25|bm25f] [--alpha=0.5] [--boosts=title:2,...]
+                         [--from=YYYY-MM-DD] [--to=YYYY-MM-DD] [--author=name,...]
+                         [--category=name,...] [--min_comments=N] [--min_inlinks=N]
+
+Reads one query per line from queries_file (stdin by default) and writes one JSON line per
+query to stdout, in the order of the queries:
+
+    {"query": "your query", "results": [{"doc_id": .., "score": .., "title": .., "url": ..}, ...]}
+
+The queries are grouped by their most frequent term, so that the queries sharing terms are
+answered one after the other. The posting lists of a group are read and decoded together
+and kept in memory until the last query of the batch using them is answered. With
+--workers=N the groups are split between N processes. The queries may use the boolean
+operators, phrases and NEAR/k operators of search.py, the filters apply to every query.
+"""
+
+import json
+import sys
+import multiprocessing
+import rankings
+import search
+import doc_filters
+import search_server
+
+# the index of a worker process
+worker_index = None
+
+def parse_input():
+    """Read the arguments, return (queries_file or None for stdin, k, mode, workers, \
+ranking, doc_filter)."""
+    usage = "Usage: ./batch_search.py [queries_file] [--k=10] [--mode=exact|wand|impact] " + \
+        "[--workers=N]\n                         [--ranking=cosine|bm25|bm25f] [--alpha=0.5] " + \
+        "[--boosts=title:2,...]\n                         [--from=YYYY-MM-DD] " + \
+        "[--to=YYYY-MM-DD] [--author=name,...]\n                         " + \
+        "[--category=name,...] [--min_comments=N] [--min_inlinks=N]"
+    queries_file = None
+    k = 10
+    mode = "exact"
+    workers = 1
+    # type(ranking_options) == { name: value } of --ranking, --alpha and --boosts
+    ranking_options = {}
+    # type(filter_options) == { name: value } of the filters, see doc_filters.PARAMETERS
+    filter_options = {}
+    for arg in sys.argv[1:]:
+        if arg.startswith("--k=") and arg[len("--k="):].isdigit():
+            k = int(arg[len("--k="):])
+        elif arg.startswith("--mode=") and arg[len("--mode="):] in search.MODES:
+            mode = arg[len("--mode="):]
+        elif arg.startswith("--workers=") and arg[len("--workers="):].isdigit():
+            workers = max(1, int(arg[len("--workers="):]))
+        elif arg.split("=")[0] in ("--ranking", "--alpha", "--boosts") and "=" in arg:
+            (name, sep, value) = arg[2:].partition("=")
+            ranking_options[name] = value
+        elif arg[2:].split("=")[0] in doc_filters.PARAMETERS and "=" in arg:
+            (name, sep, value) = arg[2:].partition("=")
+            filter_options[name] = value
+        elif not arg.startswith("--") and queries_file is None:
+            queries_file = arg
+        else:
+            print(usage)
+            sys.exit(1)
+    if k < 1 or k > search_server.MAX_K:
+        print("Error! k must be between 1 and " + str(search_server.MAX_K))
+        sys.exit(1)
+    try:
+        ranking = rankings.make_ranking(ranking_options.get("ranking", "cosine"), \
+            ranking_options.get("alpha", rankings.ALPHA), ranking_options.get("boosts"))
+        doc_filter = doc_filters.make_filter(filter_options)
+    except ValueError as e:
+        print("Error! " + str(e))
+        sys.exit(1)
+    return (queries_file, k, mode, workers, ranking, doc_filter)
+
+def group_queries(query_freqs, index):
+    """Return the positions of the non-empty queries @query_freqs ({ term: frequency } per \
+query), grouped by the term of highest df of each query."""
+    groups = {}
+    for position, query_freq in enumerate(query_freqs):
+        if len(query_freq) > 0:
+            key = max(query_freq.keys(), key=lambda term: (index.term_stats(term)[0], term))
+            groups.setdefault(key, []).append(position)
+    return [groups[key] for key in sorted(groups.keys())]
+
+def query_term_set(query_freq, query):
+    """Return the set of the terms whose posting lists are needed by the query @query_freq \
+with the boolean query @query (see search.parse_query), the excluded terms included."""
+    terms = set(query_freq)
+    if query is not None:
+        terms.update(term for (term, excluded) in search.node_terms(query))
+    return terms
+
+def run_groups(groups, query_freqs, k, index, mode="exact", ranking=None, queries=None, \
+    filtered=None):
+    """Return [(position, results)] of the queries of @groups, reading the posting list of \
+every term once. @queries holds the boolean queries of the queries (see search.parse_query), \
+if any, and @filtered the ascending doc_ids of the posts kept by the filter of the batch, if \
+any."""
+
+    # type(terms) == { position: terms whose posting lists the query needs }
+    terms = dict((position, query_term_set(query_freqs[position], \
+        queries[position] if queries is not None else None)) \
+        for group in groups for position in group)
+    # number of queries still to answer using every term
+    remaining = {}
+    for group in groups:
+        for position in group:
+            for term in terms[position]:
+                remaining[term] = remaining.get(term, 0) + 1
+
+    results = []
+    # type(live) == { term: (df, doc_ids, tfs) }, only the indexed terms
+    live = {}
+    for group in groups:
+        new_terms = set(term for position in group for term in terms[position] \
+            if term not in live)
+        live.update(index.get_posting_lists(new_terms))
+        for position in group:
+            query_freq = query_freqs[position]
+            posting_list = dict((term, live[term]) for term in terms[position] if term in live)
+            matches = None
+            if queries is not None:
+                matches = search.match_query(queries[position], posting_list, index)
+            matches = search.filter_matches(matches, filtered)
+            results.append((position, search.rank(query_freq, posting_list, k, index, mode, \
+                ranking, matches)))
+            for term in terms[position]:
+                remaining[term] -= 1
+                if remaining[term] == 0:
+                    live.pop(term, None)
+    return results
+
+def init_worker():
+    """Load the index of a worker process."""
+    global worker_index
+    worker_index = search.Index()
+
+def run_chunk(chunk):
+    """Answer the queries of @chunk == (groups, query_freqs, k, mode, ranking, queries, \
+filtered) in a worker process."""
+    (groups, query_freqs, k, mode, ranking, queries, filtered) = chunk
+    return run_groups(groups, query_freqs, k, worker_index, mode, ranking, queries, filtered)
+
+def split_groups(groups, workers):
+    """Split @groups in at most @workers lists of consecutive groups with about the same \
+number of queries."""
+    total = sum(len(group) for group in groups)
+    chunks = [[]]
+    size = 0
+    for group in groups:
+        if size >= total / workers * len(chunks) and len(chunks) < workers:
+            chunks.append([])
+        chunks[-1].append(group)
+        size += len(group)
+    return [chunk for chunk in chunks if len(chunk) > 0]
+
+def batch_search(queries, k, index, mode="exact", workers=1, ranking=None, doc_filter=None):
+    """Return the results of every query of @queries, as search.search would return them \
+with the filter @doc_filter. Raise ValueError if a query has phrases or NEAR operators and \
+@index has no positions."""
+    parsed = [search.parse_query(query_string, index) for query_string in queries]
+    query_freqs = [query_freq for (query_freq, query) in parsed]
+    boolean_queries = [query for (query_freq, query) in parsed]
+    groups = group_queries(query_freqs, index)
+    # the posts kept by the filter are looked up once for the whole batch
+    filtered = index.filter_doc_ids(doc_filter)
+    if filtered is not None and len(filtered) == 0:
+        groups = []
+
+    if workers > 1 and len(groups) > 1:
+        # the queries of a chunk use only their own term frequencies
+        chunks = []
+        for chunk in split_groups(groups, workers):
+            freqs = dict((position, query_freqs[position]) for group in chunk \
+                for position in group)
+            chunk_queries = dict((position, boolean_queries[position]) for position in freqs)
+            chunks.append((chunk, freqs, k, mode, ranking, chunk_queries, filtered))
+        with multiprocessing.Pool(len(chunks), initializer=init_worker) as pool:
+            answered = [pair for results in pool.imap_unordered(run_chunk, chunks) \
+                for pair in results]
+    else:
+        answered = run_groups(groups, query_freqs, k, index, mode, ranking, boolean_queries, \
+            filtered)
+
+    # queries without any indexed term, or without any post kept by the filter, have no results
+    results = [[] for query_string in queries]
+    for (position, result) in answered:
+        results[position] = result
+    return results
+
+def main():
+    (queries_file, k, mode, workers, ranking, doc_filter) = parse_input()
+    try:
+        index = search.Index()
+    except:
+        print("Error! Index not constructed. Execute build_index.py to search")
+        sys.exit(1)
+    if queries_file is None:
+        queries = [line.rstrip("\n") for line in sys.stdin]
+    else:
+        with open(queries_file, encoding="utf-8") as f:
+            queries = [line.rstrip("\n") for line in f]
+
+    try:
+        results = batch_search(queries, k, index, mode, workers, ranking, doc_filter)
+    except ValueError as e:
+        print("Error! " + str(e))
+        sys.exit(1)
+    for query_string, result in zip(queries, results):
+        line = {"query": query_string}
+        line.update(search_server.format_results(result))
+        print(json.dumps(line))
+
+if __name__ == "__main__":
+    main()
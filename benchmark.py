@@ -0,0 +1,1071 @@
+#!/usr/bin/python3
+
+"""Benchmarks on the real corpus. Build the index with build_index.py first.
+
+Usage: ./benchmark.py async|boolean|cache|codec|filters|impact|lexicon|positions|ranking|
+                      shards|spelling|stem|tokenize|topk|vector|wildcard
+"""
+
+import ast
+import bisect
+import asyncio
+import cache
+import doc_filters
+import os
+import re
+import sys
+import time
+import tracemalloc
+import random
+import postings
+import lexicon
+import rankings
+import search
+import shards
+import segments
+import async_server
+import build_index
+import stem_cache
+import tokenizer
+import vector_scoring
+from concurrent.futures import ThreadPoolExecutor
+from porterstemmer import PorterStemmer
+
+# texts checked against nltk by check_tokenizer: punctuation, contractions, URLs, unicode
+TOKENIZER_CORPUS = [
+    "Hello, world! It's a test.",
+    "I can't believe they don't know -- that's it...",
+    "Mr. Smith paid $3,000.50 at 10:30 a.m. on 1/2/2008.",
+    "Visit http://www.tuaw.com/2008/01/15/macworld-2008/ or mail tips@tuaw.com.",
+    "\"Quoted,\" he said; 'single quotes' (parens) [brackets] {braces} <angle>.",
+    "Cannot, gonna, gotta, wanna go, lemme see, gimme that, 'tis and 'twas.",
+    "Caf\u00e9, na\u00efve, \u00fcber-cool r\u00e9sum\u00e9 \u2014 \u201csmart quotes\u201d and " + \
+        "\u2018apostrophes\u2019 \u2026 ok.",
+    "The iPhone 3G's price: $199; the Mac Pro's: $2,799!",
+    "a. smith and J. R. R. Tolkien met U.S. officials.",
+    "Ends with an abbreviation etc.",
+    "What?! No way... Yes way!!",
+    "e-mail, re-install, well--known, 50,000 and 3.14159.",
+    "He said ''hello'' and ``goodbye''.",
+    "Don't you think it's O'Reilly's book?",
+    "\u65e5\u672c\u8a9e text, \u0395\u03bb\u03bb\u03b7\u03bd\u03b9\u03ba\u03ac and " + \
+        "\u0440\u0443\u0441\u0441\u043a\u0438\u0439.",
+]
+
+def load_all_posting_lists():
+    """Return every posting list of the index as { term: (doc_ids, tfs) } and N."""
+    index = search.Index()
+    terms = set()
+    for segment in index.segments:
+        terms.update(segment.term_dict.keys())
+    posting_list = index.get_posting_lists(terms)
+    N = index.N
+    all_lists = {}
+    for term, (df, doc_ids, tfs) in posting_list.items():
+        all_lists[term] = (list(doc_ids), list(tfs))
+    return (all_lists, N)
+
+def report(name, size, seconds, num_terms, num_postings, base_size):
+    """Print one line of a size / decode throughput table."""
+    print("{:<8} {:>12} {:>7.2f}x {:>12.2f} {:>14.0f}".format(name, size, base_size / size, \
+        seconds / num_terms * 1e6, num_postings / seconds))
+
+def benchmark_codec():
+    """Compare the index size and the decode throughput of every codec in postings.CODECS \
+against the old text format."""
+    (all_lists, N) = load_all_posting_lists()
+    num_terms = len(all_lists)
+    num_postings = sum(len(doc_ids) for (doc_ids, tfs) in all_lists.values())
+    print("Terms = " + str(num_terms) + " ; Postings = " + str(num_postings) + " ; N = " + str(N))
+    print("{:<8} {:>12} {:>8} {:>12} {:>14}".format("codec", "bytes", "smaller", "us/term", \
+        "postings/s"))
+
+    # old format: one python literal per line of term.txt
+    lines = []
+    for term, (doc_ids, tfs) in all_lists.items():
+        value = str([len(doc_ids), dict(zip(doc_ids, tfs))])
+        lines.append(value)
+    text_size = sum(len(term.encode("utf-8")) + len(value) + 2 \
+        for term, value in zip(all_lists.keys(), lines))
+    start = time.perf_counter()
+    for value in lines:
+        ast.literal_eval(value)
+    report("text", text_size, time.perf_counter() - start, num_terms, num_postings, text_size)
+
+    for codec in sorted(postings.CODECS.keys()):
+        records = [postings.encode(doc_ids, tfs, codec) for (doc_ids, tfs) in all_lists.values()]
+        size = sum(len(record) for record in records)
+        start = time.perf_counter()
+        for record in records:
+            postings.decode(record, codec)
+        report(codec, size, time.perf_counter() - start, num_terms, num_postings, text_size)
+
+def sample_queries(index, num_queries=500, seed=0):
+    """Return @num_queries titles of random posts, used as queries."""
+    rng = random.Random(seed)
+    return [index.get_field(doc_id, "title") for doc_id in rng.sample(range(index.N), \
+        num_queries)]
+
+def prepare_query(query_string, index):
+    """Return the query weights and the posting lists of @query_string, as done by search()."""
+    query_freq = search.query_terms(query_string, index)
+    posting_list = index.get_posting_lists(query_freq.keys())
+    return (rankings.calc_query_weights(query_freq, posting_list, index.N), posting_list)
+
+def benchmark_topk(k=10):
+    """Compare the latency of exact top-k selection and WAND pruning on multi-term queries \
+and check that they return the same documents."""
+    index = search.Index()
+    queries = [prepare_query(q, index) for q in sample_queries(index)]
+    queries = [(w, p) for (w, p) in queries if len(w) > 1]
+
+    start = time.perf_counter()
+    exact = []
+    for (weight_query, posting_list) in queries:
+        cosine_score = search.calc_cosine_scores(weight_query, posting_list, index.doc_norms)
+        exact.append(search.get_top_k(cosine_score, k, index.frac_inlinks))
+    exact_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    wand = []
+    for (weight_query, posting_list) in queries:
+        wand.append(search.get_top_k_wand(weight_query, posting_list, k, index))
+    wand_time = time.perf_counter() - start
+
+    same = 0
+    for (a, b) in zip(exact, wand):
+        scores_a = [round(score, 12) for (doc_id, score) in a]
+        scores_b = [round(score, 12) for (doc_id, score) in b]
+        same += scores_a == scores_b
+    print("Queries = " + str(len(queries)) + " ; k = " + str(k))
+    print("exact : {:.3f} ms/query".format(exact_time / len(queries) * 1e3))
+    print("wand  : {:.3f} ms/query".format(wand_time / len(queries) * 1e3))
+    print("Same top k scores: " + str(same) + " / " + str(len(queries)))
+
+def benchmark_impact(num_terms=50):
+    """Report the size of the impact records of an index built with --impacts, compare the \
+latency of exact top-k selection, WAND pruning and impact ordered early termination on the \
+@num_terms most frequent terms and on title queries for several k, with every posting list \
+and tier already read, and check that they return the same documents."""
+    index = search.Index()
+    postings_size = 0
+    impacts_size = 0
+    dfs = {}
+    for segment in index.segments:
+        for term, (df, offset, length, max_weight, field_length, position_length, \
+            impact_length) in segment.term_dict.items():
+            postings_size += length
+            impacts_size += impact_length
+            dfs[term] = dfs.get(term, 0) + df
+    if impacts_size == 0:
+        print("Error! Build the index with build_index.py --impacts")
+        sys.exit(1)
+    print("postings : {:>10} bytes".format(postings_size))
+    print("impacts  : {:>10} bytes (+{:.0%})".format(impacts_size, impacts_size / postings_size))
+
+    frequent = sorted(dfs.keys(), key=lambda term: -dfs[term])[ : num_terms]
+    print("Frequent terms: mean df = {:.0f}".format(sum(dfs[term] for term in frequent) / \
+        len(frequent)))
+    queries = [prepare_query(term, index) for term in frequent]
+    titles = [prepare_query(q, index) for q in sample_queries(index, 300)]
+    query_sets = [("frequent", [(w, p) for (w, p) in queries if len(w) > 0]), \
+        ("titles", [(w, p) for (w, p) in titles if len(w) > 0])]
+    print("{:<9} {:>5} {:>10} {:>10} {:>10}   {}".format("queries", "k", "exact ms", "wand ms", \
+        "impact ms", "same"))
+    for (name, queries) in query_sets:
+        for k in (10, 100, 1000):
+            for (weight_query, posting_list) in queries:
+                for term in weight_query:
+                    index.get_impact_tiers(term)
+            times = []
+            results = []
+            for top_k in (lambda w, p: search.get_top_k(search.calc_cosine_scores(w, p, \
+                index.doc_norms), k, index.frac_inlinks), \
+                lambda w, p: search.get_top_k_wand(w, p, k, index), \
+                lambda w, p: search.get_top_k_impact(w, k, index)):
+                start = time.perf_counter()
+                results.append([top_k(w, p) for (w, p) in queries])
+                times.append((time.perf_counter() - start) / len(queries) * 1e3)
+            same = sum([round(score, 12) for (doc_id, score) in a] == \
+                [round(score, 12) for (doc_id, score) in b] for (a, b) in zip(results[0], \
+                results[2]))
+            print("{:<9} {:>5} {:>10.3f} {:>10.3f} {:>10.3f}   {} / {}".format(name, k, *times, \
+                same, len(queries)))
+
+def load_text_term_dict(filename):
+    """Return the term dictionary @filename parsed into a dict { term: entry }, as loaded \
+before term_dict.bin."""
+    term_dict = {}
+    with open(filename, encoding="utf-8") as f:
+        f.readline()
+        for line in f:
+            (term, df, offset, length, max_weight, field_length, position_length, \
+                impact_length) = line.split(" ")
+            term_dict[term] = (int(df), int(offset), int(length), float(max_weight), \
+                int(field_length), int(position_length), int(impact_length))
+    return term_dict
+
+def measure(load):
+    """Return (value returned by @load(), seconds taken by the call, bytes allocated by a 2nd \
+call and still allocated after it). The 2nd call is traced, tracing slows it down."""
+    start = time.perf_counter()
+    value = load()
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    traced = load()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (value, seconds, size)
+
+def benchmark_lexicon(num_lookups=10000, seed=5):
+    """Compare the load time, the memory and the lookup latency of the term dictionary of the \
+main index parsed from term_dict.txt into a dict and memory-mapped from term_dict.bin, and \
+check that they hold the same entries and the same terms for every prefix of 2 letters."""
+    directory = segments.segment_dir(segments.MAIN)
+    (text_dict, text_time, text_size) = measure(lambda: \
+        load_text_term_dict(directory + "/term_dict.txt"))
+    (term_dict, map_time, map_size) = measure(lambda: \
+        lexicon.TermDictionary(directory + "/term_dict.bin"))
+    print("Terms = " + str(len(text_dict)) + " ; term_dict.txt = " + \
+        str(os.path.getsize(directory + "/term_dict.txt")) + " bytes ; term_dict.bin = " + \
+        str(os.path.getsize(directory + "/term_dict.bin")) + " bytes")
+    print("{:<10} {:>10} {:>12} {:>14} {:>14}".format("dictionary", "load ms", "memory bytes", \
+        "lookup us", "cached us"))
+
+    rng = random.Random(seed)
+    terms = sorted(text_dict.keys())
+    # half of the lookups are terms of the dictionary, half are not
+    lookups = [rng.choice(terms) + rng.choice(["", "x"]) for i in range(num_lookups)]
+    times = []
+    for run in range(2):
+        start = time.perf_counter()
+        for term in lookups:
+            text_dict.get(term)
+        times.append((time.perf_counter() - start) / num_lookups * 1e6)
+    print("{:<10} {:>10.2f} {:>12} {:>14.2f} {:>14.2f}".format("dict", text_time * 1e3, \
+        text_size, *times))
+    times = []
+    for run in range(2):
+        start = time.perf_counter()
+        for term in lookups:
+            term_dict.get(term)
+        times.append((time.perf_counter() - start) / num_lookups * 1e6)
+    print("{:<10} {:>10.2f} {:>12} {:>14.2f} {:>14.2f}".format("mmap", map_time * 1e3, \
+        map_size, *times))
+
+    prefixes = sorted(set(term[ : 2] for term in terms))
+    start = time.perf_counter()
+    same = sum([term for (term, entry) in term_dict.prefix(prefix)] == \
+        terms[bisect.bisect_left(terms, prefix) : bisect.bisect_left(terms, prefix + "\uffff")] \
+        for prefix in prefixes)
+    print("Prefixes of 2 letters = " + str(len(prefixes)) + " ; same terms: " + str(same) + \
+        " / " + str(len(prefixes)))
+    print("Same entries: " + str(list(term_dict.items()) == sorted(text_dict.items())))
+
+def wildcard_patterns(terms, num_patterns=500, seed=6):
+    """Return @num_patterns random wildcard patterns A*, *B, A*B and *C* made of parts of \
+random @terms, as users would type them."""
+    rng = random.Random(seed)
+    forms = [
+        lambda term, i, j: term[ : i] + "*",
+        lambda term, i, j: "*" + term[j : ],
+        lambda term, i, j: term[ : i] + "*" + term[j : ],
+        lambda term, i, j: "*" + term[i : j] + "*",
+    ]
+    patterns = []
+    while len(patterns) < num_patterns:
+        term = rng.choice(terms)
+        if len(term) < 4:
+            continue
+        i = rng.randint(1, len(term) // 2)
+        j = rng.randint(i + 1, len(term) - 1)
+        patterns.append(forms[len(patterns) % len(forms)](term, i, j))
+    return patterns
+
+def benchmark_wildcard(k=10, num_prefixes=5000, seed=7):
+    """Compare the latency of the terms matching wildcard patterns found with the permuterm \
+index and by checking the terms, and of the completions of prefixes precomputed and found by \
+reading every term of the prefix, and check that they are the same. Report the latency of \
+wildcard queries and of autocompletion."""
+    index = search.Index()
+    segment = index.segments[0]
+    directory = segments.segment_dir(segments.MAIN)
+    terms = list(segment.term_dict.keys())
+    print("Terms = " + str(len(terms)) + " ; permuterm.bin = " + \
+        str(os.path.getsize(directory + "/permuterm.bin")) + " bytes ; completions.bin = " + \
+        str(os.path.getsize(directory + "/completions.bin")) + " bytes (" + \
+        str(len(segment.completions)) + " prefixes)")
+
+    patterns = wildcard_patterns(terms)
+    print("{:<12} {:>12} {:>12} {:>8}".format("wildcard", "permuterm us", "scan us", "same"))
+    for (form, name) in enumerate(["A*", "*B", "A*B", "*C*"]):
+        form_patterns = patterns[form : : 4]
+        results = []
+        times = []
+        for permuterm in (segment.permuterm, None):
+            start = time.perf_counter()
+            results.append([lexicon.wildcard_terms(pattern, segment.term_dict, permuterm) \
+                for pattern in form_patterns])
+            times.append((time.perf_counter() - start) / len(form_patterns) * 1e6)
+        print("{:<12} {:>12.1f} {:>12.1f} {:>8}".format(name, *times, \
+            str(sum(a == b for a, b in zip(*results))) + "/" + str(len(form_patterns))))
+
+    rng = random.Random(seed)
+    prefixes = []
+    for i in range(num_prefixes):
+        term = rng.choice(terms)
+        prefixes.append(term[ : rng.randint(1, min(4, len(term)))])
+    print("{:<12} {:>12} {:>12} {:>8}".format("prefix", "precomp. us", "scan us", "same"))
+    for length in range(1, 5):
+        length_prefixes = [prefix for prefix in prefixes if len(prefix) == length]
+        results = []
+        times = []
+        for completions in (segment.completions, None):
+            start = time.perf_counter()
+            results.append([lexicon.complete(prefix, segment.term_dict, completions) \
+                for prefix in length_prefixes])
+            times.append((time.perf_counter() - start) / len(length_prefixes) * 1e6)
+        print("{:<12} {:>12.1f} {:>12.1f} {:>8}".format(length, *times, \
+            str(sum(a == b for a, b in zip(*results))) + "/" + str(len(length_prefixes))))
+
+    # the result cache would answer the repeated queries
+    index.result_cache = cache.LRUCache(0)
+    for run in range(2):
+        start = time.perf_counter()
+        for pattern in patterns:
+            search.search(pattern, k, index)
+        seconds = time.perf_counter() - start
+    expansions = sum(len(index.expand_wildcard(pattern)) for pattern in patterns)
+    print("Wildcard queries: " + "{:.3f}".format(seconds / len(patterns) * 1e3) + \
+        " ms/query (posting lists in the cache) ; " + \
+        "{:.1f}".format(expansions / len(patterns)) + " terms/query")
+    start = time.perf_counter()
+    for prefix in prefixes:
+        search.autocomplete(prefix, index)
+    seconds = time.perf_counter() - start
+    print("Autocompletion: " + "{:.3f}".format(seconds / len(prefixes) * 1e3) + " ms/query")
+
+def misspell(word, num_edits, rng):
+    """Return @word with @num_edits random typing errors: a letter inserted, deleted, replaced \
+or swapped with the next one."""
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    for edit in range(num_edits):
+        i = rng.randrange(len(word))
+        kind = rng.randrange(4)
+        if kind == 0:
+            word = word[ : i] + rng.choice(letters) + word[i : ]
+        elif kind == 1 and len(word) > 1:
+            word = word[ : i] + word[i + 1 : ]
+        elif kind == 2:
+            word = word[ : i] + rng.choice(letters.replace(word[i], "")) + word[i + 1 : ]
+        elif i + 1 < len(word) and word[i] != word[i + 1]:
+            word = word[ : i] + word[i + 1] + word[i] + word[i + 2 : ]
+        else:
+            word = word[ : i] + rng.choice(letters) + word[i : ]
+    return word
+
+def misspellings(index, num_words=1000, seed=8):
+    """Return [(misspelled word, number of errors, term of the word)] of @num_words random \
+words of the collection of at least 5 letters whose term is in at least lexicon.MIN_DF posts, \
+with 1 or 2 typing errors, misspelled to a word whose term is in fewer posts."""
+    rng = random.Random(seed)
+    words = sorted(word for (word, stem) in index.stemmer.table.items() \
+        if len(word) >= 5 and word.isalpha() and index.term_stats(stem) is not None and \
+        index.term_stats(stem)[0] >= lexicon.MIN_DF)
+    result = []
+    while len(result) < num_words:
+        word = rng.choice(words)
+        num_edits = 1 + len(result) % 2
+        misspelled = misspell(word, num_edits, rng)
+        terms = list(search.normalize(misspelled, index.stemmer, index.stopwords_set))
+        if len(terms) != 1 or search.MIN_WORD > len(terms[0]):
+            continue
+        stats = index.term_stats(terms[0])
+        if stats is None or stats[0] < lexicon.MIN_DF:
+            result.append((misspelled, num_edits, index.stemmer.table[word]))
+    return result
+
+def benchmark_spelling(num_scans=100):
+    """Compare the latency of the terms close to misspelled words found with the deletes and \
+by checking every term, check that they are the same, and report the latency and the \
+accuracy of the corrections of the words and of "did you mean" queries."""
+    index = search.Index()
+    segment = index.segments[0]
+    directory = segments.segment_dir(segments.MAIN)
+    words = misspellings(index)
+    print("Terms = " + str(len(segment.term_dict)) + " ; deletes.bin = " + \
+        str(os.path.getsize(directory + "/deletes.bin")) + " bytes (" + \
+        str(len(segment.deletes)) + " deletes) ; misspelled words = " + str(len(words)))
+    print("{:<9} {:>12} {:>12} {:>8} {:>11}".format("distance", "deletes us", "scan us", \
+        "same", "candidates"))
+    stems = [next(search.normalize(word, index.stemmer, index.stopwords_set)) \
+        for (word, num_edits, term) in words]
+    for max_distance in range(1, lexicon.MAX_DISTANCE + 1):
+        start = time.perf_counter()
+        found = [lexicon.fuzzy_terms(stem, max_distance, segment.term_dict, segment.deletes) \
+            for stem in stems]
+        deletes_time = (time.perf_counter() - start) / len(stems) * 1e6
+        start = time.perf_counter()
+        scanned = [lexicon.fuzzy_terms(stem, max_distance, segment.term_dict) \
+            for stem in stems[ : num_scans]]
+        scan_time = (time.perf_counter() - start) / num_scans * 1e6
+        print("{:<9} {:>12.1f} {:>12.1f} {:>8} {:>11.1f}".format(max_distance, deletes_time, \
+            scan_time, str(sum(a == b for a, b in zip(found, scanned))) + "/" + \
+            str(num_scans), sum(len(terms) for terms in found) / len(found)))
+
+    # the terms close to the words would be in the cache
+    index.posting_cache = cache.LRUCache(search.POSTING_CACHE_SIZE)
+    print("{:<9} {:>12} {:>12} {:>10}".format("errors", "correct us", "corrected", "right"))
+    for num_edits in (1, 2):
+        edit_words = [(stem, term) for (stem, (word, edits, term)) in zip(stems, words) \
+            if edits == num_edits]
+        start = time.perf_counter()
+        corrections = [index.correct(stem) for (stem, term) in edit_words]
+        seconds = time.perf_counter() - start
+        print("{:<9} {:>12.1f} {:>12} {:>10}".format(num_edits, seconds / len(edit_words) * 1e6, \
+            sum(correction is not None for correction in corrections), \
+            sum(correction == term for correction, (stem, term) in \
+            zip(corrections, edit_words))))
+
+    # queries of 3 words of a title, one of them misspelled
+    rng = random.Random(9)
+    queries = []
+    for (word, num_edits, term) in words[ : 200]:
+        title = index.get_field(rng.randrange(index.N), "title").split()
+        queries.append(" ".join(title[ : 2] + [word]))
+    index.posting_cache = cache.LRUCache(search.POSTING_CACHE_SIZE)
+    start = time.perf_counter()
+    for query in queries:
+        search.suggest(query, index)
+    seconds = time.perf_counter() - start
+    print("Did you mean: " + "{:.3f}".format(seconds / len(queries) * 1e3) + \
+        " ms/query (3 words, 1 misspelled)")
+
+def benchmark_stem():
+    """Compare the time to tokenize the collection (the longest stage of build_index.py) and \
+to normalize queries with the plain Porter stemmer and with the caching stemmer, and check \
+that they give the same terms."""
+    start = time.perf_counter()
+    (num_docs, plain) = build_index.add_tokens(stemmer=PorterStemmer())
+    plain_time = time.perf_counter() - start
+
+    stemmer = stem_cache.CachingStemmer()
+    start = time.perf_counter()
+    (num_docs, cached) = build_index.add_tokens(stemmer=stemmer)
+    cached_time = time.perf_counter() - start
+
+    print("Posts = " + str(num_docs) + " ; distinct words = " + str(len(stemmer.stems())))
+    print("build, plain   : {:.2f} s".format(plain_time))
+    print("build, cached  : {:.2f} s".format(cached_time))
+    print("Same posting lists: " + str(plain == cached))
+
+    index = search.Index()
+    queries = sample_queries(index)
+    stemmers = [("plain", PorterStemmer()), ("table", index.stemmer)]
+    results = []
+    for (name, stemmer) in stemmers:
+        start = time.perf_counter()
+        results.append([list(search.normalize(q, stemmer, index.stopwords_set)) \
+            for q in queries])
+        seconds = time.perf_counter() - start
+        print("query, {:<7} : {:.3f} ms/query".format(name, seconds / len(queries) * 1e3))
+    print("Same query terms: " + str(results[0] == results[1]))
+
+def normalize_nltk(string, stemmer, stopwords_set):
+    """Return the list of terms of @string computed with nltk, the way normalize used to."""
+    import nltk
+
+    # tokenize using punkt data
+    dummy_list = nltk.word_tokenize(string)
+
+    # remove stopwords
+    dummy_list = [word for word in dummy_list if word not in stopwords_set]
+
+    # split using special characters as delimiters
+    term_list = []
+    for word in dummy_list:
+        term_list += re.split(r"[^0-9A-Za-z]", word)
+
+    # stemming using Porter Stemmer
+    term_list = [stemmer.stem(word, 0, len(word) - 1) for word in term_list]
+
+    # remove empty terms
+    return [word for word in term_list if len(word) > 0]
+
+def check_tokenizer(stemmer=None, stopwords_set=None):
+    """Check that tokenizer.tokenize gives the tokens of nltk.word_tokenize holding letters \
+or digits (the others give no terms), and tokenizer.normalize the same terms, on every text \
+of TOKENIZER_CORPUS. Exit at the first difference."""
+    import nltk
+
+    if stemmer is None:
+        stemmer = stem_cache.CachingStemmer()
+    if stopwords_set is None:
+        stopwords_set = frozenset(search.stopwords.words("english"))
+    for text in TOKENIZER_CORPUS:
+        for (what, expected, actual) in [
+            ("tokens", [token for token in nltk.word_tokenize(text) \
+                if re.search(r"[^\W_]", token)], \
+                [token for token in tokenizer.tokenize(text) if re.search(r"[^\W_]", token)]),
+            ("terms", normalize_nltk(text, stemmer, stopwords_set), \
+                list(tokenizer.normalize(text, stemmer, stopwords_set))),
+        ]:
+            if actual != expected:
+                print("Error! Different " + what + " of " + repr(text) + ": nltk " + \
+                    str(expected) + " != regex " + str(actual))
+                sys.exit(1)
+    print("Same tokens as nltk: " + str(len(TOKENIZER_CORPUS)) + " texts")
+
+def benchmark_tokenize():
+    """Check that tokenizer.py gives the same tokens as the nltk tokenizer on the texts of \
+TOKENIZER_CORPUS and the same terms on every post, and compare their throughput."""
+    posts = [" ".join(fields) for (doc_id, fields) in build_index.read_posts()]
+    stopwords_set = frozenset(search.stopwords.words("english"))
+    # stemming is the same on both sides, leave it out of the measure
+    stemmer = stem_cache.CachingStemmer()
+    check_tokenizer(stemmer, stopwords_set)
+
+    start = time.perf_counter()
+    expected = [normalize_nltk(text, stemmer, stopwords_set) for text in posts]
+    nltk_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = [list(tokenizer.normalize(text, stemmer, stopwords_set)) for text in posts]
+    regex_time = time.perf_counter() - start
+
+    num_terms = sum(len(term_list) for term_list in expected)
+    different = [doc_id for doc_id, (a, b) in enumerate(zip(expected, actual)) if a != b]
+    print("Posts = " + str(len(posts)) + " ; terms = " + str(num_terms))
+    print("nltk  : {:>10.0f} terms/s".format(num_terms / nltk_time))
+    print("regex : {:>10.0f} terms/s".format(num_terms / regex_time))
+    print("Posts with different terms: " + str(len(different)) + " / " + str(len(posts)))
+    for doc_id in different[:10]:
+        print("doc_id " + str(doc_id) + ": nltk " + str(expected[doc_id][:20]) + \
+            " != regex " + str(actual[doc_id][:20]))
+
+def benchmark_cache(num_queries=5000, k=10):
+    """Compare the latency of a stream of repeated queries (Zipf distributed over 500 \
+distinct queries) without caches, with the posting list cache and with both caches."""
+    index = search.Index()
+    distinct = sample_queries(index)
+    rng = random.Random(1)
+    weights = [1 / rank for rank in range(1, len(distinct) + 1)]
+    queries = rng.choices(distinct, weights, k=num_queries)
+
+    setups = [
+        ("none", 0, 0),
+        ("postings", search.POSTING_CACHE_SIZE, 0),
+        ("both", search.POSTING_CACHE_SIZE, search.RESULT_CACHE_SIZE),
+    ]
+    results = []
+    print("Queries = " + str(num_queries) + " ; distinct = " + str(len(set(queries))))
+    print("{:<9} {:>10} {:>13} {:>13}".format("caches", "ms/query", "posting hits", \
+        "result hits"))
+    for (name, posting_size, result_size) in setups:
+        index.posting_cache = cache.LRUCache(posting_size)
+        index.result_cache = cache.LRUCache(result_size, search.RESULT_CACHE_TTL)
+        start = time.perf_counter()
+        results.append([search.search(q, k, index) for q in queries])
+        seconds = time.perf_counter() - start
+        print("{:<9} {:>10.3f} {:>12.0%} {:>12.0%}".format(name, \
+            seconds / num_queries * 1e3, hit_rate(index.posting_cache), \
+            hit_rate(index.result_cache)))
+    print("Same results: " + str(results[0] == results[1] == results[2]))
+
+def hit_rate(lru_cache):
+    """Return the fraction of the lookups in @lru_cache that were hits."""
+    lookups = lru_cache.hits + lru_cache.misses
+    return lru_cache.hits / lookups if lookups > 0 else 0.0
+
+def benchmark_vector(k=10):
+    """Compare the latency of the pure Python and the NumPy exact scorers on multi-term \
+queries, with their posting lists already in memory, and check that they return the same \
+documents."""
+    if not vector_scoring.available():
+        print("Error! NumPy is not installed")
+        sys.exit(1)
+    index = search.Index()
+    queries = [prepare_query(q, index) for q in sample_queries(index)]
+    queries = [(w, p) for (w, p) in queries if len(w) > 1]
+
+    start = time.perf_counter()
+    python = []
+    for (weight_query, posting_list) in queries:
+        cosine_score = search.calc_cosine_scores(weight_query, posting_list, index.doc_norms)
+        python.append(search.get_top_k(cosine_score, k, index.frac_inlinks))
+    python_time = time.perf_counter() - start
+
+    # 1st pass converts the posting lists to arrays, 2nd pass finds them in the cache
+    scorer = vector_scoring.VectorScorer(index)
+    times = []
+    for run in range(2):
+        start = time.perf_counter()
+        vector = []
+        for (weight_query, posting_list) in queries:
+            vector.append(scorer.top_k(weight_query, posting_list, k))
+        times.append(time.perf_counter() - start)
+
+    same_scores = sum([score for (doc_id, score) in a] == [score for (doc_id, score) in b] \
+        for (a, b) in zip(python, vector))
+    same_docs = sum(sorted(a) == sorted(b) for (a, b) in zip(python, vector))
+    num_postings = sum(len(p[term][1]) for (w, p) in queries for term in w)
+    print("Queries = " + str(len(queries)) + " ; k = " + str(k) + " ; N = " + str(index.N) + \
+        " ; postings/query = " + str(num_postings // len(queries)))
+    print("python        : {:.3f} ms/query".format(python_time / len(queries) * 1e3))
+    print("numpy         : {:.3f} ms/query".format(times[0] / len(queries) * 1e3))
+    print("numpy, cached : {:.3f} ms/query".format(times[1] / len(queries) * 1e3))
+    print("Same top k scores: " + str(same_scores) + " / " + str(len(queries)) + \
+        " ; same documents: " + str(same_docs) + " / " + str(len(queries)))
+
+def benchmark_ranking(k=10):
+    """Compare the latency of the rankings of rankings.py on multi-term queries, with their \
+posting lists already in memory, with the NumPy scorer (if installed) and in pure Python."""
+    index = search.Index()
+    queries = [search.query_terms(q, index) for q in sample_queries(index)]
+    queries = [query_freq for query_freq in queries if len(query_freq) > 1]
+    posting_lists = [index.get_posting_lists(query_freq.keys()) for query_freq in queries]
+    for query_freq in queries:
+        index.get_field_tfs(query_freq.keys())
+
+    backends = [("python", None)]
+    if index.vector_scorer is not None:
+        backends.insert(0, ("numpy", index.vector_scorer))
+    print("Queries = " + str(len(queries)) + " ; k = " + str(k))
+    print("{:<8} {:>14} {:>14}".format("ranking", *(name + " ms/query" for (name, scorer) \
+        in backends)))
+    for name in sorted(rankings.RANKINGS.keys()):
+        ranking = rankings.make_ranking(name)
+        times = []
+        for (backend, scorer) in backends:
+            index.vector_scorer = scorer
+            # 1st pass fills the caches of the scorer
+            for run in range(2):
+                start = time.perf_counter()
+                for query_freq, posting_list in zip(queries, posting_lists):
+                    search.rank(query_freq, posting_list, k, index, ranking=ranking)
+                seconds = time.perf_counter() - start
+            times.append(seconds / len(queries) * 1e3)
+        print("{:<8} {:>14.3f} {:>14.3f}".format(name, *times))
+
+def positional_queries(index, num_queries=200, seed=2):
+    """Return @num_queries phrase queries ("2 or 3 consecutive words of a title") and as many \
+NEAR queries (word NEAR/5 word, words 1 to 5 apart in a title), from titles of random posts."""
+    rng = random.Random(seed)
+    phrases = []
+    nears = []
+    while len(phrases) < num_queries or len(nears) < num_queries:
+        words = index.get_field(rng.randrange(index.N), "title").split()
+        if len(words) < 3:
+            continue
+        start = rng.randrange(len(words) - 2)
+        phrase = '"' + " ".join(words[start : start + rng.choice((2, 3))]) + '"'
+        if len(phrases) < num_queries and \
+            len(positional_constraints(search.parse_query(phrase, index)[1])) > 0:
+            phrases.append(phrase)
+        end = min(len(words) - 1, start + rng.randrange(1, 6))
+        near = words[start] + " NEAR/5 " + words[end]
+        if len(nears) < num_queries and any(constraint[0] == "near" \
+            for constraint in positional_constraints(search.parse_query(near, index)[1])):
+            nears.append(near)
+    return (phrases, nears)
+
+def positional_constraints(node):
+    """Return the phrases and NEAR operators required by the boolean query @node (see \
+search.parse_query) as ("phrase", terms) and ("near", term, term, k) constraints."""
+    if node is None:
+        return []
+    if node[0] == "phrase":
+        return [node] if len(node[1]) > 1 else []
+    if node[0] == "near":
+        (near, left, right, k) = node
+        term = left[1] if left[0] == "term" else left[1][-1]
+        other_term = right[1] if right[0] == "term" else right[1][0]
+        return positional_constraints(left) + positional_constraints(right) + \
+            [("near", term, other_term, k)]
+    if node[0] == "group":
+        return [constraint for clause in node[1] for constraint in positional_constraints(clause)]
+    return []
+
+def expected_matches(constraints, candidates, posts, index):
+    """Return the set of the posts of @candidates (containing every term of @constraints) \
+satisfying @constraints, checked on the positions of the terms in the text @posts of the \
+posts, { doc_id: fields }."""
+    matches = set()
+    for doc_id in candidates:
+        posting_list = {}
+        build_index.add_post(posting_list, doc_id, posts[doc_id], index.stemmer, \
+            index.stopwords_set, positions=True)
+        positions = dict((term, set(entry[2][doc_id])) for term, entry in posting_list.items())
+        matched = True
+        for constraint in constraints:
+            if constraint[0] == "phrase":
+                terms = constraint[1]
+                matched &= any(all(start + i in positions[term] for i, term in enumerate(terms)) \
+                    for start in positions[terms[0]])
+            else:
+                (near, term, other_term, k) = constraint
+                matched &= any(0 < abs(a - b) <= k for a in positions[term] \
+                    for b in positions[other_term])
+        if matched:
+            matches.add(doc_id)
+    return matches
+
+def benchmark_positions(k=10):
+    """Report the size of the positions records of an index built with --positions, compare \
+the latency of phrase and NEAR queries with the same words as a plain query, and check the \
+posts they match against the positions of the words in the text of the posts."""
+    index = search.Index()
+    if not index.positions:
+        print("Error! Build the index with build_index.py --positions")
+        sys.exit(1)
+    postings_size = 0
+    positions_size = 0
+    for segment in index.segments:
+        for (df, offset, length, max_weight, field_length, position_length, impact_length) \
+            in segment.term_dict.values():
+            postings_size += length + field_length
+            positions_size += position_length
+    print("postings + fields : {:>10} bytes".format(postings_size))
+    print("positions         : {:>10} bytes (+{:.0%})".format(positions_size, \
+        positions_size / postings_size))
+
+    # the result cache would answer the repeated queries
+    index.result_cache = cache.LRUCache(0)
+    (phrases, nears) = positional_queries(index)
+    print("Queries = " + str(len(phrases)) + " phrases, " + str(len(nears)) + " NEAR/5 ; k = " + \
+        str(k))
+    for (name, queries) in (("phrase", phrases), ("near", nears)):
+        plain = [query.replace('"', "").replace(" NEAR/5 ", " ") for query in queries]
+        for (label, query_list) in ((name, queries), ("words", plain)):
+            # 1st pass reads the posting lists and positions, 2nd pass finds them in the cache
+            times = []
+            for run in range(2):
+                start = time.perf_counter()
+                for query in query_list:
+                    search.search(query, k, index)
+                times.append((time.perf_counter() - start) / len(query_list) * 1e3)
+            print("{:<6} {:<6}: {:.3f} ms/query, cached {:.3f} ms/query".format(name, label, \
+                *times))
+
+    posts = dict(build_index.read_posts())
+    same = 0
+    num_candidates = 0
+    num_matches = 0
+    for query in phrases + nears:
+        (query_freq, query_node) = search.parse_query(query, index)
+        posting_list = index.get_posting_lists(query_freq.keys())
+        matches = set(search.match_query(query_node, posting_list, index))
+        constraints = positional_constraints(query_node)
+        terms = set(term for c in constraints \
+            for term in (c[1] if c[0] == "phrase" else c[1 : 3]))
+        candidates = []
+        if all(term in posting_list for term in terms):
+            candidates = search.intersect([posting_list[term][1] for term in terms])
+        num_candidates += len(candidates)
+        num_matches += len(matches)
+        same += matches == expected_matches(constraints, candidates, posts, index)
+    print("Posts with all the words: {:.1f}/query ; matching: {:.1f}/query".format( \
+        num_candidates / len(phrases + nears), num_matches / len(phrases + nears)))
+    print("Same matches as the text: " + str(same) + " / " + str(len(phrases + nears)))
+    check_near_operands(index, k)
+
+def check_near_operands(index, k=10):
+    """Check that a NEAR/k operator next to a wildcard or a fuzzy word, on either side, is \
+ignored like next to a group: same query and results as without the operator. Exit if not."""
+    terms = [term for (term, entry) in sorted(index.segments[0].term_dict.items(), \
+        key=lambda item: -item[1][0]) if len(term) >= 4 and term.isalpha()][ : 2]
+    queries = []
+    for operand in (terms[1][ : 3] + "*", terms[1] + "~"):
+        queries.extend([terms[0] + " NEAR/3 " + operand, operand + " NEAR/3 " + terms[0]])
+    for query in queries:
+        plain = query.replace(" NEAR/3 ", " ")
+        if search.parse_query(query, index) != search.parse_query(plain, index) or \
+            search.search(query, k, index) != search.search(plain, k, index):
+            print("Error! NEAR next to a wildcard or a fuzzy word is not ignored: " + query)
+            sys.exit(1)
+    print("NEAR next to wildcards and fuzzy words: " + str(len(queries)) + " queries ok")
+
+def boolean_queries(index, num_queries=200, seed=3):
+    """Return @num_queries lists of 2 to 4 words of the titles of random posts, each word \
+normalized to a different indexed term."""
+    rng = random.Random(seed)
+    queries = []
+    while len(queries) < num_queries:
+        # type(words) == { term: word }
+        words = {}
+        for word in index.get_field(rng.randrange(index.N), "title").split():
+            if re.fullmatch(r"\w+", word) is None or word in search.OPERATORS:
+                continue
+            terms = list(search.normalize(word, index.stemmer, index.stopwords_set))
+            if len(terms) == 1 and terms[0] not in words and \
+                index.term_stats(terms[0]) is not None:
+                words[terms[0]] = word
+        if len(words) >= 2:
+            queries.append(rng.sample(list(words.values()), min(len(words), rng.randint(2, 4))))
+    return queries
+
+def expected_top_k(query_freq, posting_list, k, index, matches):
+    """Return the scores of the top @k documents of the set @matches for @query_freq, all the \
+postings of its terms scored as for a query without operators."""
+    ranking = rankings.Cosine()
+    weight_query = ranking.query_weights(query_freq, posting_list, index)
+    posting_weights = dict((term, ranking.posting_weights(term, posting_list[term], None, \
+        index)) for term in weight_query)
+    score = search.calc_scores(weight_query, posting_list, posting_weights)
+    score = dict((doc_id, value) for doc_id, value in score.items() if doc_id in matches)
+    return [round(value, 12) for (doc_id, value) in search.get_top_k(score, k, \
+        index.frac_inlinks)]
+
+def benchmark_boolean(k=10):
+    """Compare the latency of conjunctive queries (AND, and +word -word) with the same words as \
+a plain query and with their rarest word alone, posting lists in the cache, with the NumPy \
+scorer (if installed) and in pure Python, and check their matches and scores against set \
+operations on the posting lists."""
+    index = search.Index()
+    # the result cache would answer the repeated queries
+    index.result_cache = cache.LRUCache(0)
+    queries = boolean_queries(index)
+    forms = [
+        ("words", " ".join),
+        ("and", " AND ".join),
+        ("+ -", lambda words: " ".join(["+" + word for word in words[ : -1]] + \
+            ["-" + words[-1]])),
+        ("rarest", lambda words: min(words, key=lambda word: index.term_stats( \
+            next(search.normalize(word, index.stemmer, index.stopwords_set)))[0])),
+    ]
+    num_postings = 0
+    num_rarest = 0
+    for words in queries:
+        dfs = [index.term_stats(term)[0] for term in search.query_terms(" ".join(words), index)]
+        num_postings += sum(dfs)
+        num_rarest += min(dfs)
+    print("Queries = " + str(len(queries)) + " ; k = " + str(k) + " ; postings/query = " + \
+        str(num_postings // len(queries)) + " ; rarest term = " + \
+        str(num_rarest // len(queries)) + " postings/query")
+    backends = [("python", None)]
+    if index.vector_scorer is not None:
+        backends.insert(0, ("numpy", index.vector_scorer))
+    print("{:<8} {:>14} {:>14}".format("query", *(name + " ms/query" for (name, scorer) \
+        in backends)))
+    for (name, form) in forms:
+        query_list = [form(words) for words in queries]
+        times = []
+        for (backend, scorer) in backends:
+            index.vector_scorer = scorer
+            # 1st pass reads the posting lists, 2nd pass finds them in the cache
+            for run in range(2):
+                start = time.perf_counter()
+                for query in query_list:
+                    search.search(query, k, index)
+                seconds = time.perf_counter() - start
+            times.append(seconds / len(query_list) * 1e3)
+        print("{:<8} {:>14.3f} {:>14.3f}".format(name, *times))
+    index.vector_scorer = backends[0][1]
+
+    same_matches = 0
+    same_scores = 0
+    num_matches = 0
+    for words in queries:
+        terms = list(search.query_terms(" ".join(words), index))
+        posting_list = index.get_posting_lists(terms)
+        doc_ids = [set(posting_list[term][1]) for term in terms]
+        expected = [set.intersection(*doc_ids), set.intersection(*doc_ids[ : -1]) - doc_ids[-1]]
+        for (name, form), expected_matches in zip(forms[1 : 3], expected):
+            (query_freq, query) = search.parse_query(form(words), index)
+            matches = search.match_query(query, posting_list, index)
+            num_matches += len(matches)
+            same_matches += set(matches) == expected_matches
+            result = search.rank(query_freq, posting_list, k, index, matches=matches)
+            same_scores += [round(score, 12) for (doc_id, score, title, url) in result] == \
+                expected_top_k(query_freq, posting_list, k, index, expected_matches)
+    print("Matches: {:.1f}/query".format(num_matches / len(queries) / 2))
+    print("Same matches as set operations: " + str(same_matches) + " / " + \
+        str(2 * len(queries)) + " ; same top k scores: " + str(same_scores) + " / " + \
+        str(2 * len(queries)))
+
+def sample_filters(index):
+    """Return [(name, DocFilter)] of filters of decreasing selectivity over the posts of \
+@index, without the category (author) filter if no post has a category (an author)."""
+    filter_index = index.filter_indexes[0]
+    # the author and the category with the most posts
+    value_filters = {}
+    for field in ("category", "author"):
+        (values, doc_ids) = filter_index.value_lists[field]
+        if len(values) > 0:
+            value = max(values, key=lambda value: values[value][1] - values[value][0])
+            value_filters[field] = doc_filters.make_filter({field: value})
+    return [
+        ("none", doc_filters.DocFilter()),
+        ("1 month", doc_filters.make_filter({"from": "2006-06-01", "to": "2006-06-30"})),
+    ] + [(field, value_filters[field]) for field in ("category", "author") \
+        if field in value_filters] + [
+        ("comments", doc_filters.make_filter({"min_comments": 10})),
+        ("1 year", doc_filters.make_filter({"from": "2006-01-01", "to": "2006-12-31"})),
+    ]
+
+def benchmark_filters(k=10):
+    """Compare the latency of queries with metadata filters applied to the candidates before \
+scoring and applied to the results of the query scored over all posts, posting lists in the \
+cache, and check that both return the same documents."""
+    index = search.Index()
+    # the result cache would answer the repeated queries
+    index.result_cache = cache.LRUCache(0)
+    # titles without operators, the plain query scored over all posts is the same query
+    queries = [query for query in sample_queries(index, 200) \
+        if len(search.query_terms(query, index)) > 1 and \
+        search.parse_query(query, index)[1] is None]
+    for query in queries:
+        search.search(query, k, index)
+    print("Queries = " + str(len(queries)) + " ; k = " + str(k) + " ; N = " + str(index.N))
+    print("{:<9} {:>7} {:>16} {:>16}".format("filter", "posts", "filtered ms/q", \
+        "after ms/q"))
+    for (name, doc_filter) in sample_filters(index):
+        # every post for the empty filter
+        keep = index.filter_doc_ids(doc_filter)
+        keep = set(range(index.N)) if keep is None else set(keep)
+        start = time.perf_counter()
+        filtered = [search.search(query, k, index, doc_filter=doc_filter) for query in queries]
+        filtered_time = time.perf_counter() - start
+
+        # every matching post scored and ranked, the filter applied to the ranked list
+        start = time.perf_counter()
+        after = []
+        for query in queries:
+            (weight_query, posting_list) = prepare_query(query, index)
+            if index.vector_scorer is not None:
+                ranked = index.vector_scorer.top_k(weight_query, posting_list, index.N)
+            else:
+                cosine_score = search.calc_cosine_scores(weight_query, posting_list, \
+                    index.doc_norms)
+                ranked = search.get_top_k(cosine_score, index.N, index.frac_inlinks)
+            after.append([result for result in ranked if result[0] in keep][ : k])
+        after_time = time.perf_counter() - start
+
+        same = sum([round(result[1], 12) for result in a] == \
+            [round(result[1], 12) for result in b] for (a, b) in zip(filtered, after))
+        print("{:<9} {:>7} {:>16.3f} {:>16.3f}   same: {} / {}".format(name, len(keep), \
+            filtered_time / len(queries) * 1e3, after_time / len(queries) * 1e3, same, \
+            len(queries)))
+
+def benchmark_shards(k=10):
+    """Compare the latency of title queries answered by the unsharded index and by the \
+local workers of the sharded index (build_index.py --shards=N), every query answered once \
+with empty caches, and check that both return the same documents with the same scores."""
+    index = search.Index()
+    shard_list = shards.read_shard_list()
+    queries = sample_queries(index, 300)
+    print("Queries = " + str(len(queries)) + " ; k = " + str(k) + " ; N = " + str(index.N) + \
+        " ; shards = " + str(len(shard_list)))
+    print("{:<8} {:>10} {:>10}   {}".format("ranking", "index ms/q", "shards ms/q", "same"))
+    coordinator = search.Coordinator()
+    try:
+        for ranking in (rankings.Cosine(), rankings.BM25(), rankings.BM25F()):
+            start = time.perf_counter()
+            unsharded = [search.search(query, k, index, ranking=ranking) for query in queries]
+            index_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            sharded = [coordinator.search(query, k, ranking=ranking) for query in queries]
+            shards_time = time.perf_counter() - start
+
+            same = sum([result[ : 2] for result in a] == [result[ : 2] for result in b] \
+                for (a, b) in zip(unsharded, sharded))
+            print("{:<8} {:>10.3f} {:>10.3f}   {} / {}".format(ranking.name, \
+                index_time / len(queries) * 1e3, shards_time / len(queries) * 1e3, same, \
+                len(queries)))
+    finally:
+        coordinator.close()
+
+def burst_threads(queries, k, threads):
+    """Answer @queries all at once with search.search in a pool of @threads threads, like \
+search_server.py, on an index with empty caches, return (results, latency of every query)."""
+    index = search.Index()
+    start = time.perf_counter()
+
+    def answer(query):
+        result = search.search(query, k, index)
+        return (result, time.perf_counter() - start)
+
+    with ThreadPoolExecutor(threads) as executor:
+        answers = list(executor.map(answer, queries))
+    return ([result for (result, latency) in answers], [latency for (result, latency) in answers])
+
+def burst_async(queries, k, threads, timeout=None):
+    """Answer @queries all at once with an async_server.QueryService of @threads threads on an \
+index with empty caches, with a deadline @timeout seconds after their arrival, return \
+(results, complete flags, latency of every query, service)."""
+    service = async_server.QueryService(search.Index(), threads)
+    start = time.perf_counter()
+
+    async def answer(query):
+        (result, complete) = await service.search(query, k, timeout=timeout)
+        return (result, complete, time.perf_counter() - start)
+
+    async def answer_all():
+        return await asyncio.gather(*[answer(query) for query in queries])
+
+    answers = asyncio.run(answer_all())
+    service.close()
+    return ([answer[0] for answer in answers], [answer[1] for answer in answers], \
+        [answer[2] for answer in answers], service)
+
+def benchmark_async(k=10, threads=8):
+    """Compare the latency of a burst of queries arriving at once, many of them repeated, \
+answered by a pool of threads like search_server.py and by the asyncio QueryService of \
+async_server.py (posting lists read concurrently, identical queries coalesced), both with \
+empty caches, and report how many queries are answered in full within a deadline."""
+    index = search.Index()
+    rng = random.Random(4)
+    titles = sample_queries(index, 100)
+    queries = [rng.choice(titles) for i in range(400)]
+    print("Queries = " + str(len(queries)) + " (" + str(len(set(queries))) + " distinct) ; k = " + \
+        str(k) + " ; threads = " + str(threads))
+
+    (expected, latencies) = burst_threads(queries, k, threads)
+    print("{:<16} {:>10} {:>12} {:>10}".format("front-end", "burst ms", "mean ms/q", \
+        "coalesced"))
+    print("{:<16} {:>10.1f} {:>12.1f} {:>10}".format("threads", max(latencies) * 1e3, \
+        sum(latencies) / len(latencies) * 1e3, "-"))
+    (results, complete, latencies, service) = burst_async(queries, k, threads)
+    same = sum([result[ : 2] for result in a] == [result[ : 2] for result in b] \
+        for (a, b) in zip(expected, results))
+    print("{:<16} {:>10.1f} {:>12.1f} {:>10}   same: {} / {}".format("asyncio", \
+        max(latencies) * 1e3, sum(latencies) / len(latencies) * 1e3, service.coalesced, same, \
+        len(queries)))
+
+    print("{:<16} {:>10} {:>12} {:>10} {:>10}".format("deadline", "complete", "partial", \
+        "empty", "burst ms"))
+    for timeout in (0.1, 0.02, 0.005):
+        (results, complete, latencies, service) = burst_async(queries, k, threads, timeout)
+        partial = sum(1 for (result, full) in zip(results, complete) if not full and result)
+        print("{:<16} {:>10} {:>12} {:>10} {:>10.1f}".format(str(int(timeout * 1e3)) + " ms", \
+            sum(complete), partial, len(queries) - sum(complete) - partial, \
+            max(latencies) * 1e3))
+
+def main():
+    benchmarks = {
+        "async": benchmark_async,
+        "boolean": benchmark_boolean,
+        "cache": benchmark_cache,
+        "codec": benchmark_codec,
+        "filters": benchmark_filters,
+        "impact": benchmark_impact,
+        "lexicon": benchmark_lexicon,
+        "wildcard": benchmark_wildcard,
+        "spelling": benchmark_spelling,
+        "positions": benchmark_positions,
+        "ranking": benchmark_ranking,
+        "shards": benchmark_shards,
+        "stem": benchmark_stem,
+        "tokenize": benchmark_tokenize,
+        "parity": check_tokenizer,
+        "topk": benchmark_topk,
+        "vector": benchmark_vector,
+    }
+    if len(sys.argv) != 2 or sys.argv[1] not in benchmarks:
+        print("Usage: ./benchmark.py " + "|".join(sorted(benchmarks.keys())))
+        sys.exit(1)
+    benchmarks[sys.argv[1]]()
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,42 @@
 #!/usr/bin/python3
 
 import time
+import sys
+import math
 import re
 import html
-import nltk
+import io
+import os
+import subprocess
+import heapq
+import itertools
+import operator
+import shutil
+import tempfile
+import multiprocessing
 from nltk.corpus import stopwords
-from porterstemmer import PorterStemmer
-from collections import OrderedDict
+import postings
+import lexicon
+import doc_stats
+import doc_store
+import doc_filters
+import segments
+import shards
+import stem_cache
+import tokenizer
+
+# number of posts indexed by a worker process at a time in a parallel build
+CHUNK_SIZE = 2000
+
+# approximate memory used by the in memory posting list of a SPIMI build, in bytes, for
+# every new term (key string + [df, {}] value) and for every new posting (dict entry + list
+# of the tfs per field) and for every position of a term in a post when positions are recorded
+TERM_BYTES = 250
+POSTING_BYTES = 130
+POSITION_BYTES = 36
+
+# number of segments (main index + delta segments) above which an update starts a merge
+MAX_SEGMENTS = 4
 
 def parse_backward(line, next_delimiter, delimiter=","):
     """Return the column text and its left delimiter by reading the delimiter from the end of line."""
@@ -22,186 +52,144 @@ def parse_forward(line, prev_delimiter, delimiter=","):
     elem = line[elem_start : elem_end].strip()
     return (elem, elem_end)
 
-def write_to_file(filename, listname):
-    """Write each element of the list to a single line in the file."""
-    with open(filename, mode="w", encoding="utf-8") as f:
-        for elem in listname:
-            f.write(elem + "\n")
+def clean_line(line):
+    """Return @line with all SGML special characters removed / converted to utf-8."""
+    line = re.sub(r"and[A-Za-z]+?;", "", line)
+    line = re.sub(r"and#([0-9]{0,4})?;", "", line)
+    return html.unescape(line)
 
 def parse_html_entities():
-    """Remove / convert to utf-8 all SGML special characters."""
+    """Remove / convert to utf-8 all SGML special characters, one line at a time."""
     raw_file = "TUAW-dataset/data/posts.csv"
-    decode = ""
+    decoded_file = "TUAW-dataset/data/clean_posts.csv"
     print("Parsing HTML entities...", end=" ")
 
+    # the entities never span two lines
+    with open(raw_file, "r", encoding="latin-1") as f, \
+        open(decoded_file, mode="w", encoding="utf-8") as decoded_fd:
+        for line in f:
+            decoded_fd.write(clean_line(line))
+
+    print("Done")
+
+def read_clean_lines(raw_file):
+    """Yield the lines of @raw_file cleaned with clean_line, split exactly like the lines read \
+back from clean_posts.csv."""
     with open(raw_file, "r", encoding="latin-1") as f:
-        s = f.read()
-        s = re.sub(r"and[A-Za-z]+?;", "", s)
-        s = re.sub(r"and#([0-9]{0,4})?;", "", s)
-        decode = html.unescape(s)
+        for line in f:
+            # an entity can decode to a line break
+            for clean in io.StringIO(clean_line(line), newline=None):
+                yield clean
 
-    decoded_file = "TUAW-dataset/data/clean_posts.csv"
+# columns of posts.csv, in order, and the file each one is split to
+# to retrieve i-th post, read i-th line of each file
+COLUMNS = ["title", "date", "author", "category", "post_text", "post_length", "num_outlinks", \
+    "num_inlinks", "num_comments", "comments_url", "post_url"]
+COLUMN_FILES = ["TUAW-dataset/data/" + column + ".txt" for column in COLUMNS]
 
-    with open(decoded_file, mode="w", encoding="utf-8") as f:
-        f.write(decode)
+month_pattern = re.compile("Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec")
 
-    print("Done")
+def parse_line(line):
+    """Return the list of the columns (in the order of COLUMNS) of the post @line of \
+clean_posts.csv."""
 
-def parse_csv():
-    """Separate each column to its own file, one line per post."""
+    # search for start of date
+    date_start = month_pattern.search(line).start()
+    
+    # end - start = length of column
+    # column = line[start, end)
 
-    # input file
-    data_file = "TUAW-dataset/data/clean_posts.csv"
+    # add title
+    title_start = 0
+    title_end = date_start - 1
+    title = line[title_start : title_end].strip()
+    
+    # search for next comma = end of date
+    prev_comma = date_start - 1
+    (date, prev_comma) = parse_forward(line, prev_comma)
+    
+    # search for next comma = end of author
+    (author, prev_comma) = parse_forward(line, prev_comma)
 
-    # 1 output file per attribute
-    # to retrieve i-th post, read i-th line of each file
-    title_file = "TUAW-dataset/data/title.txt"
-    date_file = "TUAW-dataset/data/date.txt"
-    author_file = "TUAW-dataset/data/author.txt"
-    category_file = "TUAW-dataset/data/category.txt"
-    post_text_file = "TUAW-dataset/data/post_text.txt"
-    post_length_file = "TUAW-dataset/data/post_length.txt"
-    num_inlinks_file = "TUAW-dataset/data/num_inlinks.txt"
-    num_outlinks_file = "TUAW-dataset/data/num_outlinks.txt"
-    num_comments_file = "TUAW-dataset/data/num_comments.txt"
-    comments_url_file = "TUAW-dataset/data/comments_url.txt"
+    # search for next comma = end of category
+    (category, prev_comma) = parse_forward(line, prev_comma)
+
+    post_text_start = prev_comma + 1        
+    # posts can contain comma, so parse columns from end
+    
+    # reverse search first comma = start of post_url
+    next_comma = len(line) - 2 # end of line == ",\n" (checked)
+    (post_url, next_comma) = parse_backward(line, next_comma)
+    
+    # reverse search first comma = start of comments_url
+    (comments_url, next_comma) = parse_backward(line, next_comma)
+    
+    # url assertion checked
     # assert(comments_url_file[i] == post_url_file[i] + "#comments") == True) (checked)
-    post_url_file = "TUAW-dataset/data/post_url.txt"
+    
+    # reverse search first comma = start of num_comments
+    (num_comments, next_comma) = parse_backward(line, next_comma)
+    
+    # reverse search first comma = start of num_inlinks
+    (num_inlinks, next_comma) = parse_backward(line, next_comma)
+    
+    # reverse search first comma = start of num_outlinks
+    (num_outlinks, next_comma) = parse_backward(line, next_comma)
+    
+    # reverse search first comma = start of post_length
+    (post_length, next_comma) = parse_backward(line, next_comma)
+    
+    # remaining is post_text
+    post_text_end = next_comma
+    post_text = line[post_text_start : post_text_end]
+
+    return [title, date, author, category, post_text, post_length, num_outlinks, num_inlinks, \
+        num_comments, comments_url, post_url]
 
-    month_pattern = re.compile("Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec")
+def parse_csv():
+    """Separate each column to its own file, one line per post."""
 
-    print("Parsing the columns...")
+    # input file
+    data_file = "TUAW-dataset/data/clean_posts.csv"
 
-    title_list = []
-    date_list = []
-    author_list = []
-    category_list = []
-    post_text_list = []
-    post_length_list = []
-    num_inlinks_list = []
-    num_outlinks_list = []
-    num_comments_list = []
-    comments_url_list = []
-    post_url_list = []
+    print("Parsing the columns...", end=" ")
 
+    # write every column of a line as soon as it is parsed
+    column_fds = [open(filename, mode="w", encoding="utf-8") for filename in COLUMN_FILES]
     with open(data_file, encoding="utf-8") as f:
-        line_num = 0
         for line in f:
-            line_num = line_num + 1
-            
-            # search for start of date
-            date_start = month_pattern.search(line).start()
-            
-            # end - start = length of column
-            # column = line[start, end)
-
-            # add title
-            title_start = 0
-            title_end = date_start - 1
-            title = line[title_start : title_end].strip()
-            title_list.append(title)
-            
-            # search for next comma = end of date
-            prev_comma = date_start - 1
-            (date, prev_comma) = parse_forward(line, prev_comma)
-            date_list.append(date)
-            
-            # search for next comma = end of author
-            (author, prev_comma) = parse_forward(line, prev_comma)
-            author_list.append(author)
-
-            # search for next comma = end of category
-            (category, prev_comma) = parse_forward(line, prev_comma)
-            category_list.append(category)
-
-            post_text_start = prev_comma + 1        
-            # posts can contain comma, so parse columns from end
-            
-            # reverse search first comma = start of post_url
-            next_comma = len(line) - 2 # end of line == ",\n" (checked)
-            (post_url, next_comma) = parse_backward(line, next_comma)
-            post_url_list.append(post_url)
-            
-            # reverse search first comma = start of comments_url
-            (comments_url, next_comma) = parse_backward(line, next_comma)
-            comments_url_list.append(comments_url)
-            
-            # url assertion checked
-            
-            # reverse search first comma = start of num_comments
-            (num_comments, next_comma) = parse_backward(line, next_comma)
-            num_comments_list.append(num_comments)
-            
-            # reverse search first comma = start of num_inlinks
-            (num_inlinks, next_comma) = parse_backward(line, next_comma)
-            num_inlinks_list.append(num_inlinks)
-            
-            # reverse search first comma = start of num_outlinks
-            (num_outlinks, next_comma) = parse_backward(line, next_comma)
-            num_outlinks_list.append(num_outlinks)
-            
-            # reverse search first comma = start of post_length
-            (post_length, next_comma) = parse_backward(line, next_comma)
-            post_length_list.append(post_length)
-            
-            # remaining is post_text
-            post_text_end = next_comma
-            post_text = line[post_text_start : post_text_end]
-            post_text_list.append(post_text)
-
-    # end processing of file
-
-    # write output`
-    write_to_file(title_file, title_list)
-    print("Finished parsing column title")
-    write_to_file(date_file, date_list)
-    print("Finished parsing column date")
-    write_to_file(author_file, author_list)
-    print("Finished parsing column author")
-    write_to_file(category_file, category_list)
-    print("Finished parsing column category")
-    write_to_file(post_url_file, post_url_list)
-    print("Finished parsing column post_url")
-    write_to_file(comments_url_file, comments_url_list)
-    print("Finished parsing column comments_url")
-    write_to_file(num_comments_file, num_comments_list)
-    print("Finished parsing column num_comments")
-    write_to_file(num_outlinks_file, num_outlinks_list)
-    print("Finished parsing column num_inlinks")
-    write_to_file(num_inlinks_file, num_inlinks_list)
-    print("Finished parsing column num_outlinks")
-    write_to_file(post_length_file, post_length_list)
-    print("Finished parsing column post_length")
-    write_to_file(post_text_file, post_text_list)
-    print("Finished parsing column post_text")
-
-def normalize(string, stemmer, stopwords_set):
-	"""Return a list containg non-empty terms from @string after normalization using 
-@stopwords_set and @stemmer."""
-
-	# tokenize using punkt data
-	dummy_list = nltk.word_tokenize(string)
+            for column_fd, value in zip(column_fds, parse_line(line)):
+                column_fd.write(value + "\n")
+    for column_fd in column_fds:
+        column_fd.close()
 
-	# remove stopwords
-	dummy_list = [word for word in dummy_list if word not in stopwords_set]
-
-	# split using special characters as delimiters
-	# example "50,000" -> ["50", "000"]
-	# example "." -> ["", ""]
-	term_list = []
-	for word in dummy_list:
-	    term_list += re.split(r"[^0-9A-Za-z]", word)
-	
-	# stemming using Porter Stemmer
-	term_list = [stemmer.stem(word, 0, len(word) - 1) for word in term_list]
+    print("Done")
 
-	# remove empty terms
-	term_list = [word for word in term_list if len(word) > 0]
+def split_posts(raw_file="TUAW-dataset/data/posts.csv"):
+    """Yield (doc_id, fields) for every post of @raw_file like read_posts, while cleaning it and \
+splitting its columns to the column files one line at a time, without clean_posts.csv."""
+    column_fds = [open(filename, mode="w", encoding="utf-8") for filename in COLUMN_FILES]
+    try:
+        for doc_id, line in enumerate(read_clean_lines(raw_file)):
+            columns = parse_line(line)
+            for column_fd, value in zip(column_fds, columns):
+                column_fd.write(value + "\n")
+            # title, author, category, post_text
+            yield (doc_id, (columns[0].strip(), columns[2].strip(), columns[3].strip(), \
+                columns[4].strip()))
+    finally:
+        for column_fd in column_fds:
+            column_fd.close()
 
-	return term_list
+def normalize(string, stemmer, stopwords_set):
+    """Return a generator of the non-empty terms of @string after normalization using \
+@stopwords_set and @stemmer (same terms as nltk tokenization, see tokenizer.py)."""
+    return tokenizer.normalize(string, stemmer, stopwords_set)
 
-def add_tokens():
-    """Return a posting list of all unique words in the collection."""
+def read_posts(start=0, end=None):
+    """Yield (doc_id, fields) of every post with @start <= doc_id < @end (all posts until the \
+end of the collection if @end is None), fields = the text of the post in every field of \
+doc_stats.FIELDS == (title, author, category, post_text)."""
 
     # consider only title, data, author, category and post_text columns
     # reason: the url columns contain redundant information (title) & other columns are
@@ -213,13 +201,6 @@ def add_tokens():
     category_file = "TUAW-dataset/data/category.txt"
     post_text_file = "TUAW-dataset/data/post_text.txt"
 
-    posting_list = {}
-    stemmer = PorterStemmer()
-    stopwords_set = set(stopwords.words("english"))
-
-    doc_id = -1
-    total_num_docs = 0
-
     # read the same line of the files together
     # open(date_file) as date_fd, \
     with open(title_file) as title_fd, \
@@ -227,44 +208,344 @@ def add_tokens():
         open(category_file) as category_fd, \
         open(post_text_file) as post_text_fd:
         lines = zip(title_fd, author_fd, category_fd, post_text_fd)
-        for line in lines:
-            total_num_docs += 1
-            doc_id += 1 # == line_num
-            if doc_id % 1000 == 999:
-            	print("Processed " + str(doc_id + 1) + " posts")
-            
-            # title + author + category + post_text
-            line_string = line[0].strip() + " " + line[1].strip() + " " + line[2].strip() + " " + line[3].strip()
-            
-            # normalize the terms in the line == post
-            term_list = normalize(line_string, stemmer, stopwords_set) 
-            
-            # add every word to posting list
-            for word in term_list:
-                # type(posting list) == { term: [df, {doc_id: tf}] }
-                if word in posting_list:
-                    doc_dict = posting_list[word][1]
-                    if doc_id in doc_dict:
-                        doc_dict[doc_id] = doc_dict[doc_id] + 1
-                    else:
-                        posting_list[word][0] += 1
-                        doc_dict[doc_id] = 1
-                elif len(word) > 0: # add only words of non-zero length, check again
-                    temp_dict = {}
-                    temp_dict[doc_id] = 1
-                    posting_list[word] = [1, temp_dict]
-    
+        for doc_id, line in enumerate(lines): # doc_id == line_num
+            if doc_id < start:
+                continue
+            if end is not None and doc_id >= end:
+                break
+            # title, author, category, post_text
+            yield (doc_id, tuple(value.strip() for value in line))
+
+def count_posts():
+    """Return the number of posts in the collection."""
+    with open("TUAW-dataset/data/title.txt") as f:
+        return sum(1 for line in f)
+
+def add_tokens(start=0, end=None, posts=None, stemmer=None, positions=False):
+    """Return the number of posts and a posting list of all unique words in the posts with \
+@start <= doc_id < @end (the whole collection by default), or in the stream @posts of \
+(doc_id, fields) if given. The words are stemmed with @stemmer (a new CachingStemmer by \
+default). If @positions is set, the positions of the words in every post are recorded too."""
+
+    if posts is None:
+        posts = read_posts(start, end)
+    if stemmer is None:
+        stemmer = stem_cache.CachingStemmer()
+
+    posting_list = {}
+    stopwords_set = set(stopwords.words("english"))
+
+    total_num_docs = 0
+
+    for (doc_id, fields) in posts:
+        total_num_docs += 1
+        if doc_id % 1000 == 999:
+            print("Processed " + str(doc_id + 1) + " posts")
+        add_post(posting_list, doc_id, fields, stemmer, stopwords_set, positions)
+
     return (total_num_docs, posting_list)
 
-def create_index():
-    """Create an inverted index from raw data and save it to disk."""
+def add_post(posting_list, doc_id, fields, stemmer, stopwords_set, positions=False):
+    """Add the terms of every field of the post @doc_id with the text @fields to \
+@posting_list, with their positions if @positions is set, return the approximate number of \
+bytes of memory added."""
+    added = 0
+    position = 0 if positions else None
+    # normalize the terms of every field of the post
+    for field, string in enumerate(fields):
+        term_list = normalize(string, stemmer, stopwords_set)
+        if positions:
+            term_list = list(term_list)
+        added += add_terms(posting_list, doc_id, term_list, field, position)
+        if positions:
+            position += len(term_list) + postings.POSITION_GAP
+    return added
 
-    print("Normalizing columns title, !date, author, category and post_text...")
-    (total_num_docs, posting_list) = add_tokens()
-    print("Done")
+def add_terms(posting_list, doc_id, term_list, field=0, first_position=None):
+    """Add the terms @term_list of the field number @field (see doc_stats.FIELDS) of the \
+document @doc_id to @posting_list, and if @first_position is given the position \
+@first_position + i of the i-th term, return the approximate number of bytes of memory \
+added."""
+    added = 0
 
-    # sort based on key values == terms
-    sorted_posting_list = OrderedDict( sorted(posting_list.items(), key=lambda t: t[0]) )
+    # add every word to posting list
+    for i, word in enumerate(term_list):
+        # type(posting list) == { term: [df, {doc_id: [tf in every field]}] }, or
+        # { term: [df, {doc_id: [tf in every field]}, {doc_id: [positions]}] } with positions
+        if word in posting_list:
+            doc_dict = posting_list[word][1]
+            if doc_id in doc_dict:
+                doc_dict[doc_id][field] += 1
+            else:
+                posting_list[word][0] += 1
+                doc_dict[doc_id] = [0] * len(doc_stats.FIELDS)
+                doc_dict[doc_id][field] = 1
+                added += POSTING_BYTES
+            if first_position is not None:
+                posting_list[word][2].setdefault(doc_id, []).append(first_position + i)
+                added += POSITION_BYTES
+        elif len(word) > 0: # add only words of non-zero length, check again
+            temp_dict = {}
+            temp_dict[doc_id] = [0] * len(doc_stats.FIELDS)
+            temp_dict[doc_id][field] = 1
+            posting_list[word] = [1, temp_dict]
+            added += TERM_BYTES + len(word) + POSTING_BYTES
+            if first_position is not None:
+                posting_list[word].append({doc_id: [first_position + i]})
+                added += POSITION_BYTES
+
+    return added
+
+def calc_doc_norms(posting_list, num_docs, first_doc_id=0):
+    """Return the euclidean length of the lnc weight vector of the @num_docs documents \
+starting at @first_doc_id, over all the terms of @posting_list."""
+    sum_squares = [0.0] * num_docs
+    # sum in sorted order of the terms, so the result does not depend on how the collection
+    # was split between workers
+    for term in sorted(posting_list.keys()):
+        for doc_id, field_tfs in posting_list[term][1].items():
+            sum_squares[doc_id - first_doc_id] += (1 + math.log(sum(field_tfs))) ** 2
+    return [math.sqrt(x) for x in sum_squares]
+
+def calc_field_lengths(posting_list, num_docs, first_doc_id=0):
+    """Return the number of terms of every field of doc_stats.FIELDS (one list per field) of \
+the @num_docs documents starting at @first_doc_id, over all the terms of @posting_list."""
+    field_lengths = [[0] * num_docs for field in doc_stats.FIELDS]
+    for entry in posting_list.values():
+        for doc_id, field_tfs in entry[1].items():
+            for field, tf in enumerate(field_tfs):
+                field_lengths[field][doc_id - first_doc_id] += tf
+    return field_lengths
+
+def read_num_inlinks(start=0, end=None):
+    """Return the number of inlinks of every post with @start <= doc_id < @end (all posts \
+until the end of the collection if @end is None)."""
+    num_inlinks = []
+    with open("TUAW-dataset/data/num_inlinks.txt") as f:
+        for doc_id, line in enumerate(f):
+            if end is not None and doc_id >= end:
+                break
+            if doc_id >= start:
+                num_inlinks.append(int(line))
+    return num_inlinks
+
+def read_column(column, start=0, end=None):
+    """Yield the value of @column of every post with @start <= doc_id < @end (all posts \
+until the end of the collection if @end is None)."""
+    with open("TUAW-dataset/data/" + column + ".txt", encoding="utf-8") as f:
+        for doc_id, line in enumerate(f):
+            if end is not None and doc_id >= end:
+                break
+            if doc_id >= start:
+                yield line.rstrip("\n")
+
+def write_doc_store(index_dir="TUAW-dataset/data", start=0, end=None):
+    """Write the document store and the filter index (see doc_filters.py) of the posts with \
+@start <= doc_id < @end (all posts until the end of the collection if @end is None) to \
+@index_dir."""
+    doc_store.write_doc_store(index_dir + "/doc_store", \
+        dict((column, read_column(column, start, end)) for column in doc_store.COLUMNS))
+    doc_filters.write_filter_index(index_dir + "/doc_filters", \
+        doc_store.DocStore(index_dir + "/doc_store"))
+
+def calc_frac_inlinks(num_inlinks=None):
+    """Return the fraction of all inlinks of @num_inlinks (all posts of the collection by \
+default) pointing to each post."""
+    if num_inlinks is None:
+        num_inlinks = read_num_inlinks()
+    total_num_inlinks = sum(num_inlinks)
+    if total_num_inlinks == 0:
+        return [0.0] * len(num_inlinks)
+    return [num / total_num_inlinks for num in num_inlinks]
+
+def sorted_terms(posting_list):
+    """Yield (term, doc_ids, tfs, field_tfs, positions) for every term of the in memory \
+@posting_list, in sorted order of the terms, field_tfs = the tfs in every field of \
+doc_stats.FIELDS (one list per field), tfs their sums and positions the list of positions \
+of the term in every document (None if the posting list has no positions)."""
+    for term in sorted(posting_list.keys()):
+        # doc_ids were added in increasing order, so the dict is already sorted
+        entry = posting_list[term]
+        doc_dict = entry[1]
+        field_tfs = [list(tfs) for tfs in zip(*doc_dict.values())]
+        positions = list(entry[2].values()) if len(entry) > 2 else None
+        yield (term, list(doc_dict.keys()), [sum(tfs) for tfs in doc_dict.values()], field_tfs, \
+            positions)
+
+def write_run(posting_list, filename):
+    """Write the in memory @posting_list to the run file @filename, one line per term in \
+sorted order of the terms = term doc_id tf_title tf_author tf_category tf_post_text doc_id \
+..., every posting followed by the tf positions of the term in the document if the posting \
+list has positions."""
+    with open(filename, mode="w", encoding="utf-8") as f:
+        for term in sorted(posting_list.keys()):
+            entry = posting_list[term]
+            values = []
+            for doc_id, field_tfs in entry[1].items():
+                values.append(str(doc_id))
+                values += [str(tf) for tf in field_tfs]
+                if len(entry) > 2:
+                    values += [str(position) for position in entry[2][doc_id]]
+            f.write(term + " " + " ".join(values) + "\n")
+
+def read_run(filename, run_num, positions=False):
+    """Yield (term, @run_num, doc_ids, tfs, field_tfs, positions) for every line of the run \
+file @filename, written with positions if @positions is set (positions = None otherwise)."""
+    step = 1 + len(doc_stats.FIELDS)
+    with open(filename, encoding="utf-8") as f:
+        for line in f:
+            values = line.split(" ")
+            numbers = [int(value) for value in values[1 : ]]
+            if not positions:
+                field_tfs = [numbers[field : : step] for field in range(1, step)]
+                yield (values[0], run_num, numbers[0 : : step], \
+                    [sum(tfs) for tfs in zip(*field_tfs)], field_tfs, None)
+                continue
+            # the number of positions of a posting is its tf
+            doc_ids = []
+            tfs = []
+            field_tfs = [[] for field in doc_stats.FIELDS]
+            doc_positions = []
+            i = 0
+            while i < len(numbers):
+                doc_ids.append(numbers[i])
+                for field in range(len(doc_stats.FIELDS)):
+                    field_tfs[field].append(numbers[i + 1 + field])
+                tf = sum(numbers[i + 1 : i + step])
+                tfs.append(tf)
+                doc_positions.append(numbers[i + step : i + step + tf])
+                i += step + tf
+            yield (values[0], run_num, doc_ids, tfs, field_tfs, doc_positions)
+
+def merge_runs(run_files, positions=False):
+    """Yield (term, doc_ids, tfs, field_tfs, positions) for every term of the run files \
+@run_files, written with positions if @positions is set, in sorted order of the terms, with a \
+streaming k-way merge. The runs must hold disjoint doc_id ranges in increasing order, so the \
+postings of a term are concatenated in the order of @run_files."""
+    return merge_sorted([read_run(filename, run_num, positions) \
+        for run_num, filename in enumerate(run_files)])
+
+def merge_sorted(runs):
+    """Yield (term, doc_ids, tfs, field_tfs, positions) for every term of the streams @runs of \
+(term, run_num, doc_ids, tfs, field_tfs, positions) sorted by term, concatenating the \
+postings of a term in order of run_num (positions = None if a run has no positions)."""
+    # (term, run_num) is unique, the postings are never compared
+    merged = heapq.merge(*runs)
+    for term, group in itertools.groupby(merged, key=operator.itemgetter(0)):
+        doc_ids = []
+        tfs = []
+        field_tfs = [[] for field in doc_stats.FIELDS]
+        positions = []
+        for (term, run_num, run_doc_ids, run_tfs, run_field_tfs, run_positions) in group:
+            doc_ids += run_doc_ids
+            tfs += run_tfs
+            for field, field_run_tfs in enumerate(run_field_tfs):
+                field_tfs[field] += field_run_tfs
+            if positions is not None and run_positions is not None:
+                positions += run_positions
+            else:
+                positions = None
+        yield (term, doc_ids, tfs, field_tfs, positions)
+
+def write_index(sorted_terms, total_num_docs, doc_norms, index_dir="TUAW-dataset/data", \
+    codec=postings.DEFAULT_CODEC, export_text=False, positions=False, impacts=False):
+    """Write the stream @sorted_terms of (term, doc_ids, tfs, field_tfs, positions) in sorted \
+order of the terms as a binary inverted index: postings.bin holds the posting list of every \
+term encoded with @codec followed by its tfs per field, if @positions is set its positions \
+and if @impacts is set its postings in decreasing order of their lnc weight (see postings.py), \
+and term_dict.txt maps each term to its df, the byte offset and length of its posting list in \
+postings.bin, the maximum normalized lnc weight of the term in any document, using the \
+document lengths @doc_norms, and the lengths of its field, positions and impact records, \
+term_dict.bin holding the same entries for the searches, with the permuterm index of the terms \
+in permuterm.bin, their top completions in completions.bin and their deletes for spelling \
+correction in deletes.bin (see lexicon.py). If \
+@export_text is set, also write the old text format: term.txt with one python literal posting \
+list per line and term_line_num.txt mapping each term to its line number."""
+
+    postings_file = index_dir + "/postings.bin"
+    term_dict_file = index_dir + "/term_dict.txt"
+    term_dict_writer = lexicon.TermDictWriter(index_dir + "/term_dict.bin")
+    # posting_list_file
+    term_file = index_dir + "/term.txt"
+    # for lookup during query processing
+    # map: term -> line in term_file, the posting list for the term can be retrieved
+    # by reading the corresponding line
+    term_line_num_file = index_dir + "/term_line_num.txt"
+
+    offset = 0
+    current_line = 0
+
+    # 1st line = number of documents codec [positions] [impacts], then one line per term =
+    # term df offset length max_weight field_length position_length impact_length
+    with open(postings_file, mode="wb") as f, \
+        open(term_dict_file, mode="w", encoding="utf-8") as term_dict_fd:
+        term_dict_fd.write(str(total_num_docs) + " " + codec + \
+            (" " + postings.POSITIONS_FLAG if positions else "") + \
+            (" " + postings.IMPACTS_FLAG if impacts else "") + "\n")
+        if export_text:
+            term_fd = open(term_file, mode="w", encoding="utf-8")
+            term_line_num_fd = open(term_line_num_file, mode="w", encoding="utf-8")
+            term_line_num_fd.write(str(total_num_docs) + "\n")
+
+        for (term, doc_ids, tfs, field_tfs, doc_positions) in sorted_terms:
+            record = postings.encode(doc_ids, tfs, codec)
+            field_record = postings.encode_fields(field_tfs, codec)
+            position_record = b""
+            if positions:
+                position_record = postings.encode_positions(doc_positions, codec)
+            weights = [(1 + math.log(tf)) / doc_norms[doc_id] for doc_id, tf in zip(doc_ids, tfs)]
+            impact_record = b""
+            if impacts:
+                impact_record = postings.encode_impacts(doc_ids, tfs, weights, codec)
+            f.write(record)
+            f.write(field_record)
+            f.write(position_record)
+            f.write(impact_record)
+            # upper bound of the contribution of the term to the cosine score of any document
+            max_weight = max(weights)
+            entry = (len(doc_ids), offset, len(record), max_weight, len(field_record), \
+                len(position_record), len(impact_record))
+            term_dict_fd.write(term + " " + " ".join(repr(value) for value in entry) + "\n")
+            term_dict_writer.add(term, entry)
+            offset += len(record) + len(field_record) + len(position_record) + \
+                len(impact_record)
+
+            if export_text:
+                value = [len(doc_ids), dict(zip(doc_ids, tfs))]
+                term_fd.write(term + ":" + str(value) + "\n")
+                term_line_num_fd.write(term + " " + str(current_line) + "\n")
+                current_line += 1
+
+        if export_text:
+            term_fd.close()
+            term_line_num_fd.close()
+    # generated from the terms of the dictionary, under its temporary name: term_dict.bin is
+    # replaced last, the searches load the index again when it changes
+    term_dict_writer.flush()
+    term_dict = lexicon.TermDictionary(term_dict_writer.temp_file)
+    lexicon.write_permuterm(term_dict, index_dir + "/permuterm.bin")
+    lexicon.write_completions(term_dict, index_dir + "/completions.bin")
+    lexicon.write_deletes(term_dict, index_dir + "/deletes.bin")
+    term_dict_writer.close()
+
+def print_done(start):
+    """Finish the progress message of a stage started at time @start."""
+    print("Done in " + "{:.2f}".format(time.perf_counter() - start) + " seconds")
+
+def create_index(export_text=False, codec=postings.DEFAULT_CODEC, posts=None, positions=False, \
+    impacts=False):
+    """Create an inverted index from raw data and save it to disk with posting lists encoded \
+using @codec, with the positions of the terms if @positions is set and the impact records of \
+the terms if @impacts is set. If @export_text is set, \
+also save it in the old text format. The posts are read from the column files, or from the \
+stream @posts of (doc_id, fields) if given."""
+
+    start = time.perf_counter()
+    print("Normalizing columns title, !date, author, category and post_text...")
+    stemmer = stem_cache.CachingStemmer()
+    (total_num_docs, posting_list) = add_tokens(posts=posts, stemmer=stemmer, \
+        positions=positions)
+    print_done(start)
 
     # computed average length of posting list = 27.17
     # sum_length = 0
@@ -277,41 +558,506 @@ def create_index():
     #   n +=1
     # print(sum_length / n)
 
-    # posting_list_file
-    term_file = "TUAW-dataset/data/term.txt"
+    start = time.perf_counter()
+    print("Computing document norms and lengths, inlink fractions and the document store...", \
+        end=" ")
+    doc_norms = calc_doc_norms(posting_list, total_num_docs)
+    doc_stats.write_doc_stats("TUAW-dataset/data/doc_stats.bin", doc_norms, calc_frac_inlinks())
+    doc_stats.write_field_lengths("TUAW-dataset/data/field_lengths.bin", \
+        calc_field_lengths(posting_list, total_num_docs))
+    write_doc_store()
+    print_done(start)
 
+    start = time.perf_counter()
     print("Generating inverted index...", end=" ")
+    # sort based on key values == terms
+    write_index(sorted_terms(posting_list), total_num_docs, doc_norms, codec=codec, \
+        export_text=export_text, positions=positions, impacts=impacts)
+    stemmer.save()
+    # the new main index covers all posts, including those of the delta segments
+    segments.reset()
+    print_done(start)
 
-    # for lookup during query processing
-    # map: term -> line in term_file, the posting list for the term can be retrieved
-    # by reading the corresponding line
-    term_line_num_file = "TUAW-dataset/data/term_line_num.txt"
-    line_num_dict = {}
-    current_line = 0
+def index_chunk(chunk):
+    """Index the posts of @chunk == (start, end, run_file, positions) into a sorted run file, \
+return (start, norms of the documents, lengths of their fields, stems of their words). \
+Executed by the worker processes of create_index_parallel."""
+    (start, end, run_file, positions) = chunk
+    stemmer = stem_cache.CachingStemmer()
+    (num_docs, posting_list) = add_tokens(start, end, stemmer=stemmer, positions=positions)
+    write_run(posting_list, run_file)
+    return (start, calc_doc_norms(posting_list, num_docs, start), \
+        calc_field_lengths(posting_list, num_docs, start), stemmer.stems())
 
-    # store posting_list
-    with open(term_file, mode="w", encoding="utf-8") as f:
-        for key, value in sorted_posting_list.items():
-            line_num_dict[key] = current_line
-            f.write(str(key) + ":" + str(value) + "\n")
-            current_line += 1
+def create_index_parallel(workers, export_text=False, codec=postings.DEFAULT_CODEC, \
+    chunk_size=CHUNK_SIZE, positions=False, impacts=False):
+    """Create the same inverted index as create_index with @workers processes: the posts are \
+split in chunks of @chunk_size posts, every chunk is indexed by a worker into a sorted run \
+file and the runs are merged with a streaming k-way merge, so only one chunk per worker is \
+held in memory."""
 
-    # store line number lookup
-    with open(term_line_num_file, mode="w", encoding="utf-8") as f:
-        f.write(str(total_num_docs) + "\n")
-        for term, line_num in line_num_dict.items():
-            f.write(str(term) + " " + str(line_num) + "\n")
+    total_num_docs = count_posts()
+    run_dir = tempfile.mkdtemp(prefix="runs_", dir="TUAW-dataset/data")
+    chunks = []
+    for start in range(0, total_num_docs, chunk_size):
+        run_file = run_dir + "/run_" + str(len(chunks)) + ".txt"
+        chunks.append((start, min(start + chunk_size, total_num_docs), run_file, positions))
 
-    print("Done")
+    start = time.perf_counter()
+    print("Normalizing columns title, !date, author, category and post_text with " + \
+        str(workers) + " workers...")
+    doc_norms = [0.0] * total_num_docs
+    field_lengths = [[0] * total_num_docs for field in doc_stats.FIELDS]
+    stem_table = {}
+    with multiprocessing.Pool(workers) as pool:
+        for (first_doc_id, norms, lengths, stems) in pool.imap_unordered(index_chunk, chunks):
+            doc_norms[first_doc_id : first_doc_id + len(norms)] = norms
+            for field, chunk_lengths in enumerate(lengths):
+                field_lengths[field][first_doc_id : first_doc_id + len(norms)] = chunk_lengths
+            stem_table.update(stems)
+    print_done(start)
+
+    start = time.perf_counter()
+    print("Computing inlink fractions and the document store...", end=" ")
+    doc_stats.write_doc_stats("TUAW-dataset/data/doc_stats.bin", doc_norms, calc_frac_inlinks())
+    doc_stats.write_field_lengths("TUAW-dataset/data/field_lengths.bin", field_lengths)
+    write_doc_store()
+    print_done(start)
+
+    start = time.perf_counter()
+    print("Merging " + str(len(chunks)) + " runs into the inverted index...", end=" ")
+    write_index(merge_runs([chunk[2] for chunk in chunks], positions), total_num_docs, \
+        doc_norms, codec=codec, export_text=export_text, positions=positions, impacts=impacts)
+    stem_cache.save_stem_table(stem_table)
+    # the new main index covers all posts, including those of the delta segments
+    segments.reset()
+    shutil.rmtree(run_dir)
+    print_done(start)
+
+def create_index_spimi(memory_budget, export_text=False, codec=postings.DEFAULT_CODEC, \
+    posts=None, positions=False, impacts=False):
+    """Create the same inverted index as create_index in a single pass over the posts using \
+about @memory_budget bytes for the posting lists (SPIMI): whenever the in memory posting list \
+reaches the budget, it is flushed to a sorted run file, and the runs are merged at the end \
+with a streaming k-way merge. The posts are read from the column files, or from the stream \
+@posts of (doc_id, fields) if given."""
+
+    if posts is None:
+        posts = read_posts()
+
+    run_dir = tempfile.mkdtemp(prefix="runs_", dir="TUAW-dataset/data")
+    run_files = []
+    doc_norms = []
+    field_lengths = [[] for field in doc_stats.FIELDS]
+
+    def flush(posting_list, first_doc_id, num_docs):
+        """Write @posting_list of the @num_docs posts from @first_doc_id to a new run."""
+        run_file = run_dir + "/run_" + str(len(run_files)) + ".txt"
+        write_run(posting_list, run_file)
+        run_files.append(run_file)
+        doc_norms.extend(calc_doc_norms(posting_list, num_docs, first_doc_id))
+        for field, lengths in enumerate(calc_field_lengths(posting_list, num_docs, first_doc_id)):
+            field_lengths[field].extend(lengths)
+
+    start = time.perf_counter()
+    print("Normalizing columns title, !date, author, category and post_text within " + \
+        str(memory_budget // (1024 * 1024)) + " MB...")
+    stemmer = stem_cache.CachingStemmer()
+    stopwords_set = set(stopwords.words("english"))
+    posting_list = {}
+    memory_used = 0
+    first_doc_id = 0
+    total_num_docs = 0
+
+    for (doc_id, fields) in posts:
+        total_num_docs += 1
+        if doc_id % 1000 == 999:
+            print("Processed " + str(doc_id + 1) + " posts")
+        memory_used += add_post(posting_list, doc_id, fields, stemmer, stopwords_set, positions)
+        # flush between two posts, so a run holds whole documents
+        if memory_used >= memory_budget:
+            flush(posting_list, first_doc_id, doc_id + 1 - first_doc_id)
+            posting_list = {}
+            memory_used = 0
+            first_doc_id = doc_id + 1
+    if total_num_docs > first_doc_id:
+        flush(posting_list, first_doc_id, total_num_docs - first_doc_id)
+    posting_list = {}
+    print_done(start)
+
+    start = time.perf_counter()
+    print("Computing inlink fractions and the document store...", end=" ")
+    doc_stats.write_doc_stats("TUAW-dataset/data/doc_stats.bin", doc_norms, calc_frac_inlinks())
+    doc_stats.write_field_lengths("TUAW-dataset/data/field_lengths.bin", field_lengths)
+    write_doc_store()
+    print_done(start)
+
+    start = time.perf_counter()
+    print("Merging " + str(len(run_files)) + " runs into the inverted index...", end=" ")
+    write_index(merge_runs(run_files, positions), total_num_docs, doc_norms, codec=codec, \
+        export_text=export_text, positions=positions, impacts=impacts)
+    stemmer.save()
+    # the new main index covers all posts, including those of the delta segments
+    segments.reset()
+    shutil.rmtree(run_dir)
+    print_done(start)
+
+def index_shard(shard):
+    """Index the posts of @shard == (name, start, end, codec, positions, impacts) into a \
+complete index in the directory of the shard, with doc_ids from 0 and the inlink fractions of \
+the whole collection, return (name, { term: df }, total number of terms of every field, stems \
+of the words). Executed by the worker processes of create_shards."""
+    (name, start, end, codec, positions, impacts) = shard
+    directory = shards.shard_dir(name)
+    os.makedirs(directory)
+    stemmer = stem_cache.CachingStemmer()
+    posts = ((doc_id - start, fields) for (doc_id, fields) in read_posts(start, end))
+    (num_docs, posting_list) = add_tokens(posts=posts, stemmer=stemmer, positions=positions)
+    doc_norms = calc_doc_norms(posting_list, num_docs)
+    field_lengths = calc_field_lengths(posting_list, num_docs)
+    write_index(sorted_terms(posting_list), num_docs, doc_norms, directory, codec, \
+        positions=positions, impacts=impacts)
+    doc_stats.write_doc_stats(directory + "/doc_stats.bin", doc_norms, \
+        calc_frac_inlinks()[start : end])
+    doc_stats.write_field_lengths(directory + "/field_lengths.bin", field_lengths)
+    write_doc_store(directory, start, end)
+    return (name, dict((term, entry[0]) for term, entry in posting_list.items()), \
+        [sum(lengths) for lengths in field_lengths], stemmer.stems())
+
+def create_shards(num_shards, workers=1, codec=postings.DEFAULT_CODEC, positions=False, \
+    impacts=False):
+    """Create a sharded index (see shards.py): the posts are split into @num_shards shards of \
+consecutive doc_ids, each one indexed like create_index by one of @workers processes, then \
+the statistics of the whole collection are summed from the shards and written to every \
+shard, with the dictionaries of its terms. Only the shards built at the same time are held in memory."""
+
+    total_num_docs = count_posts()
+    num_shards = max(1, min(num_shards, total_num_docs))
+    shard_list = [("shard_" + str(i), start, end - start) \
+        for i, (start, end) in enumerate(shards.shard_ranges(total_num_docs, num_shards))]
+    shards.reset()
+
+    start = time.perf_counter()
+    print("Indexing " + str(num_shards) + " shards with " + str(workers) + " workers...")
+    dfs = {}
+    total_lengths = [0] * len(doc_stats.FIELDS)
+    stem_table = {}
+    with multiprocessing.Pool(min(workers, num_shards)) as pool:
+        for (name, shard_dfs, lengths, stems) in pool.imap_unordered(index_shard, \
+            [(name, first_doc_id, first_doc_id + num_docs, codec, positions, impacts) \
+            for (name, first_doc_id, num_docs) in shard_list]):
+            for term, df in shard_dfs.items():
+                dfs[term] = dfs.get(term, 0) + df
+            total_lengths = [total + length for total, length in zip(total_lengths, lengths)]
+            stem_table.update(stems)
+    print_done(start)
+
+    start = time.perf_counter()
+    print("Writing the statistics of the collection to every shard...", end=" ")
+    # the dictionaries of the collection are built once and copied
+    first_dir = shards.shard_dir(shard_list[0][0])
+    shards.write_global_dictionaries(first_dir, dfs)
+    for (name, first_doc_id, num_docs) in shard_list:
+        directory = shards.shard_dir(name)
+        if directory != first_dir:
+            for filename in ("global_terms.bin", "global_permuterm.bin", "global_deletes.bin"):
+                shutil.copyfile(first_dir + "/" + filename, directory + "/" + filename)
+        shards.write_global_stats(directory, total_num_docs, total_lengths, dfs)
+    stem_cache.save_stem_table(stem_table)
+    # the shards are searchable once listed
+    shards.write_shard_list(shard_list)
+    print_done(start)
+
+def segment_flags(name):
+    """Return the flags of the segment @name (postings.POSITIONS_FLAG, postings.IMPACTS_FLAG) \
+it was built with."""
+    with open(segments.segment_dir(name) + "/term_dict.txt", encoding="utf-8") as f:
+        return f.readline().split()[2 : ]
+
+def has_positions(name):
+    """Return True if the segment @name was built with the positions of the terms."""
+    return postings.POSITIONS_FLAG in segment_flags(name)
+
+def has_impacts(name):
+    """Return True if the segment @name was built with the impact records of the terms."""
+    return postings.IMPACTS_FLAG in segment_flags(name)
+
+def update_index(codec=postings.DEFAULT_CODEC):
+    """Index only the posts appended to posts.csv since the last build or update: split their \
+columns to the end of the column files and index them into a new delta segment, searchable as \
+soon as it is listed in the manifest, with positions and impact records if the index has \
+them. Start a background merge when there are too many delta segments."""
+
+    raw_file = "TUAW-dataset/data/posts.csv"
+
+    with segments.lock():
+        first_doc_id = count_posts()
+        manifest = segments.read_manifest()
+        if manifest is None:
+            # the main index covers every post split so far
+            total_inlinks = sum(read_num_inlinks(0, first_doc_id))
+            manifest = (0, [(segments.MAIN, 0, first_doc_id, total_inlinks)])
+        (generation, segment_list) = manifest
+
+        start = time.perf_counter()
+        print("Parsing new posts...", end=" ")
+        num_new_posts = 0
+        column_fds = [open(filename, mode="a", encoding="utf-8") for filename in COLUMN_FILES]
+        # the posts are split like those of the full build, an entity can decode to a line
+        # break
+        for line in itertools.islice(read_clean_lines(raw_file), first_doc_id, None):
+            for column_fd, value in zip(column_fds, parse_line(line)):
+                column_fd.write(value + "\n")
+            num_new_posts += 1
+        for column_fd in column_fds:
+            column_fd.close()
+        print_done(start)
+
+        if num_new_posts == 0:
+            print("No new posts to index")
+            return
+
+        start = time.perf_counter()
+        print("Indexing " + str(num_new_posts) + " new posts...")
+        # the new words are added to the stem table of the index
+        stemmer = stem_cache.CachingStemmer(table=stem_cache.load_stem_table())
+        positions = has_positions(segment_list[0][0])
+        impacts = has_impacts(segment_list[0][0])
+        (num_docs, posting_list) = add_tokens(first_doc_id, stemmer=stemmer, positions=positions)
+        norms = calc_doc_norms(posting_list, num_docs, first_doc_id)
+        num_inlinks = read_num_inlinks(first_doc_id)
+
+        # unique name: no other segment of this generation starts at first_doc_id
+        name = "seg_" + str(first_doc_id) + "_" + str(generation + 1)
+        directory = segments.segment_dir(name)
+        os.makedirs(directory)
+        write_index(sorted_terms(posting_list), num_docs, \
+            dict(zip(range(first_doc_id, first_doc_id + num_docs), norms)), directory, codec, \
+            positions=positions, impacts=impacts)
+        doc_stats.write_doc_stats(directory + "/doc_stats.bin", norms, \
+            calc_frac_inlinks(num_inlinks))
+        doc_stats.write_field_lengths(directory + "/field_lengths.bin", \
+            calc_field_lengths(posting_list, num_docs, first_doc_id))
+        write_doc_store(directory, first_doc_id)
+        segment_list.append((name, first_doc_id, num_docs, sum(num_inlinks)))
+        stemmer.save()
+        segments.write_manifest(generation + 1, segment_list)
+        print_done(start)
+
+    # the running merge leaves the new segment for the next one
+    if len(segment_list) > MAX_SEGMENTS and not segments.merging():
+        print("Merging " + str(len(segment_list)) + " segments in the background")
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), "--merge", \
+            "--codec=" + codec], start_new_session=True)
+
+def read_segment(name, seg_num):
+    """Yield (term, @seg_num, doc_ids, tfs, field_tfs, positions) for every term of the \
+segment @name in sorted order of the terms, positions = None if the segment has no \
+positions."""
+    directory = segments.segment_dir(name)
+    with open(directory + "/term_dict.txt", encoding="utf-8") as term_dict_fd, \
+        open(directory + "/postings.bin", mode="rb") as f:
+        header = term_dict_fd.readline().split()
+        codec = header[1]
+        positions = postings.POSITIONS_FLAG in header[2 : ]
+        # the posting lists are stored one after the other in the order of the terms
+        for line in term_dict_fd:
+            (term, df, offset, length, max_weight, field_length, position_length, \
+                impact_length) = line.split(" ")
+            (doc_ids, tfs) = postings.decode(f.read(int(length)), codec)
+            field_tfs = postings.decode_fields(f.read(int(field_length)), int(df), codec)
+            doc_positions = None
+            data = f.read(int(position_length))
+            if positions:
+                doc_positions = postings.decode_positions(data, tfs, range(len(tfs)), codec)
+            # the impact record is written again from the merged posting list
+            f.seek(int(impact_length), os.SEEK_CUR)
+            yield (term, seg_num, list(doc_ids), list(tfs), [list(tfs) for tfs in field_tfs], \
+                doc_positions)
+
+def merge_segments(codec=postings.DEFAULT_CODEC):
+    """Merge the main index and the delta segments into a single segment, dropping the \
+postings of deleted posts, with positions (impact records) if every segment has positions \
+(impact records). Segments added by updates during the merge are kept after it. Only one \
+merge runs at a time, this one exits right away if another one is running."""
+
+    with segments.merge_lock() as acquired:
+        if not acquired:
+            print("Another merge is running")
+            return
+        merge_locked_segments(codec)
+
+def merge_locked_segments(codec=postings.DEFAULT_CODEC):
+    """Merge the segments as merge_segments() does, the merge lock must be held."""
+    with segments.lock():
+        manifest = segments.read_manifest()
+    if manifest is None or len(manifest[1]) < 2:
+        print("Nothing to merge")
+        return
+    (generation, segment_list) = manifest
+    tombstones = segments.read_tombstones()
+
+    start = time.perf_counter()
+    print("Merging " + str(len(segment_list)) + " segments...", end=" ")
+    total_num_docs = sum(num_docs for (name, first, num_docs, inlinks) in segment_list)
+    total_inlinks = sum(inlinks for (name, first, num_docs, inlinks) in segment_list)
+
+    # the segments hold consecutive doc_ids from 0
+    doc_norms = []
+    frac_inlinks = []
+    field_lengths = [[] for field in doc_stats.FIELDS]
+    for (name, first_doc_id, num_docs, inlinks) in segment_list:
+        directory = segments.segment_dir(name)
+        (norms, fracs) = doc_stats.load_doc_stats(directory + "/doc_stats.bin")
+        doc_norms.extend(norms)
+        lengths = doc_stats.load_field_lengths(directory + "/field_lengths.bin")
+        for field, segment_lengths in enumerate(lengths):
+            field_lengths[field].extend(segment_lengths)
+        # fractions of the inlinks of the segment -> of the inlinks of the merged segment
+        scale = inlinks / total_inlinks if total_inlinks > 0 else 0.0
+        frac_inlinks.extend(frac * scale for frac in fracs)
+
+    def live_terms():
+        """Yield the merged posting lists without the deleted posts."""
+        runs = [read_segment(name, seg_num) for seg_num, (name, first, num, inlinks) \
+            in enumerate(segment_list)]
+        for (term, doc_ids, tfs, field_tfs, doc_positions) in merge_sorted(runs):
+            if len(tombstones) > 0:
+                live = [i for i, doc_id in enumerate(doc_ids) if doc_id not in tombstones]
+                doc_ids = [doc_ids[i] for i in live]
+                tfs = [tfs[i] for i in live]
+                field_tfs = [[tfs_of_field[i] for i in live] for tfs_of_field in field_tfs]
+                if doc_positions is not None:
+                    doc_positions = [doc_positions[i] for i in live]
+            if len(doc_ids) > 0:
+                yield (term, doc_ids, tfs, field_tfs, doc_positions)
+
+    name = "seg_0_" + str(generation + 1)
+    directory = segments.segment_dir(name)
+    os.makedirs(directory)
+    positions = all(has_positions(segment[0]) for segment in segment_list)
+    impacts = all(has_impacts(segment[0]) for segment in segment_list)
+    write_index(live_terms(), total_num_docs, doc_norms, directory, codec, positions=positions, \
+        impacts=impacts)
+    doc_stats.write_doc_stats(directory + "/doc_stats.bin", doc_norms, frac_inlinks)
+    doc_stats.write_field_lengths(directory + "/field_lengths.bin", field_lengths)
+    write_doc_store(directory, 0, total_num_docs)
+
+    with segments.lock():
+        # keep the segments added while merging
+        (generation, current_list) = segments.read_manifest()
+        merged = set(segment[0] for segment in segment_list)
+        new_list = [(name, 0, total_num_docs, total_inlinks)] + \
+            [segment for segment in current_list if segment[0] not in merged]
+        segments.write_manifest(generation + 1, new_list)
+        # readers keep the files they opened, the directories can go
+        segments.remove_unlisted(new_list)
+    print_done(start)
+
+def delete_posts(doc_ids):
+    """Mark the posts @doc_ids as deleted, they stop appearing in search results right away. \
+To edit a post, append its new version to posts.csv, run --update and delete the old one."""
+    segments.add_tombstones(doc_ids)
+    print("Deleted " + str(len(doc_ids)) + " posts")
 
 def main():
-    start = time.clock()
+    # ./build_index.py [--export-text] [--codec=raw|vbyte|bitpack]
+    #     [--workers=N | --memory=MB] [--stream] [--positions] [--impacts]
+    # ./build_index.py --update | --merge | --delete=DOC_ID,... [--codec=raw|vbyte|bitpack]
+    # ./build_index.py --shards=N [--workers=N] [--codec=raw|vbyte|bitpack] [--positions]
+    #     [--impacts]
+    usage = "Usage: ./build_index.py [--export-text] [--codec=raw|vbyte|bitpack] " + \
+        "[--workers=N | --memory=MB] [--stream] [--positions] [--impacts]\n" + \
+        "       ./build_index.py --update | --merge | --delete=DOC_ID,... " + \
+        "[--codec=raw|vbyte|bitpack]\n" + \
+        "       ./build_index.py --shards=N [--workers=N] [--codec=raw|vbyte|bitpack] " + \
+        "[--positions] [--impacts]"
+    export_text = False
+    codec = postings.DEFAULT_CODEC
+    workers = 1
+    memory_budget = 0
+    stream = False
+    positions = False
+    impacts = False
+    num_shards = 0
+    action = None
+    for arg in sys.argv[1:]:
+        if arg in ("--update", "--merge"):
+            action = arg
+        elif arg.startswith("--delete=") and \
+            all(doc_id.isdigit() for doc_id in arg[len("--delete="):].split(",")):
+            action = arg
+        elif arg == "--export-text":
+            export_text = True
+        elif arg == "--stream":
+            stream = True
+        elif arg == "--positions":
+            positions = True
+        elif arg == "--impacts":
+            impacts = True
+        elif arg.startswith("--codec=") and arg[len("--codec="):] in postings.CODECS:
+            codec = arg[len("--codec="):]
+        elif arg.startswith("--workers=") and arg[len("--workers="):].isdigit():
+            workers = max(1, int(arg[len("--workers="):]))
+        elif arg.startswith("--memory=") and arg[len("--memory="):].isdigit():
+            memory_budget = max(1, int(arg[len("--memory="):])) * 1024 * 1024
+        elif arg.startswith("--shards=") and arg[len("--shards="):].isdigit():
+            num_shards = max(1, int(arg[len("--shards="):]))
+        else:
+            print(usage)
+            sys.exit(1)
+    # the parallel build reads its chunks from the column files
+    if workers > 1 and (memory_budget > 0 or stream):
+        print(usage)
+        sys.exit(1)
+    # the shards are built from the column files by processes of their own
+    if num_shards > 0 and (memory_budget > 0 or stream or export_text or action is not None):
+        print(usage)
+        sys.exit(1)
+
+    if action == "--update":
+        update_index(codec)
+        return
+    elif action == "--merge":
+        merge_segments(codec)
+        return
+    elif action is not None:
+        delete_posts([int(doc_id) for doc_id in action[len("--delete="):].split(",")])
+        return
+
+    start = time.perf_counter()
+    if stream:
+        # clean and split the raw posts while indexing them
+        if memory_budget > 0:
+            create_index_spimi(memory_budget, export_text, codec, split_posts(), positions, \
+                impacts)
+        else:
+            create_index(export_text, codec, split_posts(), positions, impacts)
+        end = time.perf_counter()
+        print("Index constructed in " + str(end - start) + " seconds. Ready to search.")
+        print("Search using: ./search.py \"query\" [k]")
+        return
+
+    stage_start = time.perf_counter()
     parse_html_entities()
     parse_csv()
-    create_index()
-    end = time.clock()
+    print("Preprocessing: " + "{:.2f}".format(time.perf_counter() - stage_start) + " seconds")
+    if num_shards > 0:
+        create_shards(num_shards, workers, codec, positions, impacts)
+        end = time.perf_counter()
+        print("Sharded index constructed in " + str(end - start) + " seconds. Ready to search.")
+        print("Search using: ./search.py \"query\" [k] --shards")
+        return
+    if workers > 1:
+        create_index_parallel(workers, export_text, codec, positions=positions, impacts=impacts)
+    elif memory_budget > 0:
+        create_index_spimi(memory_budget, export_text, codec, positions=positions, \
+            impacts=impacts)
+    else:
+        create_index(export_text, codec, positions=positions, impacts=impacts)
+    end = time.perf_counter()
     print("Index constructed in " + str(end - start) + " seconds. Ready to search.")
     print("Search using: ./search.py \"query\" [k]")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
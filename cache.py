@@ -0,0 +1,60 @@
+"""Bounded LRU cache with optional expiry, shared by the threads of the search server."""
+
+import time
+import threading
+from collections import OrderedDict
+
+class LRUCache:
+    """Keep the most recently used values up to a total size of @max_size (every value has \
+a size, 1 by default) and, if @ttl is set, for at most @ttl seconds.
+
+    The cached values are shared by all callers and must not be modified."""
+
+    def __init__(self, max_size, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        # type(entries) == OrderedDict { key: (value, size, expiry time) }, least recently
+        # used first
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the value cached for @key, None if there is none or it expired."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or (entry[2] is not None and entry[2] < time.monotonic()):
+                if entry is not None:
+                    self.remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size=1):
+        """Cache @value of size @size for @key, evicting the least recently used values if \
+the cache is full. A value larger than the cache is not cached."""
+        if size > self.max_size:
+            return
+        expiry = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (value, size, expiry)
+            self.size += size
+            while self.size > self.max_size:
+                self.remove(next(iter(self.entries)))
+
+    def remove(self, key):
+        """Drop the value of @key, the lock must be held."""
+        (value, size, expiry) = self.entries.pop(key)
+        self.size -= size
+
+    def clear(self):
+        """Drop every cached value."""
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
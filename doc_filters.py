@@ -0,0 +1,238 @@
+"""Metadata filters of the queries (date range, author, category, minimum number of comments
+or inlinks) and the columnar indexes answering them, built at index construction.
+
+A filter index is a directory next to the document store of every segment, built from it:
+
+range columns : NAME.sorted, a packed array of 2 * N little-endian signed 64 bit integers,
+                the N values of the column in ascending order, then the doc_ids of the
+                segment in that order (ascending for equal values), so the posts whose value
+                is in a range are a slice found with two binary searches
+value columns : NAME.values, one line "count value" per distinct value of the column, in
+                sorted order, and NAME.doc_ids, a packed array of little-endian unsigned 32
+                bit integers, the ascending doc_ids of the posts of every value one after the
+                other in the order of the lines (a posting list per value)
+
+The date is in seconds since the epoch as in the document store, a post is listed under every
+category of its category column (separated by CATEGORY_SEPARATOR) and under none if it is
+empty. A filter selects the ascending doc_ids of the posts matching all its criteria before
+anything is scored (see search.search).
+"""
+
+import os
+import array
+import bisect
+import calendar
+import sys
+import time
+import doc_store
+
+RANGE_COLUMNS = ["date", "num_comments", "num_inlinks"]
+VALUE_COLUMNS = ["author", "category"]
+
+# the categories of a post in its category column
+CATEGORY_SEPARATOR = ":&:"
+
+# format of the dates of the filters, e.g. 2006-01-31
+DATE_FORMAT = "%Y-%m-%d"
+DAY = 24 * 60 * 60
+
+# names of the filter parameters of search.py, batch_search.py and search_server.py
+PARAMETERS = ("from", "to", "author", "category", "min_comments", "min_inlinks")
+
+def column_values(column, value):
+    """Return the values of the value column @column listed for a post with @value."""
+    if column == "category":
+        values = value.split(CATEGORY_SEPARATOR)
+    else:
+        values = [value]
+    return sorted(set(value.strip() for value in values if len(value.strip()) > 0))
+
+def read_packed(filename, typecode):
+    """Return the little-endian packed array of @typecode stored in @filename."""
+    packed = array.array(typecode)
+    with open(filename, mode="rb") as f:
+        packed.frombytes(f.read())
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed
+
+def write_filter_index(directory, store):
+    """Write the filter index @directory of the posts of the document store @store \
+(a doc_store.DocStore). Every file is written under a temporary name and renamed, so the \
+indexes opened by running searches keep their data."""
+    os.makedirs(directory, exist_ok=True)
+    for column in RANGE_COLUMNS:
+        values = [store.get(doc_id, column) for doc_id in range(store.N)]
+        order = sorted(range(store.N), key=lambda doc_id: values[doc_id])
+        doc_store.write_packed(directory + "/" + column + ".sorted", "q", \
+            [values[doc_id] for doc_id in order] + order)
+    for column in VALUE_COLUMNS:
+        # type(lists) == { value: ascending doc_ids }
+        lists = {}
+        for doc_id in range(store.N):
+            for value in column_values(column, store.get(doc_id, column)):
+                lists.setdefault(value, []).append(doc_id)
+        with open(directory + "/" + column + ".values.tmp", mode="w", encoding="utf-8") as f:
+            for value in sorted(lists.keys()):
+                f.write(str(len(lists[value])) + " " + value + "\n")
+        os.replace(directory + "/" + column + ".values.tmp", directory + "/" + column + ".values")
+        doc_store.write_packed(directory + "/" + column + ".doc_ids", "I", \
+            [doc_id for value in sorted(lists.keys()) for doc_id in lists[value]])
+
+class FilterIndex:
+    """The filter index @directory of a segment, kept in memory. Read-only, it can be shared \
+by concurrent threads."""
+
+    def __init__(self, directory):
+        # type(sorted_columns) == { column: (ascending values, doc_ids in that order) }
+        self.sorted_columns = {}
+        for column in RANGE_COLUMNS:
+            packed = read_packed(directory + "/" + column + ".sorted", "q")
+            N = len(packed) // 2
+            self.sorted_columns[column] = (packed[ : N], packed[N : ])
+        # type(value_lists) == { column: { value: (start, end) in doc_ids }, doc_ids }
+        self.value_lists = {}
+        for column in VALUE_COLUMNS:
+            lists = {}
+            start = 0
+            with open(directory + "/" + column + ".values", encoding="utf-8") as f:
+                for line in f:
+                    (count, value) = line.rstrip("\n").split(" ", 1)
+                    lists[value] = (start, start + int(count))
+                    start += int(count)
+            self.value_lists[column] = (lists, read_packed(directory + "/" + column + \
+                ".doc_ids", "I"))
+
+    def range_doc_ids(self, column, low, high):
+        """Return the ascending doc_ids of the posts whose value of the range column @column \
+is between @low and @high (included, None = no bound)."""
+        (values, doc_ids) = self.sorted_columns[column]
+        start = 0 if low is None else bisect.bisect_left(values, low)
+        end = len(values) if high is None else bisect.bisect_right(values, high)
+        return sorted(doc_ids[start : end])
+
+    def value_doc_ids(self, column, values):
+        """Return the ascending doc_ids of the posts with one of @values in the value column \
+@column."""
+        (lists, doc_ids) = self.value_lists[column]
+        found = [doc_ids[start : end] for (start, end) in \
+            (lists[value] for value in values if value in lists)]
+        if len(found) == 1:
+            return list(found[0])
+        return sorted(set().union(*found))
+
+def parse_date(date, end_of_day=False):
+    """Return the seconds since the epoch of the start (the end if @end_of_day) of the day \
+@date written as DATE_FORMAT, raise ValueError if it is not."""
+    seconds = calendar.timegm(time.strptime(date.strip(), DATE_FORMAT))
+    return seconds + DAY - 1 if end_of_day else seconds
+
+def parse_list(values):
+    """Return the sorted tuple of the lower case values of @values, a list of strings or a \
+string of values separated by commas, raise ValueError if it is neither."""
+    if isinstance(values, str):
+        values = values.split(",")
+    if not isinstance(values, list) or any(not isinstance(value, str) for value in values):
+        raise ValueError("author and category must be strings or lists of strings")
+    return tuple(sorted(set(value.strip().lower() for value in values \
+        if len(value.strip()) > 0)))
+
+class DocFilter:
+    """The posts searched by a query: posted between @date_from and @date_to (seconds since \
+the epoch, included), by one of @authors, in one of @categories, with at least @min_comments \
+comments and @min_inlinks inlinks, None or () = any. A filter holds only its parameters, it \
+can be shared by concurrent queries."""
+
+    def __init__(self, date_from=None, date_to=None, authors=(), categories=(), \
+        min_comments=None, min_inlinks=None):
+        self.date_from = date_from
+        self.date_to = date_to
+        self.authors = tuple(authors)
+        self.categories = tuple(categories)
+        self.min_comments = min_comments
+        self.min_inlinks = min_inlinks
+
+    def key(self):
+        """Return the parameters the matching posts depend on, part of the key of cached \
+results."""
+        return (self.date_from, self.date_to, self.authors, self.categories, \
+            self.min_comments, self.min_inlinks)
+
+    def params(self):
+        """Return the parameters of make_filter giving the same filter, for a filter made by \
+make_filter."""
+        params = {}
+        if self.date_from is not None:
+            params["from"] = time.strftime(DATE_FORMAT, time.gmtime(self.date_from))
+        if self.date_to is not None:
+            params["to"] = time.strftime(DATE_FORMAT, time.gmtime(self.date_to))
+        if len(self.authors) > 0:
+            params["author"] = list(self.authors)
+        if len(self.categories) > 0:
+            params["category"] = list(self.categories)
+        if self.min_comments is not None:
+            params["min_comments"] = self.min_comments
+        if self.min_inlinks is not None:
+            params["min_inlinks"] = self.min_inlinks
+        return params
+
+    def is_empty(self):
+        """Return True if the filter keeps every post."""
+        return self.key() == (None, None, (), (), None, None)
+
+    def doc_ids(self, filter_index):
+        """Return the ascending doc_ids of the posts of the segment of @filter_index matching \
+the filter, None if it keeps every post. The criteria are intersected from the most \
+selective one."""
+        criteria = []
+        if self.date_from is not None or self.date_to is not None:
+            criteria.append(filter_index.range_doc_ids("date", self.date_from, self.date_to))
+        if self.min_comments is not None:
+            criteria.append(filter_index.range_doc_ids("num_comments", self.min_comments, None))
+        if self.min_inlinks is not None:
+            criteria.append(filter_index.range_doc_ids("num_inlinks", self.min_inlinks, None))
+        if len(self.authors) > 0:
+            criteria.append(filter_index.value_doc_ids("author", self.authors))
+        if len(self.categories) > 0:
+            criteria.append(filter_index.value_doc_ids("category", self.categories))
+        if len(criteria) == 0:
+            return None
+        criteria.sort(key=len)
+        doc_ids = criteria[0]
+        for other in criteria[1 : ]:
+            if len(doc_ids) == 0:
+                break
+            other = set(other)
+            doc_ids = [doc_id for doc_id in doc_ids if doc_id in other]
+        return doc_ids
+
+def make_filter(params):
+    """Return the DocFilter of the parameters @params == { name: value } among PARAMETERS: \
+from and to (dates written as DATE_FORMAT), author and category (lists of strings or strings \
+of values separated by commas), min_comments and min_inlinks (numbers). Raise ValueError if \
+they are not valid."""
+    dates = []
+    for name in ("from", "to"):
+        date = params.get(name)
+        if date is not None:
+            try:
+                date = parse_date(str(date), end_of_day=name == "to")
+            except ValueError:
+                raise ValueError(name + " must be a date written as YYYY-MM-DD")
+        dates.append(date)
+    minimums = []
+    for name in ("min_comments", "min_inlinks"):
+        minimum = params.get(name)
+        if minimum is not None:
+            # int() raises TypeError for a list and accepts true and 2.5
+            if isinstance(minimum, bool) or not isinstance(minimum, (int, str)):
+                raise ValueError(name + " must be an integer")
+            try:
+                minimum = int(minimum)
+            except ValueError:
+                raise ValueError(name + " must be an integer")
+            if minimum < 0:
+                raise ValueError(name + " must not be negative")
+        minimums.append(minimum)
+    return DocFilter(dates[0], dates[1], parse_list(params.get("author", [])), \
+        parse_list(params.get("category", [])), *minimums)
@@ -0,0 +1,58 @@
+"""Per-document statistics precomputed at index construction.
+
+doc_stats.bin holds two packed arrays of N little-endian doubles, indexed by doc_id:
+
+norm         : euclidean length of the lnc weight vector of the document over the whole
+               vocabulary, sqrt(sum((1 + log(tf))^2)) over all terms of the document
+frac_inlinks : fraction of all inbound links of the collection pointing to the document
+
+field_lengths.bin holds one packed array of N little-endian unsigned 32 bit integers per
+field of FIELDS, in that order: the number of terms of the field of every document.
+"""
+
+import array
+import sys
+
+# fields of a post indexed separately, in the order of their term frequencies in the index
+FIELDS = ["title", "author", "category", "post_text"]
+
+def write_doc_stats(filename, norms, frac_inlinks):
+    """Write the arrays @norms and @frac_inlinks (one value per doc_id) to @filename."""
+    packed = array.array("d", norms)
+    packed.extend(frac_inlinks)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    with open(filename, mode="wb") as f:
+        f.write(packed.tobytes())
+
+def load_doc_stats(filename):
+    """Return the arrays (norms, frac_inlinks) stored in @filename."""
+    packed = array.array("d")
+    with open(filename, mode="rb") as f:
+        packed.frombytes(f.read())
+    if sys.byteorder == "big":
+        packed.byteswap()
+    N = len(packed) // 2
+    return (packed[ : N], packed[N : ])
+
+def write_field_lengths(filename, field_lengths):
+    """Write @field_lengths, the number of terms of every field of FIELDS (one list per \
+field, one value per doc_id), to @filename."""
+    packed = array.array("I")
+    for lengths in field_lengths:
+        packed.extend(lengths)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    with open(filename, mode="wb") as f:
+        f.write(packed.tobytes())
+
+def load_field_lengths(filename):
+    """Return the number of terms of every field of FIELDS stored in @filename, one array \
+per field."""
+    packed = array.array("I")
+    with open(filename, mode="rb") as f:
+        packed.frombytes(f.read())
+    if sys.byteorder == "big":
+        packed.byteswap()
+    N = len(packed) // len(FIELDS)
+    return [packed[i * N : (i + 1) * N] for i in range(len(FIELDS))]
@@ -0,0 +1,101 @@
+"""Memory-mapped document store: the fields of every post, readable by doc_id in O(1).
+
+A store is a directory holding one or two files per column, built at index construction:
+
+numeric columns : NAME.bin, a packed array of N little-endian signed 64 bit integers
+                  (the date is stored as seconds since the epoch, read as UTC)
+text columns    : NAME.blob, the utf-8 values one after the other, and NAME.offsets, a
+                  packed array of N + 1 little-endian unsigned 64 bit integers, the value of
+                  doc_id being blob[offsets[doc_id] : offsets[doc_id + 1]]
+
+The files are memory-mapped, so opening a store reads nothing and only the pages of the
+fetched documents are ever loaded.
+"""
+
+import os
+import mmap
+import array
+import struct
+import sys
+import calendar
+import time
+
+NUMERIC_COLUMNS = ["date", "post_length", "num_outlinks", "num_inlinks", "num_comments"]
+TEXT_COLUMNS = ["title", "author", "category", "comments_url", "post_url"]
+COLUMNS = NUMERIC_COLUMNS + TEXT_COLUMNS
+
+# format of the date column of posts.csv, e.g. "Jan 30 2004 12:00AM"
+DATE_FORMAT = "%b %d %Y %I:%M%p"
+
+INT = struct.Struct("<q")
+OFFSETS = struct.Struct("<QQ")
+
+def parse_date(date):
+    """Return the seconds since the epoch of @date written as in posts.csv."""
+    return calendar.timegm(time.strptime(date.strip(), DATE_FORMAT))
+
+def write_packed(filename, typecode, values):
+    """Atomically replace @filename with the little-endian packed array @values."""
+    packed = array.array(typecode, values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    with open(filename + ".tmp", mode="wb") as f:
+        f.write(packed.tobytes())
+    os.replace(filename + ".tmp", filename)
+
+def write_doc_store(directory, columns):
+    """Write the store @directory from @columns == { column: iterable of the string values \
+of the column, in order of doc_id } for every column of COLUMNS.
+
+    Every file is written under a temporary name and renamed, so the stores opened by
+    running searches keep their data."""
+    os.makedirs(directory, exist_ok=True)
+    for column in NUMERIC_COLUMNS:
+        if column == "date":
+            values = (parse_date(value) for value in columns[column])
+        else:
+            values = (int(value) for value in columns[column])
+        write_packed(directory + "/" + column + ".bin", "q", values)
+    for column in TEXT_COLUMNS:
+        offsets = array.array("Q", [0])
+        with open(directory + "/" + column + ".blob.tmp", mode="wb") as f:
+            for value in columns[column]:
+                data = value.encode("utf-8")
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+        os.replace(directory + "/" + column + ".blob.tmp", directory + "/" + column + ".blob")
+        write_packed(directory + "/" + column + ".offsets", "Q", offsets)
+
+def map_file(filename):
+    """Return a read-only memory map of @filename (an empty bytes if the file is empty)."""
+    with open(filename, mode="rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        # the map stays valid after the file is closed
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+class DocStore:
+    """The memory-mapped store @directory. Read-only, it can be shared by concurrent \
+threads."""
+
+    def __init__(self, directory):
+        self.numeric = {}
+        self.offsets = {}
+        self.blobs = {}
+        for column in NUMERIC_COLUMNS:
+            self.numeric[column] = map_file(directory + "/" + column + ".bin")
+        for column in TEXT_COLUMNS:
+            self.offsets[column] = map_file(directory + "/" + column + ".offsets")
+            self.blobs[column] = map_file(directory + "/" + column + ".blob")
+        self.N = len(self.numeric[NUMERIC_COLUMNS[0]]) // INT.size
+
+    def get(self, doc_id, column):
+        """Return the value of @column for the document @doc_id of the store."""
+        if column in self.numeric:
+            return INT.unpack_from(self.numeric[column], doc_id * INT.size)[0]
+        (start, end) = OFFSETS.unpack_from(self.offsets[column], doc_id * 8)
+        return self.blobs[column][start : end].decode("utf-8")
+
+    def document(self, doc_id):
+        """Return { column: value } of every column of the document @doc_id."""
+        return dict((column, self.get(doc_id, column)) for column in COLUMNS)
@@ -0,0 +1,454 @@
+"""Memory-mapped term dictionary: exact lookup, ordered iteration and prefix enumeration of
+the terms of an index without loading them.
+
+build_index.py writes term_dict.bin next to term_dict.txt, with the same entries:
+
+header  : HEADER, the number of terms, the number of blocks and the byte offset of the block
+          index, as little-endian unsigned 64 bit integers
+blocks  : the utf-8 terms in sorted order, in blocks of BLOCK_TERMS terms, front coded: every
+          term is stored as the length of the prefix it shares with the previous term of the
+          block (0 for the first one), the length of the rest and the rest, the lengths
+          variable-byte encoded (see postings.vbyte_encode)
+entries : the entry of every term, in the order of the terms, packed as ENTRY (df, offset,
+          length, max_weight, field_length, position_length, impact_length, see
+          build_index.write_index), so the entry of the i-th term is found in O(1)
+index   : the byte offset of every block, as little-endian unsigned 64 bit integers
+
+A term is found with a binary search on the first terms of the blocks and a scan of a single
+block. The file is memory-mapped, so opening a dictionary reads only the header and the block
+index, and only the pages of the terms looked up are ever loaded.
+
+Three more files of the same layout, with other entries, serve wildcard queries,
+autocompletion and spelling correction (see wildcard_terms, complete and fuzzy_terms):
+
+permuterm.bin   : every rotation of term + END, except END + term, mapped to the number of the
+                  term (its rank in term_dict.bin), as ROTATION. The terms matching A*B are
+                  those of the rotations starting with B + END + A.
+completions.bin : every prefix of more than NUM_COMPLETIONS terms mapped to the numbers of its
+                  NUM_COMPLETIONS terms of largest df, as COMPLETIONS.
+deletes.bin     : delete + END + term mapped to the number of the term, as ROTATION, for every
+                  string delete made by removing at most MAX_DISTANCE characters from the first
+                  PREFIX_LENGTH characters of a term in at least MIN_DF posts. A term within
+                  MAX_DISTANCE edits of a word shares a delete with it (a substitution is a
+                  deletion from both strings), so the candidates of a word are read from the keys
+                  starting with its deletes + END, a bounded number of lookups.
+"""
+
+import os
+import re
+import array
+import heapq
+import struct
+import sys
+import cache
+import doc_store
+import postings
+
+# number of terms, number of blocks, byte offset of the block index
+HEADER = struct.Struct("<QQQ")
+# df, offset, length, max_weight, field_length, position_length, impact_length
+ENTRY = struct.Struct("<IQIdIII")
+# number of terms of a block
+BLOCK_TERMS = 16
+# number of looked up terms kept decoded
+LOOKUP_CACHE_SIZE = 1 << 16
+# number of keys sorted in memory at a time by write_sorted
+MAX_SORTED_KEYS = 1 << 20
+# end of a term in its rotations, not a character of the terms
+END = "\x00"
+# number of the term of a rotation
+ROTATION = struct.Struct("<I")
+# df of a term of the whole collection in a shard (see shards.py)
+DF = struct.Struct("<I")
+# number of precomputed completions of a prefix
+NUM_COMPLETIONS = 10
+# numbers of the completions of a prefix, in decreasing order of df, NO_TERM after the last one
+COMPLETIONS = struct.Struct("<" + "I" * NUM_COMPLETIONS)
+NO_TERM = 0xFFFFFFFF
+# largest edit distance of the deletes, characters of a term deleted from, and df of the terms
+# in the deletes
+MAX_DISTANCE = 2
+PREFIX_LENGTH = 7
+MIN_DF = 3
+
+# cached for the terms not in the dictionary
+MISSING = ()
+
+class TermDictWriter:
+    """Writes the term dictionary @filename (see the layout above) from its entries, packed as \
+@entry_struct, added in sorted order of the terms, under a temporary name renamed by close()."""
+
+    def __init__(self, filename, entry_struct=ENTRY):
+        self.filename = filename
+        self.temp_file = filename + ".tmp"
+        self.flushed = False
+        self.entry_struct = entry_struct
+        self.blocks = bytearray()
+        self.entries = bytearray()
+        self.block_offsets = []
+        self.num_terms = 0
+        self.previous = b""
+
+    def add(self, term, entry):
+        """Add @term with its @entry, (df, offset, length, max_weight, field_length, \
+position_length, impact_length) by default, after every smaller term."""
+        data = term.encode("utf-8")
+        if self.num_terms % BLOCK_TERMS == 0:
+            self.block_offsets.append(HEADER.size + len(self.blocks))
+            shared = 0
+        else:
+            shared = len(os.path.commonprefix([self.previous, data]))
+        postings.vbyte_encode([shared, len(data) - shared], self.blocks)
+        self.blocks += data[shared : ]
+        self.entries += self.entry_struct.pack(*entry)
+        self.previous = data
+        self.num_terms += 1
+
+    def flush(self):
+        """Write the dictionary under its temporary name @temp_file, where it can be read with \
+TermDictionary before close(). No term can be added after."""
+        index_offset = HEADER.size + len(self.blocks) + len(self.entries)
+        block_offsets = array.array("Q", self.block_offsets)
+        if sys.byteorder == "big":
+            block_offsets.byteswap()
+        with open(self.temp_file, mode="wb") as f:
+            f.write(HEADER.pack(self.num_terms, len(self.block_offsets), index_offset))
+            f.write(self.blocks)
+            f.write(self.entries)
+            f.write(block_offsets.tobytes())
+        self.flushed = True
+
+    def close(self):
+        """Write the dictionary if flush() did not and replace @filename with it."""
+        if not self.flushed:
+            self.flush()
+        os.replace(self.temp_file, self.filename)
+
+class TermDictionary:
+    """The memory-mapped term dictionary @filename, read like a read-only dict { term: entry } \
+of the entries packed as @entry_struct (see TermDictWriter.add). It can be shared by \
+concurrent threads."""
+
+    def __init__(self, filename, entry_struct=ENTRY):
+        self.data = doc_store.map_file(filename)
+        self.entry_struct = entry_struct
+        (self.num_terms, self.num_blocks, index_offset) = HEADER.unpack_from(self.data, 0)
+        self.block_offsets = array.array("Q")
+        self.block_offsets.frombytes(self.data[index_offset : index_offset + \
+            self.num_blocks * self.block_offsets.itemsize])
+        if sys.byteorder == "big":
+            self.block_offsets.byteswap()
+        # the entries follow the blocks
+        self.entries_offset = index_offset - self.num_terms * entry_struct.size
+        # type(lookups) == { term: entry, MISSING if the term is not in the dictionary }
+        self.lookups = cache.LRUCache(LOOKUP_CACHE_SIZE)
+
+    def __len__(self):
+        return self.num_terms
+
+    def first_term(self, block_num):
+        """Return the first term of the block @block_num, utf-8 encoded."""
+        ([shared, length], pos) = postings.vbyte_decode(self.data, 2, \
+            self.block_offsets[block_num])
+        return self.data[pos : pos + length]
+
+    def find_block(self, data):
+        """Return the number of the last block whose first term is at most the utf-8 encoded \
+term @data, -1 if there is none."""
+        low = 0
+        high = self.num_blocks
+        while low < high:
+            middle = (low + high) // 2
+            if self.first_term(middle) <= data:
+                low = middle + 1
+            else:
+                high = middle
+        return low - 1
+
+    def block_terms(self, block_num):
+        """Return a generator of (term number, utf-8 encoded term) of the terms of the block \
+@block_num, in sorted order."""
+        pos = self.block_offsets[block_num]
+        term_num = block_num * BLOCK_TERMS
+        end = min(term_num + BLOCK_TERMS, self.num_terms)
+        data = b""
+        while term_num < end:
+            ([shared, length], pos) = postings.vbyte_decode(self.data, 2, pos)
+            data = data[ : shared] + self.data[pos : pos + length]
+            pos += length
+            yield (term_num, data)
+            term_num += 1
+
+    def entry(self, term_num):
+        """Return the entry of the term number @term_num."""
+        return self.entry_struct.unpack_from(self.data, self.entries_offset + \
+            term_num * self.entry_struct.size)
+
+    def term(self, term_num):
+        """Return the term number @term_num."""
+        for (block_term_num, block_term) in self.block_terms(term_num // BLOCK_TERMS):
+            if block_term_num == term_num:
+                return block_term.decode("utf-8")
+
+    def get(self, term, default=None):
+        """Return the entry of @term, @default if it is not in the dictionary."""
+        entry = self.lookups.get(term)
+        if entry is None:
+            entry = MISSING
+            data = term.encode("utf-8")
+            block_num = self.find_block(data)
+            if block_num >= 0:
+                for (term_num, block_term) in self.block_terms(block_num):
+                    if block_term >= data:
+                        if block_term == data:
+                            entry = self.entry(term_num)
+                        break
+            self.lookups.put(term, entry)
+        return default if entry == MISSING else entry
+
+    def __getitem__(self, term):
+        entry = self.get(term)
+        if entry is None:
+            raise KeyError(term)
+        return entry
+
+    def __contains__(self, term):
+        return self.get(term) is not None
+
+    def items(self, start=""):
+        """Return a generator of (term, entry) of the terms from @start (included), in sorted \
+order."""
+        data = start.encode("utf-8")
+        for block_num in range(max(0, self.find_block(data)), self.num_blocks):
+            for (term_num, block_term) in self.block_terms(block_num):
+                if block_term >= data:
+                    yield (block_term.decode("utf-8"), self.entry(term_num))
+
+    def keys(self, start=""):
+        """Return a generator of the terms from @start (included), in sorted order."""
+        return (term for (term, entry) in self.items(start))
+
+    def values(self):
+        """Return a generator of the entries of the terms, in sorted order of the terms."""
+        return (self.entry(term_num) for term_num in range(self.num_terms))
+
+    def __iter__(self):
+        return self.keys()
+
+    def prefix(self, prefix):
+        """Return a generator of (term, entry) of the terms starting with @prefix, in sorted \
+order."""
+        for (term, entry) in self.items(prefix):
+            if not term.startswith(prefix):
+                break
+            yield (term, entry)
+
+def open_dictionary(filename, entry_struct=ENTRY):
+    """Return the TermDictionary @filename of entries @entry_struct, None if it does not exist \
+(an index built before it)."""
+    if not os.path.exists(filename):
+        return None
+    return TermDictionary(filename, entry_struct)
+
+def write_sorted(filename, entry_struct, make_keys, max_keys=MAX_SORTED_KEYS):
+    """Write the dictionary @filename of entries @entry_struct from the (key, entry) of the \
+generators returned by @make_keys(), the same non-empty distinct keys in any order, sorting at \
+most @max_keys keys at a time (more if they start with the same character): a first pass \
+counts the keys starting with every character, then every pass sorts and writes the keys \
+starting with a range of characters. The first pass keeps the keys if there are at most \
+@max_keys of them, they are sorted and written right away."""
+    counts = {}
+    kept = []
+    for (key, entry) in make_keys():
+        counts[key[0]] = counts.get(key[0], 0) + 1
+        if kept is not None:
+            kept.append((key, entry))
+            if len(kept) > max_keys:
+                kept = None
+    writer = TermDictWriter(filename, entry_struct)
+    if kept is not None:
+        # the code points sort like their utf-8 encodings
+        kept.sort()
+        for (key, entry) in kept:
+            writer.add(key, entry)
+        writer.close()
+        return
+    # type(ranges) == [[first character, last character, number of keys]]
+    ranges = []
+    for char in sorted(counts):
+        if len(ranges) == 0 or ranges[-1][2] + counts[char] > max_keys:
+            ranges.append([char, char, 0])
+        ranges[-1][1] = char
+        ranges[-1][2] += counts[char]
+    for (first, last, num_keys) in ranges:
+        for (key, entry) in sorted((key, entry) for (key, entry) in make_keys() \
+            if first <= key[0] <= last):
+            writer.add(key, entry)
+    writer.close()
+
+def write_permuterm(term_dict, filename):
+    """Write the permuterm index @filename (see above) of the TermDictionary @term_dict, \
+generating the rotations from its terms (see write_sorted)."""
+
+    def rotations():
+        for (term_num, term) in enumerate(term_dict.keys()):
+            rotated = term + END
+            for i in range(len(term)):
+                yield (rotated[i : ] + rotated[ : i], (term_num,))
+
+    write_sorted(filename, ROTATION, rotations)
+
+def write_completions(term_dict, filename):
+    """Write the completions @filename (see above) of the TermDictionary @term_dict, computed \
+in a pass over its terms (see write_sorted). The completions of a prefix are its terms of \
+largest df, the first ones in sorted order among equal dfs."""
+
+    def completions():
+        # type(prefixes) == [[number of terms, heap of (df, -term number)]] of the prefixes of
+        # the last term, the i-th one of length i + 1
+        prefixes = []
+        previous = ""
+        for (term_num, (term, entry)) in enumerate(term_dict.items()):
+            # the prefixes of the previous term longer than the one they share have all their
+            # terms
+            shared = len(os.path.commonprefix([previous, term]))
+            for length in range(len(prefixes), shared, -1):
+                yield from prefix_completions(previous[ : length], prefixes.pop())
+            prefixes.extend([0, []] for length in range(shared, len(term)))
+            for prefix in prefixes:
+                prefix[0] += 1
+                if len(prefix[1]) < NUM_COMPLETIONS:
+                    heapq.heappush(prefix[1], (entry[0], -term_num))
+                else:
+                    heapq.heappushpop(prefix[1], (entry[0], -term_num))
+            previous = term
+        for length in range(len(prefixes), 0, -1):
+            yield from prefix_completions(previous[ : length], prefixes.pop())
+
+    def prefix_completions(prefix, count_top):
+        (count, top) = count_top
+        if count > NUM_COMPLETIONS:
+            term_nums = [-num for (df, num) in sorted(top, reverse=True)]
+            yield (prefix, tuple(term_nums + [NO_TERM] * (NUM_COMPLETIONS - len(term_nums))))
+
+    write_sorted(filename, COMPLETIONS, completions)
+
+def wildcard_regex(pattern):
+    """Return the compiled regular expression matching the terms matching @pattern, where * \
+stands for any characters."""
+    return re.compile(".*".join(re.escape(part) for part in pattern.split("*")))
+
+def wildcard_terms(pattern, term_dict, permuterm=None):
+    """Return [(term, entry)] of the terms of @term_dict matching @pattern, where * stands for \
+any characters, in sorted order of the terms. A pattern without * matches itself and a \
+pattern made of * only matches nothing. The terms of A* are those of the prefix A, the terms \
+of A*B are found in the rotations of the permuterm index @permuterm starting with B + END + A \
+(with the longest part between two * instead if A and B are empty) or by checking every term \
+starting with A if @permuterm is None, and the terms found are checked against @pattern."""
+    parts = pattern.split("*")
+    if len(parts) == 1:
+        entry = term_dict.get(pattern)
+        return [(pattern, entry)] if entry is not None else []
+    if all(len(part) == 0 for part in parts):
+        return []
+    if all(len(part) == 0 for part in parts[1 : ]):
+        return list(term_dict.prefix(parts[0]))
+    if permuterm is None or (len(parts[-1]) == 0 and len(parts[0]) > 0):
+        found = term_dict.prefix(parts[0])
+    else:
+        if len(parts[-1]) == 0:
+            key = max(parts, key=len)
+        else:
+            key = parts[-1] + END + parts[0]
+        # type(rotated) == { term number: term }, the rotations of a term can start with the
+        # longest part several times
+        rotated = {}
+        for (rotation, entry) in permuterm.prefix(key):
+            (end, sep, start) = rotation.partition(END)
+            rotated[entry[0]] = start + end
+        found = ((term, term_dict.entry(term_num)) for (term_num, term) in sorted(rotated.items()))
+    regex = wildcard_regex(pattern)
+    return [(term, entry) for (term, entry) in found if regex.fullmatch(term)]
+
+def complete(prefix, term_dict, completions=None):
+    """Return [(term, entry)] of the NUM_COMPLETIONS terms of @term_dict starting with @prefix \
+of largest df, in decreasing order of df, in sorted order of the terms among equal dfs. They \
+are read from @completions if @prefix is there, otherwise @prefix has at most NUM_COMPLETIONS \
+terms, or all of them must be read if @completions is None."""
+    if completions is not None:
+        term_nums = completions.get(prefix)
+        if term_nums is not None:
+            return [(term_dict.term(term_num), term_dict.entry(term_num)) \
+                for term_num in term_nums if term_num != NO_TERM]
+    # sorted keeps the order of the terms among equal dfs
+    return sorted(term_dict.prefix(prefix), key=lambda item: item[1][0], \
+        reverse=True)[ : NUM_COMPLETIONS]
+
+def deletes(word, max_distance):
+    """Return the set of the strings made by deleting at most @max_distance characters from \
+@word, @word included."""
+    found = {word}
+    last = {word}
+    for distance in range(max_distance):
+        last = set(string[ : i] + string[i + 1 : ] for string in last \
+            for i in range(len(string)))
+        found.update(last)
+    return found
+
+def write_deletes(term_dict, filename):
+    """Write the deletes @filename (see above) of the TermDictionary @term_dict, generated from \
+its terms and their df, entry[0] (see write_sorted)."""
+
+    def keys():
+        for (term_num, (term, entry)) in enumerate(term_dict.items()):
+            if entry[0] >= MIN_DF:
+                for delete in deletes(term[ : PREFIX_LENGTH], MAX_DISTANCE):
+                    yield (delete + END + term, (term_num,))
+
+    write_sorted(filename, ROTATION, keys)
+
+def edit_distance(a, b, max_distance):
+    """Return the number of insertions, deletions, substitutions and transpositions of two \
+adjacent characters turning @a into @b (optimal string alignment distance), max_distance + 1 \
+if it is larger than @max_distance."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    # type(previous), type(current) == [distance between a[ : i] and b[ : j] for every j], i
+    # = row number, 2 rows before for the transpositions
+    before = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] * (len(b) + 1)
+        for j in range(1, len(b) + 1):
+            distance = min(previous[j] + 1, current[j - 1] + 1, \
+                previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                distance = min(distance, before[j - 2] + 1)
+            current[j] = distance
+        if min(current) > max_distance:
+            return max_distance + 1
+        (before, previous) = (previous, current)
+    return min(previous[-1], max_distance + 1)
+
+def fuzzy_terms(word, max_distance, term_dict, deletes_dict=None):
+    """Return [(term, entry, distance)] of the terms of @term_dict in at least MIN_DF posts at \
+most @max_distance (up to MAX_DISTANCE) edits from @word (see edit_distance), in sorted order \
+of the terms. The candidates are read from the deletes @deletes_dict, or every term of \
+@term_dict is checked if it is None, and only their distance to @word is computed."""
+    if deletes_dict is None:
+        candidates = ((term, entry) for (term, entry) in term_dict.items() \
+            if entry[0] >= MIN_DF)
+    else:
+        # type(found) == { term number: term }
+        found = {}
+        for delete in deletes(word[ : PREFIX_LENGTH], max_distance):
+            for (key, entry) in deletes_dict.prefix(delete + END):
+                found[entry[0]] = key[len(delete) + 1 : ]
+        candidates = ((term, term_dict.entry(term_num)) for (term_num, term) \
+            in sorted(found.items()))
+    result = []
+    for (term, entry) in candidates:
+        distance = edit_distance(word, term, max_distance)
+        if distance <= max_distance:
+            result.append((term, entry, distance))
+    return result
@@ -0,0 +1,398 @@
+#!/usr/bin/python3
+
+"""Binary encoding of posting lists.
+
+The posting list of a term is stored as a single record in the postings file and the
+term dictionary stores the byte offset and the length of the record, so a posting list
+is retrieved with one seek and one read. The layout of a record depends on the codec the
+index was built with:
+
+raw     : packed array of the doc_ids in ascending order followed by packed array of
+          the tf of each doc_id, both as little-endian unsigned 32 bit integers
+vbyte   : df, then the gaps between consecutive doc_ids, then the tfs, every number
+          encoded with variable-byte encoding (7 bits per byte, high bit set on the
+          last byte of a number)
+bitpack : df, then the gaps and the tfs in blocks of BLOCK_SIZE numbers, every block
+          stored as 1 byte bit width b followed by the numbers packed in b bits each
+
+Every record is followed by the field record of the term: the tfs of the term in each field
+of the posts (title, author, category, text), one list of df numbers per field stored one
+after the other like the tfs of the record (packed, variable-byte or bitpacked). The tf of a
+posting is the sum of its field tfs, so only the rankings using fields read them.
+
+An index built with positions stores the positions record of the term after its field
+record: the positions of the term in every post of its posting list (tf positions per post,
+see POSITION_GAP), in blocks of POSITION_BLOCK_SIZE posts so that a phrase query decodes only
+the blocks of its candidate posts. The record starts with the byte length of every block,
+variable-byte encoded, then every block holds the positions of its posts one post after the
+other, each post as the gaps between its consecutive positions (the first position as is),
+stored like the tfs of the record (packed, variable-byte or bitpacked).
+
+An index built with impacts stores the impact record of the term after its positions record:
+its postings again, in decreasing order of their impact (the lnc weight of the term in the
+post, (1 + log(tf)) / length of the post) so that a query can read the postings with the
+largest impacts first and stop before the end. The postings are split into tiers, the
+TIER_SIZE postings of largest impact in the first one, then every tier twice as large as the
+previous one, each tier in blocks of IMPACT_BLOCK_SIZE postings stored as records of the
+codec (doc_ids ascending within a block and a tier), so that a post is looked up in a tier by
+decoding a single block. The record starts with the number of tiers, then for every tier the
+largest impact of its postings (little-endian double) and its number of blocks, then for
+every block the last doc_id of the block and its byte length, all variable-byte encoded
+except the impacts, then the blocks one after the other. The impact record of a term with at
+most TIER_SIZE postings is empty, its posting list is read as a single tier.
+"""
+
+import array
+import struct
+import sys
+
+# unsigned 32 bit integer on every platform we care about
+TYPECODE = "I"
+
+# number of integers in a bitpack block
+BLOCK_SIZE = 128
+
+DEFAULT_CODEC = "vbyte"
+
+# number of posts of a block of the positions record
+POSITION_BLOCK_SIZE = 32
+
+# the position of a term in a post is its number among the terms of the post (stopwords
+# removed), the fields of doc_stats.FIELDS one after the other, every field starting
+# POSITION_GAP positions after the end of the previous one, so that phrases and NEAR/k with
+# k < POSITION_GAP never match across fields
+POSITION_GAP = 100
+
+# flag of the 1st line of the term dictionary of an index with positions, after the codec
+POSITIONS_FLAG = "positions"
+
+# number of postings of the first tier of an impact record
+TIER_SIZE = 64
+
+# number of postings of a block of a tier of an impact record
+IMPACT_BLOCK_SIZE = 128
+
+# flag of the 1st line of the term dictionary of an index with impact records, after the
+# positions flag if any
+IMPACTS_FLAG = "impacts"
+
+# largest impact of the postings of a tier
+IMPACT_FORMAT = struct.Struct("<d")
+
+def _to_bytes(values):
+    """Return @values packed as little-endian unsigned 32 bit integers."""
+    packed = array.array(TYPECODE, values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tobytes()
+
+def _from_bytes(data):
+    """Return the array of unsigned 32 bit integers packed in @data."""
+    packed = array.array(TYPECODE)
+    packed.frombytes(data)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed
+
+def to_gaps(doc_ids):
+    """Return the differences between consecutive elements of the ascending @doc_ids, the \
+first doc_id is kept as is."""
+    gaps = []
+    prev = 0
+    for doc_id in doc_ids:
+        gaps.append(doc_id - prev)
+        prev = doc_id
+    return gaps
+
+def from_gaps(gaps):
+    """Return the doc_ids whose consecutive differences are @gaps."""
+    doc_ids = []
+    doc_id = 0
+    for gap in gaps:
+        doc_id += gap
+        doc_ids.append(doc_id)
+    return doc_ids
+
+def vbyte_encode(values, out):
+    """Append the variable-byte encoding of every element of @values to bytearray @out."""
+    for n in values:
+        while n >= 128:
+            out.append(n & 127)
+            n >>= 7
+        out.append(n | 128)
+
+def vbyte_decode(data, count, pos=0):
+    """Return the list of @count numbers variable-byte encoded in @data starting at byte \
+@pos, and the position right after the last one."""
+    values = []
+    n = 0
+    shift = 0
+    while len(values) < count:
+        byte = data[pos]
+        pos += 1
+        if byte & 128:
+            values.append(n | ((byte & 127) << shift))
+            n = 0
+            shift = 0
+        else:
+            n |= byte << shift
+            shift += 7
+    return (values, pos)
+
+def bitpack_encode(values, out):
+    """Append @values to bytearray @out in blocks of BLOCK_SIZE numbers packed with the \
+bit width of the largest number of the block."""
+    for start in range(0, len(values), BLOCK_SIZE):
+        block = values[start : start + BLOCK_SIZE]
+        width = max(block).bit_length()
+        packed = 0
+        for i, n in enumerate(block):
+            packed |= n << (i * width)
+        out.append(width)
+        out += packed.to_bytes((len(block) * width + 7) // 8, "little")
+
+def bitpack_decode(data, count, pos=0):
+    """Return the list of @count numbers bitpacked in @data starting at byte @pos, and the \
+position right after the last block."""
+    values = []
+    while len(values) < count:
+        n = min(BLOCK_SIZE, count - len(values))
+        width = data[pos]
+        length = (n * width + 7) // 8
+        packed = int.from_bytes(data[pos + 1 : pos + 1 + length], "little")
+        pos += 1 + length
+        mask = (1 << width) - 1
+        for i in range(n):
+            values.append((packed >> (i * width)) & mask)
+    return (values, pos)
+
+def raw_encode_stream(values, out):
+    """Append @values packed as little-endian unsigned 32 bit integers to bytearray @out."""
+    out += _to_bytes(values)
+
+def raw_decode_stream(data, count, pos=0):
+    """Return the list of @count numbers packed in @data starting at byte @pos, and the \
+position right after the last one."""
+    end = pos + count * array.array(TYPECODE).itemsize
+    return (list(_from_bytes(data[pos : end])), end)
+
+def raw_encode(doc_ids, tfs):
+    """Return the raw record of the posting list (@doc_ids, @tfs)."""
+    return _to_bytes(doc_ids) + _to_bytes(tfs)
+
+def raw_decode(data):
+    """Return the pair (doc_ids, tfs) stored in the raw record @data."""
+    values = _from_bytes(data)
+    df = len(values) // 2
+    return (values[ : df], values[df : ])
+
+def compressed_encoder(encode_stream):
+    """Return a record encoder storing df, the doc_id gaps and the tfs with @encode_stream."""
+    def encode(doc_ids, tfs):
+        out = bytearray()
+        vbyte_encode([len(doc_ids)], out)
+        encode_stream(to_gaps(doc_ids), out)
+        encode_stream(tfs, out)
+        return bytes(out)
+    return encode
+
+def compressed_decoder(decode_stream):
+    """Return a record decoder for records written by compressed_encoder(@decode_stream's \
+encoder)."""
+    def decode(data):
+        ([df], pos) = vbyte_decode(data, 1)
+        (gaps, pos) = decode_stream(data, df, pos)
+        (tfs, pos) = decode_stream(data, df, pos)
+        return (from_gaps(gaps), tfs)
+    return decode
+
+def raw_encode_fields(field_tfs):
+    """Return the raw field record of the tfs per field @field_tfs."""
+    return b"".join(_to_bytes(tfs) for tfs in field_tfs)
+
+def raw_decode_fields(data, df):
+    """Return the tfs per field stored in the raw field record @data of a term of df @df."""
+    values = _from_bytes(data)
+    return [values[start : start + df] for start in range(0, len(values), df)]
+
+def compressed_fields_encoder(encode_stream):
+    """Return a field record encoder storing the tfs of every field with @encode_stream."""
+    def encode_fields(field_tfs):
+        out = bytearray()
+        for tfs in field_tfs:
+            encode_stream(tfs, out)
+        return bytes(out)
+    return encode_fields
+
+def compressed_fields_decoder(decode_stream):
+    """Return a field record decoder for records written by \
+compressed_fields_encoder(@decode_stream's encoder)."""
+    def decode_fields(data, df):
+        field_tfs = []
+        pos = 0
+        while pos < len(data):
+            (tfs, pos) = decode_stream(data, df, pos)
+            field_tfs.append(tfs)
+        return field_tfs
+    return decode_fields
+
+def encode_positions_record(positions, encode_stream):
+    """Return the positions record of the ascending lists of positions @positions (one per \
+post of the posting list) storing the gaps with @encode_stream."""
+    blocks = []
+    for start in range(0, len(positions), POSITION_BLOCK_SIZE):
+        block = bytearray()
+        gaps = []
+        for post_positions in positions[start : start + POSITION_BLOCK_SIZE]:
+            gaps += to_gaps(post_positions)
+        encode_stream(gaps, block)
+        blocks.append(block)
+    out = bytearray()
+    vbyte_encode([len(block) for block in blocks], out)
+    for block in blocks:
+        out += block
+    return bytes(out)
+
+def decode_positions_record(data, tfs, indexes, decode_stream, blocks=None):
+    """Return the lists of positions of the posts number @indexes (ascending) of the posting \
+list with term frequencies @tfs, stored in the positions record @data, decoding only the \
+blocks holding them with @decode_stream. The decoded blocks are kept in the dict @blocks if \
+given, and not decoded again when they are found in it."""
+    if blocks is None:
+        blocks = {}
+    starts = blocks.get("starts")
+    if starts is None:
+        num_blocks = (len(tfs) + POSITION_BLOCK_SIZE - 1) // POSITION_BLOCK_SIZE
+        (lengths, pos) = vbyte_decode(data, num_blocks)
+        starts = []
+        for length in lengths:
+            starts.append(pos)
+            pos += length
+        blocks["starts"] = starts
+
+    positions = []
+    block_num = -1
+    for i in indexes:
+        if i // POSITION_BLOCK_SIZE != block_num:
+            block_num = i // POSITION_BLOCK_SIZE
+            block = blocks.get(block_num)
+            if block is None:
+                # decode the whole block, then split it between its posts
+                first = block_num * POSITION_BLOCK_SIZE
+                block_tfs = tfs[first : first + POSITION_BLOCK_SIZE]
+                (gaps, end) = decode_stream(data, sum(block_tfs), starts[block_num])
+                block = []
+                end = 0
+                for tf in block_tfs:
+                    block.append(from_gaps(gaps[end : end + tf]))
+                    end += tf
+                blocks[block_num] = block
+        positions.append(block[i - block_num * POSITION_BLOCK_SIZE])
+    return positions
+
+# type(CODECS) == { name: (encode, decode) }
+CODECS = {
+    "raw": (raw_encode, raw_decode),
+    "vbyte": (compressed_encoder(vbyte_encode), compressed_decoder(vbyte_decode)),
+    "bitpack": (compressed_encoder(bitpack_encode), compressed_decoder(bitpack_decode)),
+}
+
+# type(FIELD_CODECS) == { name: (encode_fields, decode_fields) }
+FIELD_CODECS = {
+    "raw": (raw_encode_fields, raw_decode_fields),
+    "vbyte": (compressed_fields_encoder(vbyte_encode), compressed_fields_decoder(vbyte_decode)),
+    "bitpack": (compressed_fields_encoder(bitpack_encode), \
+        compressed_fields_decoder(bitpack_decode)),
+}
+
+# type(STREAM_CODECS) == { name: (encode_stream, decode_stream) }
+STREAM_CODECS = {
+    "raw": (raw_encode_stream, raw_decode_stream),
+    "vbyte": (vbyte_encode, vbyte_decode),
+    "bitpack": (bitpack_encode, bitpack_decode),
+}
+
+def encode(doc_ids, tfs, codec=DEFAULT_CODEC):
+    """Return the record for the posting list with doc_ids @doc_ids (ascending) and term \
+frequencies @tfs using @codec."""
+    return CODECS[codec][0](doc_ids, tfs)
+
+def decode(data, codec=DEFAULT_CODEC):
+    """Return the pair (doc_ids, tfs) stored in the record @data written with @codec."""
+    return CODECS[codec][1](data)
+
+def encode_fields(field_tfs, codec=DEFAULT_CODEC):
+    """Return the field record for the tfs per field @field_tfs (one list of tfs per field, \
+in the order of the doc_ids of the record) using @codec."""
+    return FIELD_CODECS[codec][0](field_tfs)
+
+def decode_fields(data, df, codec=DEFAULT_CODEC):
+    """Return the tfs per field stored in the field record @data of a term of df @df written \
+with @codec."""
+    return FIELD_CODECS[codec][1](data, df)
+
+def encode_positions(positions, codec=DEFAULT_CODEC):
+    """Return the positions record for the ascending lists of positions @positions of the \
+term in every post of its posting list (in the order of the doc_ids of the record) using \
+@codec."""
+    return encode_positions_record(positions, STREAM_CODECS[codec][0])
+
+def decode_positions(data, tfs, indexes, codec=DEFAULT_CODEC, blocks=None):
+    """Return the lists of positions of the posts number @indexes (ascending) of the posting \
+list with term frequencies @tfs, stored in the positions record @data written with @codec, \
+keeping the decoded blocks in the dict @blocks if given (see decode_positions_record)."""
+    return decode_positions_record(data, tfs, indexes, STREAM_CODECS[codec][1], blocks)
+
+def encode_impacts(doc_ids, tfs, impacts, codec=DEFAULT_CODEC):
+    """Return the impact record of the posting list (@doc_ids, @tfs) whose postings have the \
+impacts @impacts, with the blocks of its tiers written with @codec, empty if it has at most \
+TIER_SIZE postings."""
+    if len(doc_ids) <= TIER_SIZE:
+        return b""
+    # decreasing impact, the smallest doc_ids first among equal impacts
+    order = sorted(range(len(doc_ids)), key=lambda i: (-impacts[i], doc_ids[i]))
+    header = bytearray()
+    body = bytearray()
+    num_tiers = 0
+    start = 0
+    size = TIER_SIZE
+    while start < len(order):
+        tier = sorted(order[start : start + size], key=lambda i: doc_ids[i])
+        blocks = []
+        for first in range(0, len(tier), IMPACT_BLOCK_SIZE):
+            block = tier[first : first + IMPACT_BLOCK_SIZE]
+            record = encode([doc_ids[i] for i in block], [tfs[i] for i in block], codec)
+            blocks.append((doc_ids[block[-1]], len(record)))
+            body += record
+        header += IMPACT_FORMAT.pack(impacts[order[start]])
+        vbyte_encode([len(blocks)], header)
+        for block in blocks:
+            vbyte_encode(block, header)
+        num_tiers += 1
+        start += size
+        size *= 2
+    out = bytearray()
+    vbyte_encode([num_tiers], out)
+    return bytes(out + header + body)
+
+def decode_impact_tiers(data):
+    """Return the tiers of the impact record @data, [(largest impact of the postings of the \
+tier, [last doc_id of every block], [(start, end) byte range of every block in @data])] in \
+decreasing order of impact."""
+    ([num_tiers], pos) = vbyte_decode(data, 1)
+    tiers = []
+    for tier_num in range(num_tiers):
+        (impact, ) = IMPACT_FORMAT.unpack_from(data, pos)
+        ([num_blocks], pos) = vbyte_decode(data, 1, pos + IMPACT_FORMAT.size)
+        (values, pos) = vbyte_decode(data, 2 * num_blocks, pos)
+        tiers.append((impact, values[0 : : 2], values[1 : : 2]))
+    # the blocks follow the header
+    start = pos
+    result = []
+    for (impact, last_doc_ids, lengths) in tiers:
+        ranges = []
+        for length in lengths:
+            ranges.append((start, start + length))
+            start += length
+        result.append((impact, last_doc_ids, ranges))
+    return result
@@ -0,0 +1,196 @@
+"""Ranking functions: how the documents matching a query are scored.
+
+Every ranking scores term at a time: a document gets, for every query term it contains, the
+weight of the term in the query times the weight of the term in the document, and the sum is
+blended with the fraction of inlinks of the document:
+
+    score = alpha * fraction of inlinks + (1 - alpha) * sum(weight_query(t) * weight(t, doc))
+
+cosine : lnc.ltc cosine similarity (the default)
+bm25   : Okapi BM25 over the whole post, tf saturated with K1 and normalized by the length
+         of the post with B
+bm25f  : BM25F, the tfs of the fields of the post (see doc_stats.FIELDS) are normalized by
+         the length of their field, weighted by a boost per field and summed before the
+         saturation, so a match in the title can weigh more than a match in the text
+
+The length normalizations of BM25 and BM25F depend only on the documents, they are computed
+once when the index is loaded (doc_length_norms), so scoring a posting costs about the same
+with every ranking.
+"""
+
+import math
+import array
+import doc_stats
+
+# score = alpha * frac_inlinks + (1 - alpha) * relevance
+ALPHA = 0.5
+
+# BM25 tf saturation and length normalization
+K1 = 1.2
+B = 0.75
+
+# weight of a match in every field for BM25F
+DEFAULT_BOOSTS = {"title": 2.0, "author": 1.0, "category": 1.0, "post_text": 1.0}
+
+def calc_query_weights(query_freq, posting_list, N):
+    """Return the normalized query weight vector (ltc) of the query with term frequencies \
+@query_freq."""
+
+    # type(weight_query) == {term: tf-idf == ltc }
+    weight_query = {}
+    for term, freq in query_freq.items():
+        query_tf = 1 + math.log(freq)
+        query_idf = math.log(N / posting_list[term][0])
+        weight_query[term] = query_tf * query_idf
+
+    # normalize query, c = euclidean
+    divide_by = math.sqrt( sum([ x**2 for x in weight_query.values() ]) )
+    if divide_by > 0:
+        for term, weight in weight_query.items():
+            weight_query[term] = weight / divide_by
+
+    return weight_query
+
+def length_norms(lengths, average=None):
+    """Return 1 - B + B * length / @average (the average of @lengths by default) for every \
+element of @lengths."""
+    if average is None:
+        average = sum(lengths) / len(lengths) if len(lengths) > 0 else 0.0
+    if average == 0:
+        return array.array("d", [1.0] * len(lengths))
+    return array.array("d", [1 - B + B * length / average for length in lengths])
+
+def doc_length_norms(field_lengths, averages=None):
+    """Return the per document statistics of BM25 and BM25F computed from @field_lengths \
+(the number of terms of every field of doc_stats.FIELDS, one array per field): (K1 * the \
+length normalization of every document, [1 / the length normalization of the field of every \
+document, for every field]). The average lengths are @averages == (average length of the \
+posts, [average length of every field]) if given (those of a whole sharded collection), \
+computed from @field_lengths otherwise."""
+    if averages is None:
+        averages = (None, [None] * len(field_lengths))
+    lengths = [sum(doc_lengths) for doc_lengths in zip(*field_lengths)]
+    bm25_norms = array.array("d", [K1 * norm for norm in length_norms(lengths, averages[0])])
+    field_norms = [array.array("d", [1 / norm for norm in length_norms(doc_lengths, average)]) \
+        for doc_lengths, average in zip(field_lengths, averages[1])]
+    return (bm25_norms, field_norms)
+
+class Ranking:
+    """Base class of the rankings, @alpha = weight of the fraction of inlinks in the score. \
+A ranking holds only its parameters, it can be shared by concurrent queries."""
+
+    name = None
+    # whether posting_weights needs the tfs per field of the posting lists
+    uses_fields = False
+
+    def __init__(self, alpha=ALPHA):
+        self.alpha = alpha
+
+    def key(self):
+        """Return the parameters the scores depend on, part of the key of cached results."""
+        return (self.name, self.alpha)
+
+    def query_weights(self, query_freq, posting_list, index):
+        """Return { term: weight } of the terms of the query @query_freq == { term: \
+frequency }, @posting_list holding their posting lists."""
+        raise NotImplementedError
+
+    def posting_weights(self, term, posting_list, field_tfs, index):
+        """Return the list of the weights of @term in the documents of its posting list \
+@posting_list == (df, doc_ids, tfs), @field_tfs holding its tfs per field if uses_fields."""
+        raise NotImplementedError
+
+class Cosine(Ranking):
+    """lnc.ltc cosine similarity, the document vectors normalized with index.doc_norms."""
+
+    name = "cosine"
+
+    def query_weights(self, query_freq, posting_list, index):
+        return calc_query_weights(query_freq, posting_list, index.N)
+
+    def posting_weights(self, term, posting_list, field_tfs, index):
+        (df, doc_ids, tfs) = posting_list
+        doc_norms = index.doc_norms
+        return [(1 + math.log(tf)) / doc_norms[doc_id] for doc_id, tf in zip(doc_ids, tfs)]
+
+class BM25(Ranking):
+    """Okapi BM25 over the whole post."""
+
+    name = "bm25"
+
+    def query_weights(self, query_freq, posting_list, index):
+        # idf that is never negative, even for terms in more than half of the posts
+        return dict((term, freq * math.log(1 + (index.N - posting_list[term][0] + 0.5) / \
+            (posting_list[term][0] + 0.5))) for term, freq in query_freq.items())
+
+    def posting_weights(self, term, posting_list, field_tfs, index):
+        (df, doc_ids, tfs) = posting_list
+        bm25_norms = index.bm25_norms
+        return [tf * (K1 + 1) / (tf + bm25_norms[doc_id]) for doc_id, tf in zip(doc_ids, tfs)]
+
+class BM25F(BM25):
+    """BM25F over the fields of the post, a match in a field weighted by @boosts[field] \
+(DEFAULT_BOOSTS for the missing fields)."""
+
+    name = "bm25f"
+    uses_fields = True
+
+    def __init__(self, alpha=ALPHA, boosts=None):
+        super().__init__(alpha)
+        self.boosts = dict(DEFAULT_BOOSTS)
+        if boosts is not None:
+            self.boosts.update(boosts)
+
+    def key(self):
+        return (self.name, self.alpha, tuple(self.boosts[field] for field in doc_stats.FIELDS))
+
+    def posting_weights(self, term, posting_list, field_tfs, index):
+        doc_ids = posting_list[1]
+        # boost, tfs and 1 / length normalization of every field
+        fields = [(self.boosts[field], field_tfs[i], index.field_norms[i]) \
+            for i, field in enumerate(doc_stats.FIELDS)]
+        weights = []
+        for i, doc_id in enumerate(doc_ids):
+            tf = sum(boost * (tfs[i] * norms[doc_id]) for (boost, tfs, norms) in fields)
+            weights.append(tf * (K1 + 1) / (tf + K1))
+        return weights
+
+# type(RANKINGS) == { name: class }
+RANKINGS = dict((ranking.name, ranking) for ranking in (Cosine, BM25, BM25F))
+
+def parse_boosts(string):
+    """Return { field: boost } written as "field:boost,field:boost" in @string."""
+    boosts = {}
+    for item in string.split(","):
+        (field, sep, boost) = item.partition(":")
+        boosts[field.strip()] = boost
+    return boosts
+
+def make_ranking(name="cosine", alpha=ALPHA, boosts=None):
+    """Return the ranking @name with the weight of the fraction of inlinks @alpha and, for \
+bm25f, the boosts per field @boosts ({ field: boost } or "field:boost,..."), raise ValueError \
+if they are not valid."""
+    if name not in RANKINGS:
+        raise ValueError("ranking must be one of " + ", ".join(sorted(RANKINGS.keys())))
+    # float() raises TypeError for null or a list
+    if isinstance(alpha, bool) or not isinstance(alpha, (int, float, str)):
+        raise ValueError("alpha must be a number")
+    try:
+        alpha = float(alpha)
+    except ValueError:
+        raise ValueError("alpha must be a number")
+    if not 0 <= alpha <= 1:
+        raise ValueError("alpha must be between 0 and 1")
+    if boosts is None:
+        return RANKINGS[name](alpha)
+    if name != "bm25f":
+        raise ValueError("boosts are only used by the bm25f ranking")
+    if isinstance(boosts, str):
+        boosts = parse_boosts(boosts)
+    if not isinstance(boosts, dict) or any(field not in DEFAULT_BOOSTS for field in boosts):
+        raise ValueError("boosts must map fields among " + ", ".join(doc_stats.FIELDS) + \
+            " to numbers")
+    boosts = dict((field, float(boost)) for field, boost in boosts.items())
+    if any(boost < 0 for boost in boosts.values()):
+        raise ValueError("boosts must not be negative")
+    return BM25F(alpha, boosts)
@@ -1,251 +1,1559 @@
 #!/usr/bin/python3
 
+import os
 import re
 import math
-import nltk
-import ast
+import array
 import sys
+import json
+import heapq
+import bisect
+import operator
+import itertools
+import threading
+import multiprocessing
+import postings
+import lexicon
+import doc_stats
+import doc_store
+import doc_filters
+import segments
+import shards
+import cache
+import stem_cache
+import tokenizer
+import rankings
+import vector_scoring
+import search_client
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
 from nltk.corpus import stopwords
-from porterstemmer import PorterStemmer
-from collections import OrderedDict
 
-term_file = "TUAW-dataset/data/term.txt"
-num_inlinks_file = "TUAW-dataset/data/num_inlinks.txt"
-term_line_num_file = "TUAW-dataset/data/term_line_num.txt"
+term_dict_file = "TUAW-dataset/data/term_dict.txt"
+
+# exact = score every matching document, wand = skip documents that cannot enter the top k,
+# impact = read the postings of largest impact first and stop when no other document can
+# enter the top k (wand and impact: cosine ranking only, the other rankings always use exact,
+# impact: queries without boolean operators and filters only, the others use exact)
+MODES = ("exact", "wand", "impact")
+
+# number of cached results, and seconds they are kept
+RESULT_CACHE_SIZE = 10000
+RESULT_CACHE_TTL = 300
+# number of postings of the cached posting lists
+POSTING_CACHE_SIZE = 1 << 20
+# key of the tfs per field of a term in the posting list cache, (FIELDS_KEY, term)
+FIELDS_KEY = "fields"
+# key of the positions of a term in a segment in the posting list cache,
+# (POSITIONS_KEY, segment number, term)
+POSITIONS_KEY = "positions"
+# key of the posts matching a filter in the posting list cache, (FILTER_KEY, filter key)
+FILTER_KEY = "filter"
+# key of the impact tiers of a term in a segment in the posting list cache,
+# (IMPACTS_KEY, segment number, term)
+IMPACTS_KEY = "impacts"
+# key of the terms of a wildcard in the posting list cache, (WILDCARD_KEY, pattern)
+WILDCARD_KEY = "wildcard"
+# key of the terms close to a word in the posting list cache, (FUZZY_KEY, word, max distance)
+FUZZY_KEY = "fuzzy"
+
+# a wildcard or a fuzzy word stands for at most MAX_EXPANSIONS terms, the first ones (largest
+# df for a wildcard) whose dfs add up to at most MAX_EXPANSION_DF (but always the first one)
+MAX_EXPANSIONS = 32
+MAX_EXPANSION_DF = 1 << 16
+# the characters of a wildcard pattern
+WILDCARD_RE = re.compile(r"[0-9A-Za-z*]+")
+# the last word of a query being typed
+LAST_WORD_RE = re.compile(r"[0-9A-Za-z]+$")
+# a fuzzy word, word~ or word~N (N = largest edit distance, lexicon.MAX_DISTANCE at most)
+FUZZY_RE = re.compile(r"([^~*]+)~(\d?)")
+# a term is corrected to a term in CORRECTION_RATIO times more posts, terms of at most
+# SHORT_WORD characters by a single edit, terms shorter than MIN_WORD are not corrected
+CORRECTION_RATIO = 10
+SHORT_WORD = 4
+MIN_WORD = 3
+
+# a "quoted phrase", a NEAR/k operator, a parenthesis or a word of a query, a phrase, an
+# opening parenthesis or a word may have a + or - prefix
+QUERY_RE = re.compile(r'[+-]?"([^"]*)"?|NEAR/(\d+)|[+-]?\(|\)|[^\s"()]+')
+# the words of a query that are boolean operators
+OPERATORS = ("AND", "OR", "NOT")
+# largest k of NEAR/k, terms of different fields of a post are never nearer
+MAX_NEAR = postings.POSITION_GAP - 1
+# occurrence of a clause in a group of a boolean query
+REQUIRED = 0
+OPTIONAL = 1
+EXCLUDED = 2
+# sorted lists are intersected with binary searches in the longer list, unless it is at most
+# SCAN_RATIO times longer than the other one, then it is scanned
+SCAN_RATIO = 4
+# the matches of a boolean query are scored alone if there are fewer than the postings of its
+# terms / number of terms / MATCH_SCORING_COST, the NumPy scorer is faster for more (see rank)
+MATCH_SCORING_COST = 100
 
 def parse_input():
-    """Read input from the user."""
-    if len(sys.argv) == 1 or len(sys.argv) > 3:
-        print("""Usage: ./search.py "query" [k]
-Returns the top k results of the search. The second argument is optional, by default k = 10.""")
+    """Read input from the user, return the query, k and the dict of --name=value options."""
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    options = {}
+    for arg in sys.argv[1:]:
+        if arg.startswith("--"):
+            (name, sep, value) = arg[2:].partition("=")
+            options[name] = value
+    if len(args) == 0 or len(args) > 2:
+        print("""Usage: ./search.py "query" [k] [--mode=exact|wand|impact]
+                   [--ranking=cosine|bm25|bm25f] [--alpha=0.5]
+                   [--boosts=title:2,author:1,category:1,post_text:1]
+                   [--from=YYYY-MM-DD] [--to=YYYY-MM-DD] [--author=name,...]
+                   [--category=name,...] [--min_comments=N] [--min_inlinks=N]
+                   [--shards[=host:port,...]]
+       ./search.py "partial query" [k] --complete
+Returns the top k results of the search. The second argument is optional, by default k = 10.
+Words can be combined with AND, OR, NOT and (parentheses), +word requires a word and -word
+excludes it. In an index built with --positions, the query can require a "quoted phrase" or
+two words at most k terms apart with word NEAR/k word. A word with * stands for the words
+of the index matching it (ipho*, *phone, i*ne), at most 32 of them, the most frequent, and
+word~ (word~1) for the words at most 2 (1) typing errors away from it.
+The results of a query with misspelled words follow "Did you mean" and the corrected query.
+--complete returns the k most frequent completions of the last word of the query instead.
+--mode=wand skips the documents that cannot make it to the top k (same results, faster).
+--mode=impact reads the postings of largest impact first and stops as soon as no other
+document can make it to the top k (same results, fastest on an index built with --impacts).
+--ranking chooses the ranking function, --alpha the weight of the fraction of inlinks in the
+score and --boosts the weight of a match in every field of the posts for bm25f.
+--from, --to, --author, --category, --min_comments and --min_inlinks only search the posts
+posted in that date range, by one of the authors, in one of the categories, with at least
+that many comments or inlinks.
+--shards searches the index built with build_index.py --shards=N with a worker process per
+shard, or with the search servers of the shards at host:port,... (search_server.py --shard).""")
         sys.exit(1)
-    elif len(sys.argv) == 2:
-        query_string = sys.argv[1]
+    elif len(args) == 1:
+        query_string = args[0]
         k = 10
     else:
-        query_string = sys.argv[1]
-        k = int(sys.argv[2])
+        query_string = args[0]
+        k = int(args[1])
         if k < 1 or k > 100000:
             print("Error! k must be between 1 and 100000, setting k = 10")
             k = 10
-    return (query_string, k)
+    return (query_string, k, options)
+
+def load_term_dict(filename=term_dict_file):
+    """Return the number of documents N, the term dictionary stored in @filename, the codec \
+of the posting lists and whether they have positions. Only the 1st line of @filename is read, \
+the entries of the terms are memory-mapped from the term_dict.bin next to it."""
+
+    # type(term_dict) == lexicon.TermDictionary { term: (df, offset, length, max_weight,
+    # field_length, position_length, impact_length) }
+    with open(filename, encoding="utf-8") as f:
+        header = f.readline().split()
+    N = int(header[0])
+    codec = header[1] if len(header) > 1 else "raw"
+    positions = postings.POSITIONS_FLAG in header[2 : ]
+    term_dict = lexicon.TermDictionary(os.path.dirname(filename) + "/term_dict.bin")
+    return (N, term_dict, codec, positions)
+
+class ImpactTier:
+    """A tier of the postings of a term in a segment (see postings.encode_impacts), number \
+@tier_num of the segment, whose postings have a lnc weight of at most @bound. Its blocks, \
+given by the last doc_id @last_doc_ids and the byte range @ranges in @data of each, are \
+decoded with @codec when they are needed, and kept in the dict @blocks shared by the tiers of \
+the term in the segment. @first_doc_id is the first doc_id of the segment."""
+
+    def __init__(self, tier_num, bound, last_doc_ids, ranges, data, codec, blocks, \
+        first_doc_id):
+        self.tier_num = tier_num
+        self.bound = bound
+        self.last_doc_ids = last_doc_ids
+        self.ranges = ranges
+        self.data = data
+        self.codec = codec
+        self.blocks = blocks
+        self.first_doc_id = first_doc_id
+
+    def block(self, block_num):
+        """Return (doc_ids, tfs) of the block @block_num of the tier."""
+        key = (self.tier_num, block_num)
+        block = self.blocks.get(key)
+        if block is None:
+            # concurrent queries may decode a block twice, both keep the same values
+            (start, end) = self.ranges[block_num]
+            block = postings.decode(self.data[start : end], self.codec)
+            self.blocks[key] = block
+        return block
+
+    def postings(self):
+        """Return a generator of (doc_id, tf) of the postings of the tier."""
+        for block_num in range(len(self.ranges)):
+            (doc_ids, tfs) = self.block(block_num)
+            for posting in zip(doc_ids, tfs):
+                yield posting
+
+    def find(self, doc_ids):
+        """Return { doc_id: tf } of the postings of the tier of the ascending @doc_ids. Only the \
+blocks that may hold them are decoded."""
+        found = {}
+        pos = bisect.bisect_left(doc_ids, self.first_doc_id)
+        for block_num, last_doc_id in enumerate(self.last_doc_ids):
+            if pos == len(doc_ids):
+                break
+            end = bisect.bisect_right(doc_ids, last_doc_id, pos)
+            if end > pos:
+                (block_doc_ids, tfs) = self.block(block_num)
+                for i in locate(block_doc_ids, doc_ids[pos : end]):
+                    found[block_doc_ids[i]] = tfs[i]
+                pos = end
+        return found
+
+class Segment:
+    """One segment of the index: its term dictionary, permuterm index, completions and \
+deletes, memory-mapped (see lexicon.py, the last three are None in an index built before \
+them), and its postings file, kept open so that it can still be read after a merge replaced \
+the segment."""
+
+    def __init__(self, directory):
+        (self.N, self.term_dict, self.codec, self.positions) = \
+            load_term_dict(directory + "/term_dict.txt")
+        self.permuterm = lexicon.open_dictionary(directory + "/permuterm.bin", lexicon.ROTATION)
+        self.completions = lexicon.open_dictionary(directory + "/completions.bin", \
+            lexicon.COMPLETIONS)
+        self.deletes = lexicon.open_dictionary(directory + "/deletes.bin", lexicon.ROTATION)
+        self.postings_fd = os.open(directory + "/postings.bin", os.O_RDONLY)
+
+    def __del__(self):
+        os.close(self.postings_fd)
+
+class Index:
+    """Everything needed to answer queries, loaded from disk once and kept in memory: the \
+main index, its delta segments, the deleted posts and the memory-mapped document stores, or \
+only the shard @shard of a sharded index (see shards.py) if given.
+
+    The index is only read after construction, so a single instance can serve concurrent
+    queries. A new instance must be loaded to see the changes made by build_index.py since
+    @version, with new empty caches: the caches of an instance never hold stale results.
+
+    A shard has its own doc_ids from 0 but scores its posts with the statistics of the whole
+    collection, and its search results hold the doc_ids of the collection."""
+
+    def __init__(self, shard=None):
+        self.shard = shard
+        self.version = self.current_version()
+        if shard is not None:
+            # a single segment, with the inlink fractions of the whole collection
+            manifest = None
+            segment_list = [(shard, 0, 0, 0)]
+        else:
+            manifest = segments.read_manifest()
+            if manifest is None:
+                segment_list = [(segments.MAIN, 0, 0, 0)]
+            else:
+                segment_list = manifest[1]
+        total_inlinks = sum(inlinks for (name, first, num_docs, inlinks) in segment_list)
+
+        # the segments hold consecutive doc_ids from 0, per document arrays are concatenated
+        self.segments = []
+        self.doc_stores = []
+        self.filter_indexes = []
+        self.first_doc_ids = []
+        self.doc_norms = array.array("d")
+        self.frac_inlinks = array.array("d")
+        self.field_lengths = [array.array("I") for field in doc_stats.FIELDS]
+        for (name, first_doc_id, num_docs, inlinks) in segment_list:
+            directory = segments.segment_dir(name) if shard is None else shards.shard_dir(name)
+            self.first_doc_ids.append(len(self.doc_norms))
+            self.segments.append(Segment(directory))
+            self.doc_stores.append(doc_store.DocStore(directory + "/doc_store"))
+            self.filter_indexes.append(doc_filters.FilterIndex(directory + "/doc_filters"))
+            (norms, fracs) = doc_stats.load_doc_stats(directory + "/doc_stats.bin")
+            if manifest is not None:
+                # fractions of the inlinks of the segment -> of the whole collection
+                scale = inlinks / total_inlinks if total_inlinks > 0 else 0.0
+                fracs = array.array("d", [frac * scale for frac in fracs])
+            self.doc_norms.extend(norms)
+            self.frac_inlinks.extend(fracs)
+            lengths = doc_stats.load_field_lengths(directory + "/field_lengths.bin")
+            for field, segment_lengths in enumerate(lengths):
+                self.field_lengths[field].extend(segment_lengths)
+
+        self.N = sum(segment.N for segment in self.segments)
+        # doc_id of the collection of the first post of the index
+        self.first_doc_id = 0
+        # type(global_dfs) == { term: df in the whole collection } for a shard, None otherwise
+        self.global_dfs = None
+        # the term dictionary (of dfs), permuterm index and deletes of the whole collection for
+        # a shard, each one None otherwise
+        (self.global_terms, self.global_permuterm, self.global_deletes) = (None, None, None)
+        averages = None
+        tombstones = segments.read_tombstones()
+        if shard is not None:
+            # the idf and the average lengths of the whole collection, so that the scores are
+            # those of the unsharded index
+            (self.N, total_lengths, self.global_dfs) = \
+                shards.read_global_stats(shards.shard_dir(shard))
+            averages = (sum(total_lengths) / self.N, \
+                [length / self.N for length in total_lengths])
+            (self.global_terms, self.global_permuterm, self.global_deletes) = \
+                shards.open_global_dictionaries(shards.shard_dir(shard))
+            self.first_doc_id = shards.first_doc_id(shard)
+            num_docs = len(self.doc_norms)
+            tombstones = [doc_id - self.first_doc_id for doc_id in tombstones \
+                if 0 <= doc_id - self.first_doc_id < num_docs]
+        # phrase and NEAR queries need the positions of every segment
+        self.positions = all(segment.positions for segment in self.segments)
+        self.max_frac_inlinks = max(self.frac_inlinks)
+        # document length normalizations of BM25 and BM25F
+        (self.bm25_norms, self.field_norms) = rankings.doc_length_norms(self.field_lengths, \
+            averages)
+        self.tombstones = frozenset(tombstones)
+        self.stopwords_set = frozenset(stopwords.words("english"))
+        # shared by the queries: stems of the words of the collection + cache of the others
+        self.stemmer = stem_cache.CachingStemmer(table=stem_cache.load_stem_table())
+        # type(stem_words) == { stem: [words of the collection with this stem] }, to show
+        # the completions
+        self.stem_words = {}
+        for (word, stem) in self.stemmer.table.items():
+            self.stem_words.setdefault(stem, []).append(word)
+        # results of repeated queries, and posting lists of the terms queried most recently
+        self.result_cache = cache.LRUCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+        self.posting_cache = cache.LRUCache(POSTING_CACHE_SIZE)
+        # exact mode scores with NumPy if it is installed, in pure Python otherwise
+        self.vector_scorer = None
+        if vector_scoring.available():
+            self.vector_scorer = vector_scoring.VectorScorer(self)
+
+    def current_version(self):
+        """Return the version of the index (or of the shard) on disk, see @version."""
+        if self.shard is not None:
+            return shards.shard_version(self.shard)
+        return segments.index_version()
+
+    def term_stats(self, term):
+        """Return (df, max_weight) of @term over all segments, None if it does not occur. The \
+df of a shard is the df in the whole collection, max_weight is 0 if the term occurs only in \
+other shards."""
+        df = 0
+        max_weight = 0.0
+        for segment in self.segments:
+            entry = segment.term_dict.get(term)
+            if entry is not None:
+                df += entry[0]
+                max_weight = max(max_weight, entry[3])
+        if self.global_dfs is not None:
+            df = self.global_dfs.get(term, 0)
+        if df == 0:
+            return None
+        return (df, max_weight)
+
+    def expand_wildcard(self, pattern):
+        """Return the terms matching the wildcard @pattern (see lexicon.wildcard_terms) in any \
+segment, at most MAX_EXPANSIONS of them in decreasing order of df, see MAX_EXPANSION_DF. A \
+shard looks them up in the dictionaries of the whole collection instead, so that the query has \
+the same terms in every shard. The terms may come from the posting list cache and must not be \
+modified."""
+        key = (WILDCARD_KEY, pattern)
+        terms = self.posting_cache.get(key)
+        if terms is None:
+            # type(dfs) == { term: df }
+            dfs = {}
+            if self.global_dfs is None:
+                for segment in self.segments:
+                    for (term, entry) in lexicon.wildcard_terms(pattern, segment.term_dict, \
+                        segment.permuterm):
+                        dfs[term] = dfs.get(term, 0) + entry[0]
+            elif self.global_terms is not None:
+                dfs = dict((term, entry[0]) for (term, entry) in \
+                    lexicon.wildcard_terms(pattern, self.global_terms, self.global_permuterm))
+            elif len(pattern.strip("*")) > 0:
+                # a shard built before the dictionaries of the collection
+                regex = lexicon.wildcard_regex(pattern)
+                dfs = dict((term, df) for (term, df) in self.global_dfs.items() \
+                    if regex.fullmatch(term))
+            terms = select_expansions(sorted(dfs.items(), key=lambda item: (-item[1], item[0])))
+            self.posting_cache.put(key, terms, max(1, len(terms)))
+        return terms
+
+    def fuzzy_terms(self, word, max_distance):
+        """Return { term: (df, distance) } of the terms in at least lexicon.MIN_DF posts of a \
+segment at most @max_distance edits from the term @word (see lexicon.fuzzy_terms), df over \
+all segments. A shard looks them up in the dictionaries of the whole collection instead, with \
+the df of the collection, so that the query has the same terms in every shard. They may come \
+from the posting list cache and must not be modified."""
+        key = (FUZZY_KEY, word, max_distance)
+        terms = self.posting_cache.get(key)
+        if terms is None:
+            terms = {}
+            if self.global_dfs is None:
+                for segment in self.segments:
+                    for (term, entry, distance) in lexicon.fuzzy_terms(word, max_distance, \
+                        segment.term_dict, segment.deletes):
+                        terms[term] = (terms.get(term, (0, distance))[0] + entry[0], distance)
+            elif self.global_terms is not None:
+                for (term, entry, distance) in lexicon.fuzzy_terms(word, max_distance, \
+                    self.global_terms, self.global_deletes):
+                    terms[term] = (entry[0], distance)
+            else:
+                # a shard built before the dictionaries of the collection
+                for (term, df) in self.global_dfs.items():
+                    if df >= lexicon.MIN_DF:
+                        distance = lexicon.edit_distance(word, term, max_distance)
+                        if distance <= max_distance:
+                            terms[term] = (df, distance)
+            self.posting_cache.put(key, terms, max(1, len(terms)))
+        return terms
+
+    def expand_fuzzy(self, word, max_distance=lexicon.MAX_DISTANCE):
+        """Return the terms at most @max_distance edits from the term @word (see fuzzy_terms), \
+@word itself first if it occurs, then the closest ones, of largest df among equal distances, \
+at most MAX_EXPANSIONS of them, see MAX_EXPANSION_DF."""
+        terms = dict(self.fuzzy_terms(word, max_distance))
+        stats = self.term_stats(word)
+        if stats is not None:
+            terms[word] = (stats[0], 0)
+        ranked = sorted((distance, -df, term) for (term, (df, distance)) in terms.items())
+        return select_expansions([(term, -negative_df) for (distance, negative_df, term) \
+            in ranked])
+
+    def correct(self, term):
+        """Return the correction of the query term @term, None if it needs none: a term of at \
+least MIN_WORD characters in fewer than lexicon.MIN_DF posts is corrected to the closest term \
+within lexicon.MAX_DISTANCE edits (SHORT_WORD characters: 1 edit) in CORRECTION_RATIO times \
+more posts, of largest df among equal distances."""
+        if len(term) < MIN_WORD:
+            return None
+        stats = self.term_stats(term)
+        df = stats[0] if stats is not None else 0
+        if df >= lexicon.MIN_DF:
+            return None
+        max_distance = 1 if len(term) <= SHORT_WORD else lexicon.MAX_DISTANCE
+        candidates = [(distance, -candidate_df, candidate) for (candidate, (candidate_df, \
+            distance)) in self.fuzzy_terms(term, max_distance).items() \
+            if candidate_df >= CORRECTION_RATIO * df]
+        if len(candidates) == 0:
+            return None
+        return min(candidates)[2]
+
+    def complete(self, prefix, k=lexicon.NUM_COMPLETIONS):
+        """Return [(term, df)] of the @k (at most lexicon.NUM_COMPLETIONS) terms starting \
+with @prefix of largest df, from the precomputed completions of every segment (see \
+lexicon.complete), in decreasing order of df. With several segments, a term that is not \
+among the completions of any segment is left out even if its df over all segments is \
+larger."""
+        if len(prefix) == 0:
+            return []
+        dfs = {}
+        for segment in self.segments:
+            for (term, entry) in lexicon.complete(prefix, segment.term_dict, \
+                segment.completions):
+                dfs[term] = dfs.get(term, 0) + entry[0]
+        if len(self.segments) > 1 or self.global_dfs is not None:
+            # the dfs of the segments where the term is not among the completions
+            dfs = dict((term, self.term_stats(term)[0]) for term in dfs)
+        return sorted(dfs.items(), key=lambda item: (-item[1], item[0]))[ : k]
+
+    def completion_word(self, term, prefix):
+        """Return the shortest word of the collection starting with @prefix with the stem \
+@term (the first one in sorted order among words of the same length), to show the \
+completion @term of @prefix, @term itself if there is none."""
+        words = [word for word in self.stem_words.get(term, ()) if word.startswith(prefix)]
+        if len(words) == 0:
+            return term
+        return min(words, key=lambda word: (len(word), word))
+
+    def get_field(self, doc_id, column):
+        """Return the value of @column (see doc_store.py) of the post @doc_id."""
+        seg_num = bisect.bisect_right(self.first_doc_ids, doc_id) - 1
+        return self.doc_stores[seg_num].get(doc_id - self.first_doc_ids[seg_num], column)
+
+    def get_document(self, doc_id):
+        """Return { column: value } of every column of the post @doc_id."""
+        seg_num = bisect.bisect_right(self.first_doc_ids, doc_id) - 1
+        return self.doc_stores[seg_num].document(doc_id - self.first_doc_ids[seg_num])
+
+    def filter_doc_ids(self, doc_filter):
+        """Return the ascending doc_ids of the posts matching the doc_filters.DocFilter \
+@doc_filter in every segment, None if it keeps every post. They may come from the posting \
+list cache and must not be modified."""
+        if doc_filter is None or doc_filter.is_empty():
+            return None
+        key = (FILTER_KEY, doc_filter.key())
+        doc_ids = self.posting_cache.get(key)
+        if doc_ids is None:
+            doc_ids = []
+            for first_doc_id, filter_index in zip(self.first_doc_ids, self.filter_indexes):
+                # later segments hold larger doc_ids
+                segment_doc_ids = doc_filter.doc_ids(filter_index)
+                doc_ids.extend(first_doc_id + doc_id for doc_id in segment_doc_ids)
+            self.posting_cache.put(key, doc_ids, max(1, len(doc_ids)))
+        return doc_ids
+
+    def get_posting_lists(self, terms):
+        """Return the posting lists of @terms over all segments, without the deleted posts. \
+They may come from the posting list cache and must not be modified."""
+
+        # type(posting list) == { term: (df, doc_ids, tfs) }, doc_ids in ascending order
+        posting_list = {}
+        cached = {}
+        missing = []
+        for term in terms:
+            entry = self.posting_cache.get(term)
+            if entry is not None:
+                cached[term] = entry
+            else:
+                missing.append(term)
+
+        for segment in self.segments:
+            segment_list = get_posting_list(missing, segment.term_dict, segment.codec, \
+                segment.postings_fd)
+            for term, (df, doc_ids, tfs) in segment_list.items():
+                if term in posting_list:
+                    # later segments hold larger doc_ids
+                    (prev_df, prev_doc_ids, prev_tfs) = posting_list[term]
+                    doc_ids = list(prev_doc_ids) + list(doc_ids)
+                    tfs = list(prev_tfs) + list(tfs)
+                    df += prev_df
+                posting_list[term] = (df, doc_ids, tfs)
+
+        if len(self.tombstones) > 0:
+            for term, (df, doc_ids, tfs) in posting_list.items():
+                live = [i for i, doc_id in enumerate(doc_ids) if doc_id not in self.tombstones]
+                if len(live) < len(doc_ids):
+                    posting_list[term] = (df, [doc_ids[i] for i in live], [tfs[i] for i in live])
+
+        if self.global_dfs is not None:
+            # the idf of the whole collection, empty lists for the terms of other shards
+            for term in missing:
+                if term in self.global_dfs:
+                    (df, doc_ids, tfs) = posting_list.get(term, (0, [], []))
+                    posting_list[term] = (self.global_dfs[term], doc_ids, tfs)
+
+        for term, entry in posting_list.items():
+            self.posting_cache.put(term, entry, max(1, len(entry[1])))
+        posting_list.update(cached)
+        return posting_list
 
-def get_posting_list(lines_to_get):
-    """Return the posting lists corresponding to each element of @lines_to_get"""
+    def get_field_tfs(self, terms):
+        """Return { term: tfs in every field of doc_stats.FIELDS } of @terms over all segments, \
+one list per field in the order of the doc_ids of get_posting_lists. They may come from the \
+posting list cache and must not be modified."""
 
-    # type(posting list) == { term: [df, {doc_id: tf}] }
+        # the cache holds the posting lists under the term, their tfs per field under
+        # (FIELDS_KEY, term)
+        field_tfs = {}
+        cached = {}
+        missing = []
+        for term in terms:
+            entry = self.posting_cache.get((FIELDS_KEY, term))
+            if entry is not None:
+                cached[term] = entry
+            else:
+                missing.append(term)
+
+        for segment in self.segments:
+            for term in missing:
+                if term not in segment.term_dict:
+                    continue
+                (df, offset, length, max_weight, field_length, position_length, \
+                    impact_length) = segment.term_dict[term]
+                # the field record follows the posting list
+                data = os.pread(segment.postings_fd, length + field_length, offset)
+                segment_tfs = postings.decode_fields(data[length : ], df, segment.codec)
+                if len(self.tombstones) > 0:
+                    doc_ids = postings.decode(data[ : length], segment.codec)[0]
+                    live = [i for i, doc_id in enumerate(doc_ids) if doc_id not in self.tombstones]
+                    segment_tfs = [[tfs[i] for i in live] for tfs in segment_tfs]
+                if term in field_tfs:
+                    # later segments hold larger doc_ids
+                    segment_tfs = [list(prev_tfs) + list(tfs) for prev_tfs, tfs \
+                        in zip(field_tfs[term], segment_tfs)]
+                field_tfs[term] = segment_tfs
+        if self.global_dfs is not None:
+            for term in missing:
+                if term not in field_tfs and term in self.global_dfs:
+                    # the term of other shards
+                    field_tfs[term] = [[] for field in doc_stats.FIELDS]
+
+        for term, entry in field_tfs.items():
+            self.posting_cache.put((FIELDS_KEY, term), entry, \
+                max(1, sum(len(tfs) for tfs in entry)))
+        field_tfs.update(cached)
+        return field_tfs
+
+    def get_positions(self, terms, doc_ids):
+        """Return { term: { doc_id: positions of the term in the post } } of @terms in the \
+posts @doc_ids (ascending), which must all contain every term. Only the blocks of the \
+positions records holding these posts are decoded, and they are kept with the record in the \
+posting list cache for the next queries (concurrent queries may decode a block twice, both \
+keep the same values). The positions may come from the cache and must not be modified."""
+        positions = dict((term, {}) for term in terms)
+        for seg_num, segment in enumerate(self.segments):
+            # the doc_ids of the segment
+            first = bisect.bisect_left(doc_ids, self.first_doc_ids[seg_num])
+            end = len(doc_ids)
+            if seg_num + 1 < len(self.segments):
+                end = bisect.bisect_left(doc_ids, self.first_doc_ids[seg_num + 1])
+            if first == end:
+                continue
+            for term in terms:
+                if term not in segment.term_dict:
+                    continue
+                key = (POSITIONS_KEY, seg_num, term)
+                entry = self.posting_cache.get(key)
+                if entry is None:
+                    (df, offset, length, max_weight, field_length, position_length, \
+                        impact_length) = segment.term_dict[term]
+                    # the positions record follows the field record
+                    data = os.pread(segment.postings_fd, length + field_length + \
+                        position_length, offset)
+                    (segment_doc_ids, tfs) = postings.decode(data[ : length], segment.codec)
+                    # sized for all the blocks decoded
+                    entry = (segment_doc_ids, tfs, data[length + field_length : ], {})
+                    self.posting_cache.put(key, entry, df + sum(tfs))
+                (segment_doc_ids, tfs, data, blocks) = entry
+                indexes = [bisect.bisect_left(segment_doc_ids, doc_id) \
+                    for doc_id in doc_ids[first : end]]
+                decoded = postings.decode_positions(data, tfs, indexes, segment.codec, blocks)
+                positions[term].update(zip(doc_ids[first : end], decoded))
+        return positions
+
+    def get_impact_tiers(self, term):
+        """Return the tiers of the postings of @term in every segment (see ImpactTier), the \
+posting list of a segment without impact record for the term as a single tier. They are kept \
+with their decoded blocks in the posting list cache for the next queries, and may include \
+deleted posts."""
+        tiers = []
+        for seg_num, segment in enumerate(self.segments):
+            if term not in segment.term_dict:
+                continue
+            key = (IMPACTS_KEY, seg_num, term)
+            segment_tiers = self.posting_cache.get(key)
+            if segment_tiers is None:
+                (df, offset, length, max_weight, field_length, position_length, \
+                    impact_length) = segment.term_dict[term]
+                first_doc_id = self.first_doc_ids[seg_num]
+                blocks = {}
+                if impact_length == 0:
+                    data = os.pread(segment.postings_fd, length, offset)
+                    blocks[(0, 0)] = postings.decode(data, segment.codec)
+                    segment_tiers = [ImpactTier(0, max_weight, [blocks[(0, 0)][0][-1]], \
+                        [(0, length)], data, segment.codec, blocks, first_doc_id)]
+                else:
+                    # the impact record follows the positions record
+                    data = os.pread(segment.postings_fd, impact_length, \
+                        offset + length + field_length + position_length)
+                    segment_tiers = [ImpactTier(tier_num, bound, last_doc_ids, ranges, data, \
+                        segment.codec, blocks, first_doc_id) for tier_num, \
+                        (bound, last_doc_ids, ranges) \
+                        in enumerate(postings.decode_impact_tiers(data))]
+                # sized for all the blocks decoded
+                self.posting_cache.put(key, segment_tiers, df)
+            tiers.extend(segment_tiers)
+        return tiers
+
+def get_posting_list(terms, term_dict, codec, postings_fd):
+    """Return the posting lists of the elements of @terms found in @term_dict, read from the \
+open postings file @postings_fd and decoded with @codec."""
+
+    # type(posting list) == { term: (df, doc_ids, tfs) }, doc_ids in ascending order
     posting_list = {}
-    current_index = 0
-    with open(term_file) as f:
-        for i, line in enumerate(f):
-            if i == lines_to_get[current_index]:
-                term_length = line.find(":") # format = term: [df: {doc_id, tf}]
-                term = line[0 : term_length]
-                # safely parse (but not evaluate) the value, result -> valid python object
-                value = ast.literal_eval(line[term_length + 1 : ])
-                posting_list[term] = value
-                current_index += 1
-                if(current_index == len(lines_to_get)):
-                    break
+    # read the posting lists in the order they appear in the file
+    terms = sorted([t for t in terms if t in term_dict], key=lambda t: term_dict[t][1])
+    for term in terms:
+        (df, offset, length, max_weight, field_length, position_length, impact_length) = \
+            term_dict[term]
+        # positional read, the file can be shared by concurrent queries
+        (doc_ids, tfs) = postings.decode(os.pread(postings_fd, length, offset), codec)
+        posting_list[term] = (df, doc_ids, tfs)
     
     return posting_list
 
-def calc_weights(query_freq, posting_list, N):
-    """Return the query weight vector @weight_query and the documents weight vectors @doc_dict."""
-    
-    # type(weight_query) == {term: tf-idf == ltc }
-    weight_query = {}
-    # type(doc_dict) == {doc_id: {term: tf-idf == lnc }}
-    doc_dict = {}
-
-    for term in query_freq.keys():
-            # query = ltc
-            query_tf = 1 + math.log( query_freq[term] )
-            # print(query_tf)
-            term_df = posting_list[term][0]
-            # print(term_df)
-            query_idf = math.log(N / term_df)
-            # print(query_idf)
-            weight_query[term] = query_tf * query_idf
-            
-            # document = lnc
-            weight_doc = {}
-            for doc_id in posting_list[term][1].keys():
-                doc_tf = 1 + math.log( posting_list[term][1][doc_id] )
-                doc_df = 1 # no
-                weight_doc[term] = doc_tf * doc_df
-                if doc_id in doc_dict:
-                    doc_dict[doc_id][term] = weight_doc[term]
-                else:
-                    doc_dict[doc_id] = {}
-                    doc_dict[doc_id][term] = weight_doc[term]
-
-    # normalize query, c = euclidean
-    divide_by = math.sqrt( sum([ x**2 for x in weight_query.values() ]) )
-    for term, weight in weight_query.items():
-        weight_query[term] = weight / divide_by
-    # normalize docs, c = euclidean
-    for doc_id, weight_doc in doc_dict.items():
-        divide_by = math.sqrt( sum( [ x**2 for x in weight_doc.values() ] ) )
-        for term, weight in weight_doc.items():
-            doc_dict[doc_id][term] = weight / divide_by
-
-    return (weight_query, doc_dict)
-
-def get_top_k(weight_query, doc_dict, k):
-    """Return doc_ids of the top @k documents that match the query based on cosine similarity \
-between query vector and document vectors and number of inbounds links to the post"""
-    
-    # find fraction of all inlinks to doc_id
-    total_num_inlinks = 0
-    frac_inlinks = {}
-    with open(num_inlinks_file) as f:
-        doc_ids_set = doc_dict.keys()
-        for i, line in enumerate(f):
-            total_num_inlinks += int(line.strip())
-            if i in doc_ids_set:
-                frac_inlinks[i] = int(line.strip())
-    
+def calc_scores(weight_query, posting_list, posting_weights):
+    """Return the relevance of every document of @posting_list for the query vector \
+@weight_query, @posting_weights holding the weights of every term in the documents of its \
+posting list (see rankings.Ranking.posting_weights)."""
 
-    for doc_id, frac in frac_inlinks.items():
-        frac_inlinks[doc_id] = frac / total_num_inlinks
+    # type(score) == {doc_id: relevance}
+    # term at a time, accumulate the contribution of every posting
+    score = {}
+    for term, query_weight in weight_query.items():
+        doc_ids = posting_list[term][1]
+        for doc_id, weight in zip(doc_ids, posting_weights[term]):
+            score[doc_id] = score.get(doc_id, 0.0) + weight * query_weight
 
-    # calculate score
-    # score = alpha * frac_inlinks + (1 - alpha) * cosine similarity
-    alpha = 0.5
+    return score
+
+def calc_cosine_scores(weight_query, posting_list, doc_norms):
+    """Return the cosine similarity between the query vector @weight_query and every document \
+of @posting_list, documents = lnc normalized with the precomputed lengths @doc_norms."""
+
+    # type(score) == {doc_id: cosine similarity}
+    # term at a time, accumulate the contribution of every posting
     score = {}
-    for doc_id, weight_doc in doc_dict.items():
-        cosine_score = 0
-        for term, weight in weight_doc.items():
-            cosine_score += weight_doc[term] * weight_query[term]
-        score[doc_id] = alpha * frac_inlinks[doc_id] + (1 - alpha) * cosine_score
-    
-    # sort based on score, high to low
-    sorted_score = OrderedDict( sorted(score.items(), key=lambda t: t[1], reverse=True) )
-    
-    # type(top_k) == {doc_id: [score, "doc_text"]}
-    # note top_k is not sorted based on score!
-    top_k = {}
-    num_results = 0
-    for doc_id, score in sorted_score.items():
-        num_results += 1
-        top_k[doc_id] = [score, ""]
-        if num_results == k:
+    for term, query_weight in weight_query.items():
+        (df, doc_ids, tfs) = posting_list[term]
+        for doc_id, tf in zip(doc_ids, tfs):
+            weight = (1 + math.log(tf)) / doc_norms[doc_id] * query_weight
+            score[doc_id] = score.get(doc_id, 0.0) + weight
+
+    return score
+
+def get_top_k(cosine_score, k, frac_inlinks, alpha=rankings.ALPHA):
+    """Return (doc_id, score) of the top @k documents that match the query based on their \
+cosine similarity (or other relevance) with the query @cosine_score and @frac_inlinks, the \
+fraction of all inbound links pointing to each post, weighted by @alpha, sorted by score, \
+high to low."""
+
+    # calculate score
+    score = ((doc_id, alpha * frac_inlinks[doc_id] + (1 - alpha) * cosine) \
+        for doc_id, cosine in cosine_score.items())
+
+    # bounded heap of size k, high to low
+    return heapq.nlargest(k, score, key=lambda t: t[1])
+
+def get_top_k_wand(weight_query, posting_list, k, index, alpha=rankings.ALPHA, matches=None):
+    """Return (doc_id, score) of the top @k documents for the query vector @weight_query, \
+same scoring as get_top_k, sorted by score, high to low, only the documents in @matches if \
+given.
+
+Document at a time with WAND pruning: the posting lists are walked in parallel in doc_id \
+order and a document is scored only if the upper bounds of the terms it may contain (from \
+the max_weight of the term dictionary) and of its inlink fraction can beat the current k-th \
+best score, the other postings are skipped with a binary search."""
+
+    # type(cursor) == [current doc_id, position, doc_ids, tfs, upper bound of the score,
+    # query weight]
+    cursors = []
+    for term, query_weight in weight_query.items():
+        (df, doc_ids, tfs) = posting_list[term]
+        if len(doc_ids) == 0: # every post of the term was deleted
+            continue
+        max_weight = index.term_stats(term)[1]
+        cursors.append([doc_ids[0], 0, doc_ids, tfs, (1 - alpha) * query_weight * max_weight, \
+            query_weight])
+    prior_bound = alpha * index.max_frac_inlinks
+    doc_norms = index.doc_norms
+    current_doc = operator.itemgetter(0)
+
+    # min heap of (score, doc_id), the k-th best score is the threshold to beat
+    top_k = []
+    threshold = -1.0
+
+    while len(cursors) > 0:
+        cursors.sort(key=current_doc)
+
+        # pivot = first cursor at which the sum of the upper bounds beats the threshold
+        bound = prior_bound
+        pivot = -1
+        for i, cursor in enumerate(cursors):
+            bound += cursor[4]
+            if bound > threshold:
+                pivot = i
+                break
+        if pivot == -1:
             break
-    return top_k
+        pivot_doc = cursors[pivot][0]
 
-def normalize(string, stemmer, stopwords_set):
-    """Return a list containg non-empty terms from @string after normalization using 
-@stopwords_set and @stemmer."""
+        if cursors[0][0] == pivot_doc:
+            # the cursors on pivot_doc are sorted first, score it fully
+            cosine = 0.0
+            for cursor in cursors:
+                if cursor[0] != pivot_doc:
+                    break
+                cosine += (1 + math.log(cursor[3][cursor[1]])) * cursor[5]
+                cursor[1] += 1
+                cursor[0] = cursor[2][cursor[1]] if cursor[1] < len(cursor[2]) else -1
+            score = alpha * index.frac_inlinks[pivot_doc] + \
+                (1 - alpha) * cosine / doc_norms[pivot_doc]
+            # a document not in matches is scored only to move the cursors past it
+            if matches is not None and pivot_doc not in matches:
+                pass
+            elif len(top_k) < k:
+                heapq.heappush(top_k, (score, pivot_doc))
+            elif score > threshold:
+                heapq.heapreplace(top_k, (score, pivot_doc))
+            if len(top_k) == k:
+                threshold = top_k[0][0]
+        else:
+            # no document before pivot_doc can beat the threshold, skip them
+            for cursor in cursors[ : pivot]:
+                cursor[1] = bisect.bisect_left(cursor[2], pivot_doc, cursor[1])
+                cursor[0] = cursor[2][cursor[1]] if cursor[1] < len(cursor[2]) else -1
 
-    # tokenize using punkt data
-    dummy_list = nltk.word_tokenize(string)
+        # drop the exhausted posting lists
+        if any(cursor[0] == -1 for cursor in cursors):
+            cursors = [cursor for cursor in cursors if cursor[0] != -1]
 
-    # remove stopwords
-    dummy_list = [word for word in dummy_list if word not in stopwords_set]
+    return [(doc_id, score) for (score, doc_id) in sorted(top_k, reverse=True)]
 
-    # split using special characters as delimiters
-    # example "50,000" -> ["50", "000"]
-    # example "." -> ["", ""]
-    term_list = []
-    for word in dummy_list:
-        term_list += re.split(r"[^0-9A-Za-z]", word)
-    
-    # stemming using Porter Stemmer
-    term_list = [stemmer.stem(word, 0, len(word) - 1) for word in term_list]
+def get_top_k_impact(weight_query, k, index, alpha=rankings.ALPHA):
+    """Return (doc_id, score) of the top @k documents for the query vector @weight_query, \
+same scoring as get_top_k, sorted by score, high to low.
+
+Impact ordered with early termination (threshold algorithm): the tiers of the postings of \
+the terms (see Index.get_impact_tiers) are read in decreasing order of the upper bound of \
+their contribution to the score, the new documents of a tier are scored at once by looking up \
+their postings of the other terms in the tiers not read yet, and the reading stops as soon as \
+the bounds of the next tier of every term and of the inlink fraction cannot beat the k-th best \
+score. The number of tiers read depends on k and on the scores of the best documents, not on \
+the length of the posting lists."""
+
+    terms = list(weight_query.items())
+    # type(unread) == [tiers of a term not read yet, largest bound first]
+    unread = [sorted(index.get_impact_tiers(term), key=lambda tier: tier.bound, reverse=True) \
+        for (term, query_weight) in terms]
+    prior_bound = alpha * index.max_frac_inlinks
+    doc_norms = index.doc_norms
+    scored = set()
+
+    # min heap of (score, -doc_id), the k-th best score is the threshold to beat
+    top_k = []
+    while True:
+        # bound of the score of the documents not scored yet, which have no posting in the
+        # tiers read, and term whose next tier has the largest bound
+        bound = prior_bound
+        best = -1
+        best_bound = -1.0
+        for i, ((term, query_weight), tiers) in enumerate(zip(terms, unread)):
+            if len(tiers) > 0:
+                term_bound = (1 - alpha) * query_weight * tiers[0].bound
+                bound += term_bound
+                if term_bound > best_bound:
+                    (best, best_bound) = (i, term_bound)
+        if best == -1 or (len(top_k) == k and top_k[0][0] > bound):
+            break
+
+        # the documents of the tier not scored yet have no posting in the tiers read
+        tier = unread[best].pop(0)
+        found = dict((doc_id, tf) for (doc_id, tf) in tier.postings() \
+            if doc_id not in scored and doc_id not in index.tombstones)
+        doc_ids = list(found.keys())
+        scored.update(doc_ids)
+        # type(term_tfs) == [{ doc_id: tf } of every term]
+        term_tfs = []
+        for i, tiers in enumerate(unread):
+            if i == best:
+                term_tfs.append(found)
+                continue
+            tfs = {}
+            for other_tier in tiers:
+                tfs.update(other_tier.find(doc_ids))
+            term_tfs.append(tfs)
 
-    # remove empty terms
-    term_list = [word for word in term_list if len(word) > 0]
+        for doc_id in doc_ids:
+            # in the order of the query, like the exact mode
+            cosine = 0.0
+            for (term, query_weight), tfs in zip(terms, term_tfs):
+                tf = tfs.get(doc_id)
+                if tf is not None:
+                    cosine += (1 + math.log(tf)) / doc_norms[doc_id] * query_weight
+            score = alpha * index.frac_inlinks[doc_id] + (1 - alpha) * cosine
+            if len(top_k) < k:
+                heapq.heappush(top_k, (score, -doc_id))
+            elif (score, -doc_id) > top_k[0]:
+                heapq.heapreplace(top_k, (score, -doc_id))
 
-    return term_list
+    return [(-doc_id, score) for (score, doc_id) in sorted(top_k, reverse=True)]
 
-def search(query_string, k, line_num_dict, N):
-    """Return top @k search results for @query_string from the corpus of @N documents using \
-@line_num_dict as a lookup table."""
-    stemmer = PorterStemmer()
-    stopwords_set = set(stopwords.words("english"))
+def select_expansions(ranked):
+    """Return the tuple of the terms a wildcard or a fuzzy word stands for, from the list \
+@ranked of (term, df) of the terms matching it, best first: the first MAX_EXPANSIONS terms \
+whose dfs add up to at most MAX_EXPANSION_DF, the first one always."""
+    terms = []
+    total_df = 0
+    for (term, df) in ranked:
+        if len(terms) == MAX_EXPANSIONS:
+            break
+        if len(terms) == 0 or total_df + df <= MAX_EXPANSION_DF:
+            terms.append(term)
+            total_df += df
+    return tuple(terms)
+
+def normalize(string, stemmer, stopwords_set):
+    """Return a generator of the non-empty terms of @string after normalization using \
+@stopwords_set and @stemmer (same terms as nltk tokenization, see tokenizer.py)."""
+    return tokenizer.normalize(string, stemmer, stopwords_set)
 
+def query_terms(query_string, index):
+    """Return { term: number of occurrences } of the terms of @query_string that occur in \
+@index."""
     # normalize the query
-    term_list = normalize(query_string, stemmer, stopwords_set)
-    
+    return count_terms(normalize(query_string, index.stemmer, index.stopwords_set), index)
+
+def count_terms(term_list, index):
+    """Return { term: number of occurrences } of the terms of @term_list that occur in \
+@index."""
     query_freq = {} # num of occurences of every unique term
     for term in term_list:
         if term in query_freq:
             query_freq[term] = query_freq[term] + 1
-        elif len(term) > 0: # add only term of non-zero length
+        elif len(term) > 0 and index.term_stats(term) is not None: # add only indexed terms of non-zero length
             query_freq[term] = 1
+    return query_freq
+
+def make_group(required, optional, excluded):
+    """Return the node of a group of a boolean query with the clauses @required, @optional and \
+@excluded, the clause itself if it is alone, None if there is no clause."""
+    if len(required) + len(optional) + len(excluded) == 0:
+        return None
+    if len(required) + len(optional) == 1 and len(excluded) == 0:
+        return (required + optional)[0]
+    return ("group", tuple(required), tuple(optional), tuple(excluded))
+
+class QueryParser:
+    """Recursive descent parser of the boolean queries of parse_query, one instance per query."""
+
+    def __init__(self, query_string, index):
+        # type(tokens) == [(token, phrase or None, k of NEAR/k or None)]
+        self.tokens = [match.group(0, 1, 2) for match in QUERY_RE.finditer(query_string)]
+        self.pos = 0
+        self.index = index
 
-    # retrieve only necessary posting lists in the order they appear in the file
-    lines_to_get = []
-    for term in query_freq.keys():
-        lines_to_get += [line_num_dict[term]]
-    lines_to_get.sort()
+    def peek(self):
+        """Return the current token, None at the end of the query."""
+        return self.tokens[self.pos][0] if self.pos < len(self.tokens) else None
+
+    def parse_group(self, nested=False):
+        """Return the node of the clauses up to the end of the query, or up to the ")" closing \
+the group if @nested (not consumed). Clauses joined by AND are required, like +clause, NOT \
+clause is excluded like -clause, the other clauses are optional, except phrases and NEAR \
+operators which are required unless they are operands of an OR."""
+        # type(clauses) == [[occurrence, nodes, operand of an OR]]
+        clauses = []
+        after_or = False
+        while self.peek() is not None:
+            token = self.peek()
+            if token == ")" and nested:
+                break
+            if token in (")", "AND", "OR"):
+                # an unbalanced ")" or an AND without left operand is ignored
+                self.pos += 1
+                if token == "OR":
+                    if len(clauses) > 0:
+                        clauses[-1][2] = True
+                    after_or = True
+                continue
+            (occurrence, nodes) = self.parse_and()
+            clauses.append([occurrence, nodes, after_or])
+            after_or = False
+
+        groups = ([], [], [])
+        for (occurrence, nodes, or_operand) in clauses:
+            for node in nodes:
+                if occurrence == OPTIONAL and not or_operand and node[0] in ("phrase", "near"):
+                    groups[REQUIRED].append(node)
+                else:
+                    groups[occurrence].append(node)
+        return make_group(*groups)
+
+    def parse_and(self):
+        """Return (occurrence, nodes) of the clauses joined by AND from the current token, \
+one optional group requiring all of them if there are several."""
+        operands = [self.parse_unary()]
+        while self.peek() == "AND":
+            self.pos += 1
+            if self.peek() not in (None, ")", "AND", "OR"):
+                operands.append(self.parse_unary())
+        if len(operands) == 1:
+            return operands[0]
+        required = []
+        excluded = []
+        for (occurrence, nodes) in operands:
+            (excluded if occurrence == EXCLUDED else required).extend(nodes)
+        group = make_group(required, [], excluded)
+        return (OPTIONAL, [group] if group is not None else [])
+
+    def parse_unary(self):
+        """Return (occurrence, nodes) of the clause at the current token, with its NOT, + or \
+- prefix if any."""
+        (token, phrase, near) = self.tokens[self.pos]
+        if token == "NOT":
+            self.pos += 1
+            return (EXCLUDED, self.parse_near())
+        # a + or - alone is not a prefix
+        if token[0] in "+-" and len(token) > 1:
+            self.tokens[self.pos] = (token[1 : ], phrase, near)
+            return (REQUIRED if token[0] == "+" else EXCLUDED, self.parse_near())
+        return (OPTIONAL, self.parse_near())
+
+    def parse_near(self):
+        """Return the nodes of the word, phrase or group at the current token and of the words \
+or phrases joined to it by NEAR/k operators: their terms and phrases, the operands of the \
+operators replaced by ("near", left, right, k) nodes (all of them in one required group if \
+the operators are chained). An operator next to a group, a wildcard or a fuzzy word (optional \
+groups of terms) is ignored, on either side."""
+        nodes = self.parse_primary()
+        previous = nodes
+        nears = []
+        operands = []
+        while self.pos < len(self.tokens) and self.tokens[self.pos][2] is not None:
+            k = max(1, min(int(self.tokens[self.pos][2]), MAX_NEAR))
+            self.pos += 1
+            # a NEAR/k operator without a word or phrase on both sides is ignored
+            if self.peek() in (None, "(", ")"):
+                break
+            following = self.parse_primary()
+            if len(previous) > 0 and len(following) > 0 and previous[-1][0] != "group" and \
+                following[0][0] != "group":
+                nears.append(("near", previous[-1], following[0], k))
+                operands.extend((previous[-1], following[0]))
+            nodes = nodes + following
+            previous = following
+        nodes = [node for node in nodes if not any(node is operand for operand in operands)]
+        if len(nears) > 1:
+            nears = [make_group(nears, [], [])]
+        return nodes + nears
+
+    def parse_primary(self):
+        """Return the nodes of the word, phrase or group at the current token: a ("term", \
+term) node per term of a word, the node of an optional group of the terms of a wildcard (a \
+word with *, see Index.expand_wildcard) or of every term of a fuzzy word (word~, see \
+Index.expand_fuzzy), a ("phrase", terms) node or the node of the group."""
+        if self.peek() in (None, ")"):
+            return []
+        (token, phrase, near) = self.tokens[self.pos]
+        self.pos += 1
+        if token == "(":
+            group = self.parse_group(nested=True)
+            if self.peek() == ")":
+                self.pos += 1
+            return [group] if group is not None else []
+        if near is not None:
+            return []
+        fuzzy = FUZZY_RE.fullmatch(token) if phrase is None else None
+        if fuzzy is not None:
+            max_distance = min(int(fuzzy.group(2) or lexicon.MAX_DISTANCE), lexicon.MAX_DISTANCE)
+            nodes = []
+            for term in normalize(fuzzy.group(1), self.index.stemmer, self.index.stopwords_set):
+                group = make_group([], [("term", expansion) \
+                    for expansion in self.index.expand_fuzzy(term, max_distance)], [])
+                if group is not None:
+                    nodes.append(group)
+            return nodes
+        if phrase is None and "*" in token:
+            # the pattern is matched against the terms, it is not stemmed
+            pattern = "".join(WILDCARD_RE.findall(token)).lower()
+            group = make_group([], [("term", term) \
+                for term in self.index.expand_wildcard(pattern)], [])
+            return [group] if group is not None else []
+        terms = tuple(normalize(token if phrase is None else phrase, self.index.stemmer, \
+            self.index.stopwords_set))
+        if phrase is not None and len(terms) > 0:
+            return [("phrase", terms)]
+        return [("term", term) for term in terms]
+
+def node_terms(node, excluded=False):
+    """Return a generator of (term, excluded) of the terms of the query @node in the order of \
+the query, excluded if a NOT or - applies to them."""
+    if node[0] == "term":
+        yield (node[1], excluded)
+    elif node[0] == "phrase":
+        for term in node[1]:
+            yield (term, excluded)
+    elif node[0] == "near":
+        for operand in node[1 : 3]:
+            yield from node_terms(operand, excluded)
+    else:
+        for occurrence in (REQUIRED, OPTIONAL, EXCLUDED):
+            for clause in node[1 + occurrence]:
+                yield from node_terms(clause, excluded or occurrence == EXCLUDED)
+
+def is_disjunction(node):
+    """Return True if the query @node matches the documents containing one of its terms: it \
+is a term or a group of optional terms and such groups."""
+    if node[0] == "group":
+        return len(node[1]) + len(node[3]) == 0 and all(is_disjunction(clause) \
+            for clause in node[2])
+    return node[0] == "term"
+
+def is_positional(node):
+    """Return True if the query @node needs positions, it has phrases or NEAR operators."""
+    if node[0] == "group":
+        return any(is_positional(clause) for clauses in node[1 : ] for clause in clauses)
+    return node[0] == "near" or (node[0] == "phrase" and len(node[1]) > 1)
+
+def parse_query(query_string, index):
+    """Return the terms of @query_string scored by the ranking as { term: number of \
+occurrences } (see query_terms) and the boolean query filtering the matching documents, None \
+if every document containing one of the terms matches.
+
+The query holds words, "quoted phrases", words or phrases at most k terms apart written \
+word NEAR/k word, groups in parentheses and the operators AND, OR and NOT, AND binding tighter \
+than OR, with the usual meaning. A +clause is required and a -clause excluded, the other \
+clauses of a group are optional: a document matches the group if it matches every required \
+clause, none of the excluded clauses and, if there are no required clauses, one of the \
+optional clauses. A word normalized to several terms stands for these terms, a word with * \
+for the terms matching it, any characters in place of the *, and a word~ (word~N) for the \
+terms at most lexicon.MAX_DISTANCE (N) edits from its terms.
+
+The boolean query is a tree of ("term", term), ("phrase", terms), ("near", term or phrase, \
+term or phrase, k) and ("group", required clauses, optional clauses, excluded clauses) \
+nodes. Raise ValueError if it has phrases or NEAR operators and @index has no positions."""
+    if not any(match.group(0)[0] in '"()' or match.group(1) is not None or \
+        match.group(2) is not None or (match.group(0)[0] in "+-" and len(match.group(0)) > 1) \
+        or match.group(0) in OPERATORS or "*" in match.group(0) or "~" in match.group(0) \
+        for match in QUERY_RE.finditer(query_string)):
+        # plain list of words
+        return (query_terms(query_string, index), None)
+
+    query = QueryParser(query_string, index).parse_group()
+    if query is None:
+        return ({}, None)
+    if is_positional(query) and not index.positions:
+        raise ValueError("phrase and NEAR queries need an index built with --positions")
+    query_freq = count_terms((term for (term, excluded) in node_terms(query) \
+        if not excluded), index)
+    if is_disjunction(query):
+        # the documents containing one of the terms
+        query = None
+    return (query_freq, query)
+
+def intersect(doc_id_lists):
+    """Return the doc_ids in every one of the ascending @doc_id_lists. The shortest list is \
+walked and every doc_id is searched in the others with a binary search starting after the \
+previous one, skipping the doc_ids in between, so the cost depends on the length of the \
+shortest list, not of the longest."""
+    doc_id_lists = sorted(doc_id_lists, key=len)
+    common = doc_id_lists[0]
+    for doc_ids in doc_id_lists[1 : ]:
+        common = [doc_ids[i] for i in locate(doc_ids, common)]
+    return list(common)
+
+def locate(doc_ids, targets):
+    """Return the positions in the ascending @doc_ids of the elements of the ascending \
+@targets they contain, each searched with a binary search starting after the previous one, \
+or with a scan of @doc_ids if it is at most SCAN_RATIO times longer than @targets."""
+    if len(doc_ids) <= len(targets) * SCAN_RATIO:
+        targets = set(targets)
+        return [pos for pos, doc_id in enumerate(doc_ids) if doc_id in targets]
+    found = []
+    pos = 0
+    end = len(doc_ids)
+    bisect_left = bisect.bisect_left
+    for doc_id in targets:
+        pos = bisect_left(doc_ids, doc_id, pos)
+        if pos == end:
+            break
+        if doc_ids[pos] == doc_id:
+            found.append(pos)
+    return found
+
+def unite(doc_id_lists):
+    """Return the doc_ids in one of the ascending @doc_id_lists, ascending."""
+    if len(doc_id_lists) == 1:
+        return doc_id_lists[0]
+    return sorted(set().union(*doc_id_lists))
+
+def subtract(doc_ids, excluded_doc_ids):
+    """Return the doc_ids of the ascending @doc_ids not in the ascending @excluded_doc_ids, \
+searched with a binary search starting after the previous one."""
+    excluded_doc_ids = set(excluded_doc_ids[i] for i in locate(excluded_doc_ids, doc_ids))
+    return [doc_id for doc_id in doc_ids if doc_id not in excluded_doc_ids]
+
+def match_phrase(phrase_positions):
+    """Return True if the terms whose positions in a post are @phrase_positions (one list per \
+term of the phrase) occur one right after the other."""
+    starts = set(phrase_positions[0])
+    for i, positions in enumerate(phrase_positions[1 : ], 1):
+        starts.intersection_update(position - i for position in positions)
+        if len(starts) == 0:
+            return False
+    return True
+
+def match_near(positions, other_positions, k):
+    """Return True if two different occurrences at @positions and @other_positions (both \
+ascending) are at most @k positions apart."""
+    i = 0
+    j = 0
+    while i < len(positions) and j < len(other_positions):
+        distance = abs(positions[i] - other_positions[j])
+        if 0 < distance <= k:
+            return True
+        if positions[i] < other_positions[j]:
+            i += 1
+        else:
+            j += 1
+    return False
+
+def match_node(node, posting_list, index):
+    """Return the ascending doc_ids of the posts matching the query @node (see parse_query) \
+using the posting lists @posting_list of its terms. The required clauses are intersected \
+first, so the cost of a group depends on its rarest clause, the excluded ones are only \
+searched for the doc_ids matching the others, and the positions are only read for the posts \
+containing every term of a phrase or NEAR operator."""
+    if node[0] == "term":
+        return posting_list[node[1]][1] if node[1] in posting_list else []
+
+    if node[0] == "phrase":
+        terms = node[1]
+        if any(term not in posting_list for term in terms):
+            return []
+        candidates = intersect([posting_list[term][1] for term in terms])
+        if len(terms) == 1 or len(candidates) == 0:
+            return candidates
+        positions = index.get_positions(set(terms), candidates)
+        return [doc_id for doc_id in candidates \
+            if match_phrase([positions[term][doc_id] for term in terms])]
+
+    if node[0] == "near":
+        (near, left, right, k) = node
+        candidates = intersect([match_node(left, posting_list, index), \
+            match_node(right, posting_list, index)])
+        if len(candidates) == 0:
+            return candidates
+        # the last term before the operator and the first one after it
+        term = left[1] if left[0] == "term" else left[1][-1]
+        other_term = right[1] if right[0] == "term" else right[1][0]
+        positions = index.get_positions(set((term, other_term)), candidates)
+        return [doc_id for doc_id in candidates \
+            if match_near(positions[term][doc_id], positions[other_term][doc_id], k)]
+
+    (group, required, optional, excluded) = node
+    if len(required) > 0:
+        doc_ids = intersect([match_node(clause, posting_list, index) for clause in required])
+    elif len(optional) > 0:
+        doc_ids = unite([match_node(clause, posting_list, index) for clause in optional])
+    else:
+        return []
+    for clause in excluded:
+        if len(doc_ids) == 0:
+            break
+        doc_ids = subtract(doc_ids, match_node(clause, posting_list, index))
+    return doc_ids
+
+def match_query(query, posting_list, index):
+    """Return the ascending doc_ids of the posts matching the boolean query @query (see \
+parse_query) using the posting lists @posting_list of its terms, None if @query is None."""
+    if query is None:
+        return None
+    return list(match_node(query, posting_list, index))
+
+def filter_matches(matches, filtered):
+    """Return the ascending doc_ids of the matches @matches of a query (None = every document \
+containing one of its terms) kept by a filter, @filtered being the ascending doc_ids of the \
+posts it keeps (None = every post)."""
+    if filtered is None:
+        return matches
+    if matches is None:
+        return filtered
+    return intersect([matches, filtered])
+
+def get_top_k_matches(weight_query, posting_list, k, index, ranking, matches):
+    """Return (doc_id, score) of the top @k documents of the ascending @matches for the query \
+vector @weight_query scored with @ranking, same scoring as get_top_k, sorted by score, high to \
+low. Only the postings of the matches are scored, each searched in the posting lists with a \
+binary search starting after the previous one, so the cost depends on the number of matches, \
+not on the length of the posting lists."""
+    field_tfs = index.get_field_tfs(weight_query.keys()) if ranking.uses_fields else None
+    matched_list = {}
+    posting_weights = {}
+    for term in weight_query:
+        (df, doc_ids, tfs) = posting_list[term]
+        found = locate(doc_ids, matches)
+        matched_list[term] = (df, [doc_ids[i] for i in found], [tfs[i] for i in found])
+        matched_tfs = None
+        if field_tfs is not None:
+            matched_tfs = [[tfs[i] for i in found] for tfs in field_tfs[term]]
+        posting_weights[term] = ranking.posting_weights(term, matched_list[term], matched_tfs, \
+            index)
+    score = calc_scores(weight_query, matched_list, posting_weights)
+    return get_top_k(score, k, index.frac_inlinks, ranking.alpha)
+
+def rank(query_freq, posting_list, k, index, mode="exact", ranking=None, matches=None):
+    """Return top @k search results for the query @query_freq, scored with @ranking (cosine \
+by default, see rankings.py) using the posting lists @posting_list of its terms, as a list of \
+(doc_id, score, title, url) sorted by score, high to low. If @matches is given, only the \
+documents of the ascending list @matches are returned."""
+    if ranking is None:
+        ranking = rankings.Cosine()
+    if matches is not None and len(matches) == 0:
+        return []
+    weight_query = ranking.query_weights(query_freq, posting_list, index)
+    if matches is not None and (index.vector_scorer is None or len(matches) * \
+        len(weight_query) * MATCH_SCORING_COST <= sum(len(posting_list[term][1]) \
+        for term in weight_query)):
+        # few matches, e.g. of a conjunctive query, only their postings are scored
+        top_k = get_top_k_matches(weight_query, posting_list, k, index, ranking, matches)
+    elif mode == "impact" and ranking.name == "cosine" and matches is None:
+        top_k = get_top_k_impact(weight_query, k, index, ranking.alpha)
+    elif mode == "wand" and ranking.name == "cosine":
+        top_k = get_top_k_wand(weight_query, posting_list, k, index, ranking.alpha, \
+            None if matches is None else set(matches))
+    elif index.vector_scorer is not None:
+        top_k = index.vector_scorer.top_k(weight_query, posting_list, k, ranking, matches)
+    else:
+        field_tfs = index.get_field_tfs(weight_query.keys()) if ranking.uses_fields else None
+        posting_weights = dict((term, ranking.posting_weights(term, posting_list[term], \
+            field_tfs[term] if field_tfs is not None else None, index)) for term in weight_query)
+        score = calc_scores(weight_query, posting_list, posting_weights)
+        top_k = get_top_k(score, k, index.frac_inlinks, ranking.alpha)
+
+    # result = doc_id + score + title + url, the doc_id of the collection for a shard
+    result = []
+    for (doc_id, score) in top_k:
+        result.append((index.first_doc_id + doc_id, score, index.get_field(doc_id, "title"), \
+            index.get_field(doc_id, "post_url")))
+    return result
+
+def result_key(query_freq, query, k, mode, ranking, doc_filter):
+    """Return the key of the results of the query @query_freq, @query (see parse_query) in \
+the result cache, for the arguments @k, @mode, @ranking and @doc_filter of search()."""
+    # queries with the same terms, term frequencies, boolean query and filter have the same
+    # results (the modes can order documents with equal scores differently)
+    return (tuple(sorted(query_freq.items())), query, k, mode) + ranking.key() + \
+        (doc_filter.key() if doc_filter is not None else ())
+
+def search(query_string, k, index, mode="exact", ranking=None, doc_filter=None):
+    """Return top @k search results for @query_string using the resident @index, as a list \
+of (doc_id, score, title, url) sorted by score, high to low. @mode is one of MODES, @ranking a \
+rankings.Ranking (cosine by default) and @doc_filter a doc_filters.DocFilter restricting the \
+posts searched, if any. The query may use the boolean operators of parse_query. Raise \
+ValueError if the query has phrases or NEAR operators and @index has no positions."""
+    if ranking is None:
+        ranking = rankings.Cosine()
+    (query_freq, query) = parse_query(query_string, index)
 
     # if no word in the quey occurs in the data, posting list will be empty
-    if len(lines_to_get) == 0:
-        print("No results found")
-        sys.exit(0)
+    if len(query_freq) == 0:
+        return []
 
-    posting_list = get_posting_list(lines_to_get)
+    key = result_key(query_freq, query, k, mode, ranking, doc_filter)
+    result = index.result_cache.get(key)
+    if result is not None:
+        # a copy, the caller may modify it
+        return list(result)
 
-    (weight_query, doc_dict) = calc_weights(query_freq, posting_list, N)
-    
-    top_k = get_top_k(weight_query, doc_dict, k)
-
-    # result = doc_id + score + title + url
-    title_file = "TUAW-dataset/data/title.txt"
-    post_url_file = "TUAW-dataset/data/post_url.txt"
-
-    # sort based on doc_id for efficient retrieval
-    docs_to_get = []
-    for doc_id in top_k.keys():
-        docs_to_get += [doc_id]
-    docs_to_get.sort()
-
-    current_index = 0
-    with open(title_file) as title_fd, open(post_url_file) as post_url_fd:
-        lines = zip(title_fd, post_url_fd)
-        for i, line in enumerate(lines):
-            if i == docs_to_get[current_index]:
-                title_string = "Title = " + line[0]
-                post_url_string = "URL = " + line[1]
-                top_k[i][1] = title_string + post_url_string
-                current_index += 1
-                if current_index == len(docs_to_get):
-                    break
+    # the filter restricts the candidates before the posting lists are read
+    filtered = index.filter_doc_ids(doc_filter)
+    if filtered is not None and len(filtered) == 0:
+        index.result_cache.put(key, ())
+        return []
+
+    # retrieve only necessary posting lists, with the ones of the excluded terms
+    terms = set(query_freq.keys())
+    if query is not None:
+        terms.update(term for (term, excluded) in node_terms(query))
+    if mode == "impact" and ranking.name == "cosine" and query is None and filtered is None:
+        # get_top_k_impact reads the postings tier by tier, the query weights need the df only
+        posting_list = dict((term, (index.term_stats(term)[0], [], [])) for term in terms)
+    else:
+        posting_list = index.get_posting_lists(terms)
+
+    matches = filter_matches(match_query(query, posting_list, index), filtered)
+    result = rank(query_freq, posting_list, k, index, mode, ranking, matches)
+    index.result_cache.put(key, tuple(result))
+    return result
+
+def autocomplete(query_string, index, k=lexicon.NUM_COMPLETIONS):
+    """Return [(completed query, term, df)] of the @k (at most lexicon.NUM_COMPLETIONS) \
+completions of the last word of @query_string being typed, the terms starting with it of \
+largest df (see Index.complete), the word replaced by the shortest word of the collection \
+with the stem of the term. The words are not stemmed, [] if the query does not end with a \
+word."""
+    match = LAST_WORD_RE.search(query_string)
+    if match is None:
+        return []
+    prefix = match.group(0).lower()
+    return [(query_string[ : match.start()] + index.completion_word(term, prefix), term, df) \
+        for (term, df) in index.complete(prefix, k)]
+
+def suggest(query_string, index):
+    """Return @query_string with its misspelled words replaced by the shortest word of the \
+collection with the stem of their correction (see Index.correct), None if no word needs a \
+correction ("did you mean"). Stopwords, operators, wildcards and fuzzy words are kept."""
+    corrected = False
+    parts = []
+    end = 0
+    for match in tokenizer.ALNUM_RE.finditer(query_string):
+        word = match.group(0)
+        if word in OPERATORS or query_string[match.start() - 1 : match.start()] in ("*", "/") \
+            or query_string[match.end() : match.end() + 1] in ("*", "~", "/"):
+            continue
+        terms = list(normalize(word, index.stemmer, index.stopwords_set))
+        correction = index.correct(terms[0]) if len(terms) > 0 else None
+        if correction is not None:
+            parts.extend((query_string[end : match.start()], \
+                index.completion_word(correction, "")))
+            end = match.end()
+            corrected = True
+    if not corrected:
+        return None
+    return "".join(parts) + query_string[end : ]
+
+def shard_worker(shard, conn):
+    """Answer with the shard @shard the requests (query_string, k, mode, ranking, doc_filter) \
+received on the connection @conn, sending back (True, results of search()) or (False, error \
+message) if the query is not valid, until it receives None. Executed by the worker processes \
+of a Coordinator."""
+    index = Index(shard)
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        if index.current_version() != index.version:
+            index = Index(shard)
+        try:
+            conn.send((True, search(request[0], request[1], index, *request[2 : ])))
+        except ValueError as e:
+            conn.send((False, str(e)))
+    conn.close()
+
+def request_params(query_string, k, mode, ranking, doc_filter):
+    """Return the parameters of a request to search_server.py for the arguments of search()."""
+    params = {"query": query_string, "k": k, "mode": mode, "ranking": ranking.name, \
+        "alpha": ranking.alpha}
+    if ranking.name == "bm25f":
+        params["boosts"] = ranking.boosts
+    if doc_filter is not None:
+        params.update(doc_filter.params())
+    return params
+
+def query_worker(address, params):
+    """Return (True, results as returned by search()) of the search server at @address \
+(host:port) for the request @params, (False, error message) if the query is not valid."""
+    try:
+        results = search_client.query_server(params["query"], params["k"], params, \
+            "http://" + address)
+    except HTTPError as e:
+        if e.code != 400:
+            raise
+        return (False, json.loads(e.read().decode("utf-8"))["error"])
+    return (True, [(result["doc_id"], result["score"], result["title"], result["url"]) \
+        for result in results])
+
+class Coordinator:
+    """Answers queries over a sharded index (see shards.py) with one worker per shard: a \
+local process per shard listed in shards.txt, or the search servers at @addresses (host:port, \
+each started with search_server.py --shard=NAME) if given.
+
+    A query is sent to every worker at once. Each one returns its top k scored with the
+    statistics of the whole collection, so merging them gives the top k of the unsharded
+    index, documents with equal scores by doc_id. Concurrent threads can search at the same
+    time: a local worker answers one query at a time, the lock of its connection pairs a
+    request with its reply, and a search server opens a connection per query."""
+
+    def __init__(self, addresses=None):
+        self.addresses = addresses
+        # type(workers) == [(process, connection, lock of the connection)] of the local workers
+        self.workers = []
+        self.executor = None
+        if addresses is None:
+            for (name, first_doc_id, num_docs) in shards.read_shard_list():
+                (conn, worker_conn) = multiprocessing.Pipe()
+                process = multiprocessing.Process(target=shard_worker, args=(name, worker_conn), \
+                    daemon=True)
+                process.start()
+                worker_conn.close()
+                self.workers.append((process, conn, threading.Lock()))
+        else:
+            self.executor = ThreadPoolExecutor(len(addresses))
+
+    def search(self, query_string, k, mode="exact", ranking=None, doc_filter=None):
+        """Return the top @k search results for @query_string over all shards, same arguments \
+and results as search(). Raise ValueError if the query is not valid."""
+        if ranking is None:
+            ranking = rankings.Cosine()
+        if self.executor is None:
+            replies = []
+            # the locks are taken in the order of the workers and every one is released as soon
+            # as its worker replied, so another query can use that worker while this one waits
+            # for the others
+            num_locked = 0
+            try:
+                for (process, conn, lock) in self.workers:
+                    lock.acquire()
+                    num_locked += 1
+                    conn.send((query_string, k, mode, ranking, doc_filter))
+                for (process, conn, lock) in self.workers:
+                    replies.append(conn.recv())
+                    lock.release()
+            finally:
+                for (process, conn, lock) in self.workers[len(replies) : num_locked]:
+                    lock.release()
+        else:
+            params = request_params(query_string, k, mode, ranking, doc_filter)
+            replies = list(self.executor.map(lambda address: query_worker(address, params), \
+                self.addresses))
+        for (valid, reply) in replies:
+            if not valid:
+                raise ValueError(reply)
+        # the results of every shard are sorted by score, high to low
+        merged = heapq.merge(*[reply for (valid, reply) in replies], \
+            key=lambda result: (-result[1], result[0]))
+        return list(itertools.islice(merged, k))
+
+    def close(self):
+        """Stop the workers."""
+        for (process, conn, lock) in self.workers:
+            conn.send(None)
+            conn.close()
+            process.join()
+        self.workers = []
+        if self.executor is not None:
+            self.executor.shutdown()
 
-    # sort top_k based on score
-    result = OrderedDict( sorted(top_k.items(), key=lambda t: t[1][0], reverse=True) )
+def print_results(result):
+    """Print the search results @result returned by search()."""
+    if len(result) == 0:
+        print("No results found")
+        return
 
-    # print output
     num_results = 1
-    for doc_id, [score, details] in result.items():
-        print(str(num_results) + ". Doc_ID = " + str(doc_id) + " ; Score = " + str(result[doc_id][0]))
-        print(result[doc_id][1])
+    for (doc_id, score, title, post_url) in result:
+        print(str(num_results) + ". Doc_ID = " + str(doc_id) + " ; Score = " + str(score))
+        print("Title = " + title + "\nURL = " + post_url + "\n")
         num_results += 1
 
 def main():
-    line_num_dict = {}
-    N = 0
-    dummy_list = []
-    
+    (query_string, k, options) = parse_input()
+    if "complete" in options:
+        try:
+            index = Index()
+        except:
+            print("Error! Index not constructed. Execute build_index.py to search")
+            sys.exit(1)
+        for (completion, term, df) in autocomplete(query_string, index, k):
+            print(completion + " ; df = " + str(df))
+        return
+    coordinator = None
     try:
-        f = open(term_line_num_file)
-        for line in f:
-            dummy_list += [line]
-        N = int(dummy_list[0])
-        for line in dummy_list[1:]:
-            temp = line.split(" ")
-            term = temp[0].strip()
-            line_num = int(temp[1].strip())
-            line_num_dict[term] = line_num
+        if "shards" in options:
+            # local workers, or the search servers serving the shards
+            addresses = options["shards"].split(",") if len(options["shards"]) > 0 else None
+            coordinator = Coordinator(addresses)
+        else:
+            index = Index()
     except:
         print("Error! Index not constructed. Execute build_index.py to search")
         sys.exit(1)
-    else:
-        f.close()
-    (query_string, k) = parse_input()
-    search(query_string, k, line_num_dict, N)
+    mode = options.get("mode", "exact")
+    if mode not in MODES:
+        print("Error! mode must be one of " + ", ".join(MODES))
+        sys.exit(1)
+    try:
+        ranking = rankings.make_ranking(options.get("ranking", "cosine"), \
+            options.get("alpha", rankings.ALPHA), options.get("boosts"))
+        doc_filter = doc_filters.make_filter(dict((name, value) \
+            for name, value in options.items() if name in doc_filters.PARAMETERS))
+    except ValueError as e:
+        print("Error! " + str(e))
+        sys.exit(1)
+    try:
+        if coordinator is not None:
+            result = coordinator.search(query_string, k, mode, ranking, doc_filter)
+        else:
+            result = search(query_string, k, index, mode, ranking, doc_filter)
+    except ValueError as e:
+        print("Error! " + str(e))
+        sys.exit(1)
+    except URLError as e:
+        print("Error! Cannot reach the search server of a shard: " + str(e.reason))
+        sys.exit(1)
+    finally:
+        if coordinator is not None:
+            coordinator.close()
+    if coordinator is None:
+        suggestion = suggest(query_string, index)
+        if suggestion is not None:
+            print("Did you mean: " + suggestion + "\n")
+    print_results(result)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
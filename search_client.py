@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+
+"""Thin client for search_server.py with the same usage and output as search.py.
+
+Usage: ./search_client.py "query" [k]
+
+The server address is read from the environment variable SEARCH_SERVER (default
+http://127.0.0.1:8765).
+"""
+
+import json
+import os
+import sys
+from urllib.request import Request, urlopen
+from urllib.error import URLError
+
+server_url = os.environ.get("SEARCH_SERVER", "http://127.0.0.1:8765")
+
+def parse_input():
+    """Read input from the user."""
+    if len(sys.argv) == 1 or len(sys.argv) > 3:
+        print("""Usage: ./search_client.py "query" [k]
+Returns the top k results of the search. The second argument is optional, by default k = 10.""")
+        sys.exit(1)
+    elif len(sys.argv) == 2:
+        query_string = sys.argv[1]
+        k = 10
+    else:
+        query_string = sys.argv[1]
+        k = int(sys.argv[2])
+        if k < 1 or k > 100000:
+            print("Error! k must be between 1 and 100000, setting k = 10")
+            k = 10
+    return (query_string, k)
+
+def query_server(query_string, k, params=None, url=None):
+    """Return the list of results of the server at @url (server_url by default) for \
+@query_string, @k and the other request parameters @params (see search_server.py)."""
+    body = dict(params) if params is not None else {}
+    body.update({"query": query_string, "k": k})
+    data = json.dumps(body).encode("utf-8")
+    request = Request((url if url is not None else server_url) + "/search", data=data, \
+        headers={"Content-Type": "application/json"})
+    with urlopen(request) as response:
+        return json.loads(response.read().decode("utf-8"))["results"]
+
+def main():
+    (query_string, k) = parse_input()
+    try:
+        results = query_server(query_string, k)
+    except URLError as e:
+        print("Error! Cannot reach the search server at " + server_url + ": " + str(e.reason))
+        sys.exit(1)
+
+    if len(results) == 0:
+        print("No results found")
+        return
+
+    # same output as search.print_results
+    num_results = 1
+    for result in results:
+        print(str(num_results) + ". Doc_ID = " + str(result["doc_id"]) + " ; Score = " + \
+            str(result["score"]))
+        print("Title = " + result["title"] + "\nURL = " + result["url"] + "\n")
+        num_results += 1
+
+if __name__ == "__main__":
+    main()
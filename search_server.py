@@ -0,0 +1,206 @@
+#!/usr/bin/python3
+
+"""Long-lived search server: loads the index once and answers queries over HTTP.
+
+Usage: ./search_server.py [port] [--shard=NAME]
+
+    POST /search    body = {"query": "your query", "k": 10, "mode": "exact", "ranking": "bm25f",
+                            "alpha": 0.5, "boosts": {"title": 2}, "from": "2006-01-01",
+                            "to": "2006-12-31", "author": ["erica sadun"],
+                            "category": ["software"], "min_comments": 5, "min_inlinks": 1}
+    GET  /search?query=your+query&k=10&mode=exact&ranking=bm25f&alpha=0.5&boosts=title:2
+                &from=2006-01-01&to=2006-12-31&author=erica+sadun&category=software
+                &min_comments=5&min_inlinks=1
+
+Both return {"results": [{"doc_id": .., "score": .., "title": .., "url": ..}, ...]}
+ranked by score, high to low.
+
+    POST /complete  body = {"query": "partial que", "k": 10}
+    GET  /complete?query=partial+que&k=10
+
+return {"completions": [{"query": "partial query", "term": .., "df": ..}, ...]}, the k (at
+most 10) most frequent completions of the last word of the query (see search.autocomplete).
+
+Every request is handled in its own thread. The index is
+loaded again as soon as build_index.py changes it (new delta segments, merges, deletions).
+
+With --shard=NAME the server answers with only the shard NAME of the index built with
+build_index.py --shards=N, as a worker of search.py --shards=host:port,... (see
+search.Coordinator). Its results hold the doc_ids of the collection.
+"""
+
+import json
+import sys
+import threading
+import rankings
+import search
+import lexicon
+import doc_filters
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+MAX_K = 100000
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """HTTP server answering each request in a new thread."""
+    daemon_threads = True
+
+    def current_index(self):
+        """Return the up to date index, reloading it if build_index.py changed it."""
+        if self.index.current_version() != self.index.version:
+            with self.reload_lock:
+                if self.index.current_version() != self.index.version:
+                    # queries in progress keep using the old index
+                    self.index = search.Index(self.index.shard)
+        return self.index
+
+def parse_k(params, default, maximum):
+    """Return the "k" of the request parameters @params, @default if there is none, raise \
+ValueError if it is not an integer between 1 and @maximum."""
+    k = params.get("k", default)
+    # int() raises TypeError for null and accepts true and 2.5
+    if isinstance(k, bool) or not isinstance(k, (int, str)):
+        raise ValueError("k must be an integer")
+    try:
+        k = int(k)
+    except ValueError:
+        raise ValueError("k must be an integer")
+    if k < 1 or k > maximum:
+        raise ValueError("k must be between 1 and " + str(maximum))
+    return k
+
+def parse_request(params):
+    """Return (query_string, k, mode, ranking, doc_filter) from the request parameters \
+@params, raise ValueError if they are not valid."""
+    query_string = params.get("query")
+    if not isinstance(query_string, str):
+        raise ValueError("query must be a string")
+    k = parse_k(params, 10, MAX_K)
+    mode = params.get("mode", "exact")
+    if mode not in search.MODES:
+        raise ValueError("mode must be one of " + ", ".join(search.MODES))
+    ranking = rankings.make_ranking(params.get("ranking", "cosine"), \
+        params.get("alpha", rankings.ALPHA), params.get("boosts"))
+    doc_filter = doc_filters.make_filter(params)
+    return (query_string, k, mode, ranking, doc_filter)
+
+def parse_complete_request(params):
+    """Return (query_string, k) of the /complete request parameters @params, raise ValueError \
+if they are not valid."""
+    query_string = params.get("query")
+    if not isinstance(query_string, str):
+        raise ValueError("query must be a string")
+    return (query_string, parse_k(params, lexicon.NUM_COMPLETIONS, lexicon.NUM_COMPLETIONS))
+
+def format_completions(completions):
+    """Return the completions @completions of search.autocomplete as a JSON serializable \
+dict."""
+    return {"completions": [{"query": query, "term": term, "df": df} \
+        for (query, term, df) in completions]}
+
+def format_results(result):
+    """Return the search results @result as a JSON serializable dict."""
+    return {"results": [{"doc_id": doc_id, "score": score, "title": title, "url": post_url} \
+        for (doc_id, score, title, post_url) in result]}
+
+class SearchHandler(BaseHTTPRequestHandler):
+    """Answer /search and /complete requests using the index of the server."""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = dict((key, values[0]) for key, values in parse_qs(url.query).items())
+        self.answer(url.path, params)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            params = json.loads(self.rfile.read(length).decode("utf-8"))
+            if not isinstance(params, dict):
+                raise ValueError("request body must be a JSON object")
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        self.answer(url.path, params)
+
+    def answer(self, path, params):
+        """Send the response to the request for @path with parameters @params."""
+        if path == "/complete":
+            try:
+                (query_string, k) = parse_complete_request(params)
+            except (ValueError, TypeError) as e:
+                self.send_json(400, {"error": str(e)})
+                return
+            try:
+                completions = search.autocomplete(query_string, self.server.current_index(), k)
+            except ValueError as e:
+                self.send_json(400, {"error": str(e)})
+                return
+            except Exception as e:
+                self.send_json(500, {"error": repr(e)})
+                return
+            self.send_json(200, format_completions(completions))
+            return
+        if path != "/search":
+            self.send_json(404, {"error": "unknown path " + path})
+            return
+        try:
+            (query_string, k, mode, ranking, doc_filter) = parse_request(params)
+        except (ValueError, TypeError) as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        try:
+            result = search.search(query_string, k, self.server.current_index(), mode, ranking, \
+                doc_filter)
+        except ValueError as e:
+            # a phrase query on an index without positions
+            self.send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            self.send_json(500, {"error": repr(e)})
+            return
+        self.send_json(200, format_results(result))
+
+    def send_json(self, status, body):
+        """Send @body encoded as JSON with HTTP status @status."""
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+def serve(index, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """Answer queries on @host:@port with the resident @index until interrupted."""
+    server = ThreadingHTTPServer((host, port), SearchHandler)
+    server.index = index
+    server.reload_lock = threading.Lock()
+    print("Serving on http://" + host + ":" + str(port) + "/search")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--shard=")]
+    shard = None
+    for arg in sys.argv[1:]:
+        if arg.startswith("--shard="):
+            shard = arg[len("--shard="):]
+    if len(args) > 1 or shard == "":
+        print("Usage: ./search_server.py [port] [--shard=NAME]")
+        sys.exit(1)
+    port = int(args[0]) if len(args) == 1 else DEFAULT_PORT
+    try:
+        index = search.Index(shard)
+    except:
+        print("Error! Index not constructed. Execute build_index.py to search")
+        sys.exit(1)
+    serve(index, port=port)
+
+if __name__ == "__main__":
+    main()
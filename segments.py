@@ -0,0 +1,138 @@
+"""Delta segments and tombstones for incremental index updates.
+
+The main index (postings.bin, term_dict.txt, term_dict.bin, doc_stats.bin in the data
+directory) can be followed by delta segments, each one a complete index of the same format
+over a range of new posts, stored in segments/NAME/. The manifest segments.txt lists them:
+
+    1st line = generation, incremented on every change of the list of segments
+    then one line per segment, in increasing order of doc_ids =
+    name first_doc_id num_docs total_inlinks
+
+where name "." is the main index and total_inlinks is the number of inlinks of the posts
+of the segment, used to turn the inlink fractions of the segment into fractions of the
+whole collection. Without a manifest the main index is the whole index.
+
+Deleted (or edited, then added again as new posts) posts are listed in tombstones.txt, one
+doc_id per line, and never returned by a search.
+"""
+
+import os
+import fcntl
+import shutil
+from contextlib import contextmanager
+
+index_dir = "TUAW-dataset/data"
+manifest_file = index_dir + "/segments.txt"
+tombstones_file = index_dir + "/tombstones.txt"
+lock_file = index_dir + "/segments.lock"
+merge_lock_file = index_dir + "/merge.lock"
+segments_dir = index_dir + "/segments"
+
+# name of the main index in the manifest
+MAIN = "."
+
+def segment_dir(name):
+    """Return the directory holding the files of segment @name."""
+    if name == MAIN:
+        return index_dir
+    return segments_dir + "/" + name
+
+def read_manifest():
+    """Return (generation, [(name, first_doc_id, num_docs, total_inlinks)]) from the \
+manifest, or None if the index has no delta segments."""
+    try:
+        f = open(manifest_file, encoding="utf-8")
+    except FileNotFoundError:
+        return None
+    with f:
+        generation = int(f.readline())
+        segment_list = []
+        for line in f:
+            (name, first_doc_id, num_docs, total_inlinks) = line.split(" ")
+            segment_list.append((name, int(first_doc_id), int(num_docs), int(total_inlinks)))
+    return (generation, segment_list)
+
+def write_manifest(generation, segment_list):
+    """Atomically replace the manifest with @generation and @segment_list."""
+    temp_file = manifest_file + ".tmp"
+    with open(temp_file, mode="w", encoding="utf-8") as f:
+        f.write(str(generation) + "\n")
+        for (name, first_doc_id, num_docs, total_inlinks) in segment_list:
+            f.write(name + " " + str(first_doc_id) + " " + str(num_docs) + " " + \
+                str(total_inlinks) + "\n")
+    os.replace(temp_file, manifest_file)
+
+@contextmanager
+def lock():
+    """Hold an exclusive lock on the list of segments, so that updates and merges running \
+in different processes do not overwrite each other's manifest."""
+    with open(lock_file, mode="w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+@contextmanager
+def merge_lock():
+    """Try to take the exclusive lock of the merges without waiting: yield True if it is \
+held until the end of the block, False if another process is merging. The lock goes away \
+with the process, so a crashed merge does not block the next ones."""
+    with open(merge_lock_file, mode="w") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def merging():
+    """Return True if a merge is running."""
+    with merge_lock() as acquired:
+        return not acquired
+
+def read_tombstones():
+    """Return the set of doc_ids of the deleted posts."""
+    try:
+        with open(tombstones_file) as f:
+            return set(int(line) for line in f if line.strip())
+    except FileNotFoundError:
+        return set()
+
+def add_tombstones(doc_ids):
+    """Mark the posts @doc_ids as deleted."""
+    with open(tombstones_file, mode="a") as f:
+        for doc_id in doc_ids:
+            f.write(str(doc_id) + "\n")
+
+def index_version():
+    """Return a value that changes whenever the index, its segments or its tombstones \
+change."""
+    version = []
+    for filename in (index_dir + "/term_dict.bin", manifest_file, tombstones_file):
+        try:
+            version.append(os.stat(filename).st_mtime_ns)
+        except FileNotFoundError:
+            version.append(0)
+    return tuple(version)
+
+def remove_unlisted(segment_list):
+    """Delete the directories of the delta segments that are not in @segment_list. The \
+caller must hold both the lock and the merge lock: updates build their segment and list it \
+under the lock, and only the holder of the merge lock builds a merged segment, so no \
+directory can be half-built."""
+    listed = set(name for (name, first_doc_id, num_docs, total_inlinks) in segment_list)
+    if os.path.isdir(segments_dir):
+        for name in os.listdir(segments_dir):
+            if name not in listed:
+                shutil.rmtree(segments_dir + "/" + name)
+
+def reset():
+    """Drop every delta segment, the main index now covers the whole collection."""
+    if os.path.exists(manifest_file):
+        os.remove(manifest_file)
+    if os.path.isdir(segments_dir):
+        shutil.rmtree(segments_dir)
@@ -0,0 +1,120 @@
+"""Sharded index: the posts split into shards answered by separate workers.
+
+build_index.py --shards=N splits the posts into N shards of consecutive doc_ids, each one a
+complete index of the same format as the main index (postings.bin, term_dict.txt,
+term_dict.bin, doc_stats.bin, field_lengths.bin, doc_store/, doc_filters/) stored in
+shards/NAME/, whose doc_ids start from 0. The list shards/shards.txt holds one line per shard,
+in increasing order of doc_ids =
+
+    name first_doc_id num_docs
+
+where first_doc_id is the doc_id of the collection of the first post of the shard. Every
+shard also holds the statistics of the whole collection, global_stats.txt:
+
+    1st line = N, then the total number of terms of every field of doc_stats.FIELDS
+    then one line per term of the collection = term df
+
+so that a shard scores its posts with the idf, the average lengths and the inlink fractions
+(stored in doc_stats.bin) of the whole collection, the same scores as the unsharded index.
+The terms of the whole collection are also in global_terms.bin, with their permuterm index
+in global_permuterm.bin and their deletes in global_deletes.bin (see lexicon.py), so that a
+shard expands the wildcards and fuzzy words of a query to the same terms as the others.
+"""
+
+import os
+import shutil
+import segments
+import lexicon
+
+shards_dir = segments.index_dir + "/shards"
+shard_list_file = shards_dir + "/shards.txt"
+
+def shard_dir(name):
+    """Return the directory holding the files of shard @name."""
+    return shards_dir + "/" + name
+
+def shard_ranges(num_docs, num_shards):
+    """Return [(start, end)] of @num_shards ranges of consecutive doc_ids of about the same \
+size covering the @num_docs posts."""
+    bounds = [num_docs * i // num_shards for i in range(num_shards + 1)]
+    return list(zip(bounds[ : -1], bounds[1 : ]))
+
+def read_shard_list():
+    """Return [(name, first_doc_id, num_docs)] of every shard, raise FileNotFoundError if \
+the index has no shards."""
+    shard_list = []
+    with open(shard_list_file, encoding="utf-8") as f:
+        for line in f:
+            (name, first_doc_id, num_docs) = line.split(" ")
+            shard_list.append((name, int(first_doc_id), int(num_docs)))
+    return shard_list
+
+def write_shard_list(shard_list):
+    """Atomically replace the list of shards with @shard_list."""
+    temp_file = shard_list_file + ".tmp"
+    with open(temp_file, mode="w", encoding="utf-8") as f:
+        for (name, first_doc_id, num_docs) in shard_list:
+            f.write(name + " " + str(first_doc_id) + " " + str(num_docs) + "\n")
+    os.replace(temp_file, shard_list_file)
+
+def first_doc_id(name):
+    """Return the doc_id of the collection of the first post of shard @name, raise \
+ValueError if there is no such shard."""
+    for (shard, first, num_docs) in read_shard_list():
+        if shard == name:
+            return first
+    raise ValueError("unknown shard " + name)
+
+def write_global_stats(directory, N, total_lengths, dfs):
+    """Write the statistics of the whole collection to @directory: the number of posts @N, \
+the total number of terms of every field @total_lengths and the df of every term @dfs == \
+{ term: df }."""
+    with open(directory + "/global_stats.txt", mode="w", encoding="utf-8") as f:
+        f.write(" ".join(str(value) for value in [N] + list(total_lengths)) + "\n")
+        for term in sorted(dfs.keys()):
+            f.write(term + " " + str(dfs[term]) + "\n")
+
+def write_global_dictionaries(directory, dfs):
+    """Write the term dictionary of the whole collection (entries: lexicon.DF) of document \
+frequencies @dfs == { term: df }, its permuterm index and its deletes to @directory."""
+    writer = lexicon.TermDictWriter(directory + "/global_terms.bin", lexicon.DF)
+    for term in sorted(dfs.keys()):
+        writer.add(term, (dfs[term],))
+    writer.close()
+    term_dict = lexicon.TermDictionary(directory + "/global_terms.bin", lexicon.DF)
+    lexicon.write_permuterm(term_dict, directory + "/global_permuterm.bin")
+    lexicon.write_deletes(term_dict, directory + "/global_deletes.bin")
+
+def open_global_dictionaries(directory):
+    """Return (term dictionary, permuterm index, deletes) of the whole collection stored in \
+@directory, memory-mapped, each one None if missing (a shard built before them)."""
+    return (lexicon.open_dictionary(directory + "/global_terms.bin", lexicon.DF), \
+        lexicon.open_dictionary(directory + "/global_permuterm.bin", lexicon.ROTATION), \
+        lexicon.open_dictionary(directory + "/global_deletes.bin", lexicon.ROTATION))
+
+def read_global_stats(directory):
+    """Return (N, total number of terms of every field, { term: df }) of the whole collection \
+stored in @directory."""
+    dfs = {}
+    with open(directory + "/global_stats.txt", encoding="utf-8") as f:
+        header = [int(value) for value in f.readline().split()]
+        for line in f:
+            (term, df) = line.split(" ")
+            dfs[term] = int(df)
+    return (header[0], header[1 : ], dfs)
+
+def shard_version(name):
+    """Return a value that changes whenever shard @name or the tombstones change."""
+    version = []
+    for filename in (shard_dir(name) + "/term_dict.bin", shard_dir(name) + "/global_stats.txt", \
+        segments.tombstones_file):
+        try:
+            version.append(os.stat(filename).st_mtime_ns)
+        except FileNotFoundError:
+            version.append(0)
+    return tuple(version)
+
+def reset():
+    """Drop every shard."""
+    if os.path.isdir(shards_dir):
+        shutil.rmtree(shards_dir)
@@ -0,0 +1,83 @@
+"""Caching front-end to the Porter stemmer.
+
+The collection has only a few tens of thousands of distinct words, so every word is stemmed
+once and its stem is remembered in a bounded LRU cache. The cache of the build is saved next
+to the index as stem_table.txt, one "word stem" pair per line, and loaded by search.py as a
+read-only table, so stemming a query is a dictionary lookup.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from porterstemmer import PorterStemmer
+
+stem_table_file = "TUAW-dataset/data/stem_table.txt"
+
+# more than the number of distinct words of the collection
+DEFAULT_CACHE_SIZE = 1 << 17
+
+class CachingStemmer:
+    """Drop-in replacement of PorterStemmer remembering the stems of the last @max_size words \
+stemmed, on top of the precomputed stems of @table.
+
+    A single instance can be shared by concurrent threads."""
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE, table=None):
+        self.stemmer = PorterStemmer()
+        self.max_size = max_size
+        self.table = table if table is not None else {}
+        # type(cache) == OrderedDict { word: stem }, least recently used first
+        self.cache = OrderedDict()
+        # the Porter stemmer keeps the word being stemmed in its state
+        self.lock = threading.Lock()
+
+    def stem(self, p, i, j):
+        """Return the stem of p[i:j + 1], like PorterStemmer.stem."""
+        word = p[i : j + 1]
+        stem = self.table.get(word)
+        if stem is not None:
+            return stem
+        with self.lock:
+            stem = self.cache.get(word)
+            if stem is not None:
+                self.cache.move_to_end(word)
+                return stem
+            stem = self.stemmer.stem(word, 0, len(word) - 1)
+            self.cache[word] = stem
+            if len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+        return stem
+
+    def stems(self):
+        """Return { word: stem } of every word known to the stemmer."""
+        with self.lock:
+            all_stems = dict(self.table)
+            all_stems.update(self.cache)
+        return all_stems
+
+    def save(self, filename=stem_table_file):
+        """Write every word known to the stemmer and its stem to @filename."""
+        save_stem_table(self.stems(), filename)
+
+def save_stem_table(stem_table, filename=stem_table_file):
+    """Atomically replace @filename with { word: stem } @stem_table in sorted order of the \
+words."""
+    temp_file = filename + ".tmp"
+    with open(temp_file, mode="w", encoding="utf-8") as f:
+        for word in sorted(stem_table.keys()):
+            # the words contain only letters and digits, the empty word is not saved
+            if len(word) > 0:
+                f.write(word + " " + stem_table[word] + "\n")
+    os.replace(temp_file, filename)
+
+def load_stem_table(filename=stem_table_file):
+    """Return { word: stem } read from @filename, empty if there is no stem table."""
+    stem_table = {}
+    try:
+        with open(filename, encoding="utf-8") as f:
+            for line in f:
+                (word, stem) = line.split()
+                stem_table[word] = stem
+    except FileNotFoundError:
+        pass
+    return stem_table
@@ -0,0 +1,117 @@
+"""Single pass tokenizer producing the same terms as nltk.word_tokenize followed by stopword
+removal, splitting on special characters and stemming.
+
+Only two things about an nltk token matter for the terms: whether the whole token is a
+stopword and its runs of letters and digits. So instead of rewriting the text with the
+punkt sentence splitter and the treebank regexes, one compiled regex finds the tokens that
+can hold letters or digits, with the same boundaries as nltk:
+
+    * the characters the treebank tokenizer always pads with spaces are delimiters
+    * "--", runs of 2 or more "." and "''" are delimiters
+    * "," and ":" are delimiters unless a digit follows (3,000 ; 10:30)
+    * a "." is a delimiter where punkt ends a sentence on it (before whitespace and the
+      next word, or before some punctuation) and at the end of the text, except after an
+      initial (a single letter, e.g. "a. smith") which punkt takes for an abbreviation
+
+The rare tokens with an apostrophe ("it's", "don't", "'quote") and the contractions split
+by nltk ("cannot", "gonna", ...) go through the treebank rules for clitics and contractions.
+Punkt also keeps the "." of the abbreviations it learned, this changes the terms only when
+the abbreviation is a stopword.
+"""
+
+import re
+
+# a "." followed by this ends the text, even after closing brackets and quotes
+# (a " after a space is an opening quote)
+TEXT_END = r"""(?:[\])}>'\u00bb\u201d\u2019]|[ ](?!"|'')|(?<![ ])")*\s*$"""
+
+# punctuation after which punkt ends a sentence on a "."
+AFTER_PERIOD = r"""[)";}\]*:@'({\[\u2018\u2019\u201c\u201d\u00ab\u00bb?!]"""
+
+# closing quotes and brackets standing alone after a ".", moved back to the end of its
+# sentence by punkt, where they keep the "." from being split by the treebank tokenizer
+CLOSING_AFTER_PERIOD = r"""(?:[ ]+(?="|'')|[ ]*[^\S ]\s*)["'\])}]+(?:\s|--|$)"""
+
+# any character of a token that can hold letters and digits
+TOKEN_CHAR = r"""(?:
+        [^\s.,:'\-;@#$%%&?!*()\[\]{}<>"`\u00ab\u00bb\u201c\u201d\u2018\u2019\u201e\u2012-\u2015]
+      | [,:](?=\d)
+      | -(?!-)
+      | '(?!')
+      # the "." of an initial (a single letter) followed by a word, see above
+      | (?<=[^\W\d])(?<![^\s)";}\]*:@'({\[\u2018\u2019\u201c\u201d\u00ab\u00bb][^\W\d])
+        \.(?!\.)(?!%(end)s)(?=\s+[^\W\d_]|\s*[;:,!?])
+      # any other "." not ending a sentence
+      | \.(?!\.)(?!%(end)s)(?!%(after)s)(?:(?=\s+%(closing)s)|(?!\s))
+    )""" % {"end": TEXT_END, "after": AFTER_PERIOD, "closing": CLOSING_AFTER_PERIOD}
+
+# delimiters of several characters, or a token that can hold letters and digits: nltk
+# splits ",," or "::" into "," and a 2nd "," or ":" glued to the next token
+TOKEN_RE = re.compile(r"""
+    --|\.{2,}|''|
+    [,:]([,:]%(char)s*)|
+    (%(char)s+)
+    """ % {"char": TOKEN_CHAR}, re.X)
+
+ALNUM_RE = re.compile(r"[0-9A-Za-z]+")
+
+# a token starting with a quote that is not a clitic, e.g. 'quote
+OPENING_QUOTE_RE = re.compile(r"(?i)(?<!\w)(')(?!(?:re|ve|ll|m|t|s|d|n)\b)(?=\w)")
+
+# clitics split from the end of a token, e.g. it's -> it 's ; don't -> do n't
+CLITIC_RES = [
+    re.compile(r"([^'])(') "),
+    re.compile(r"([^' ])('[sS]|'[mM]|'[dD]|') "),
+    re.compile(r"([^' ])('ll|'LL|'re|'RE|'ve|'VE|n't|N'T) "),
+]
+
+# contractions split by nltk, from Robert MacIntyre's tokenizer
+CONTRACTION_RES = [re.compile(pattern) for pattern in [
+    r"(?i)\b(can)(not)\b",
+    r"(?i)\b(d)('ye)\b",
+    r"(?i)\b(gim)(me)\b",
+    r"(?i)\b(gon)(na)\b",
+    r"(?i)\b(got)(ta)\b",
+    r"(?i)\b(lem)(me)\b",
+    r"(?i)\b(more)('n)\b",
+    r"(?i)\b(wan)(na)(?=\s)",
+    r"(?i) ('t)(is)\b",
+    r"(?i) ('t)(was)\b",
+]]
+
+# a text without a match has no contraction
+CONTRACTION_HINT_RE = re.compile(r"(?i)cannot|d'ye|gimme|gonna|gotta|lemme|more'n|wanna|'twas|'tis")
+
+def split_token(token):
+    """Return the nltk tokens of @token, a token with an apostrophe or a contraction."""
+    token = OPENING_QUOTE_RE.sub(r"\1 ", token)
+    token = " " + token + " "
+    for regexp in CLITIC_RES:
+        token = regexp.sub(r"\1 \2 ", token)
+    for regexp in CONTRACTION_RES:
+        token = regexp.sub(r" \1 \2 ", token)
+    return token.split()
+
+def tokenize(string):
+    """Yield the tokens of @string that can hold letters or digits, as nltk.word_tokenize \
+would return them."""
+    has_contraction = CONTRACTION_HINT_RE.search(string) is not None
+    for match in TOKEN_RE.finditer(string):
+        token = match.group(1) or match.group(2)
+        if token is None:
+            continue
+        if has_contraction or "'" in token:
+            yield from split_token(token)
+        else:
+            yield token
+
+def normalize(string, stemmer, stopwords_set):
+    """Yield the non-empty terms of @string after normalization using @stopwords_set and \
+@stemmer."""
+    for token in tokenize(string):
+        # remove stopwords
+        if token in stopwords_set:
+            continue
+        # split using special characters as delimiters, example "50,000" -> ["50", "000"]
+        for word in ALNUM_RE.findall(token):
+            yield stemmer.stem(word, 0, len(word) - 1)
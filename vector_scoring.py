@@ -0,0 +1,111 @@
+"""Vectorized exact scoring with NumPy, used by search.py when NumPy is installed.
+
+The posting list of every queried term is converted once to two arrays, its doc_ids and the
+weight of the term in each posting for the ranking (see rankings.py), e.g. the lnc weight
+(1 + log(tf)) / norm(doc_id) for the cosine ranking, and kept in an LRU cache. The weights
+of BM25F depend on the boosts of the query, so its arrays hold the tfs per field already
+divided by the length normalization of their field, and only the boosts are applied per
+query. A query then costs a few array
+operations per term instead of a Python loop over its postings:
+
+    * the relevance scores are accumulated term at a time into a dense array of N scores, by
+      adding the weights times the query weight of the term at the doc_ids of its postings
+    * the scores of the matching documents are blended with their inlink fraction
+    * the top k are selected with argpartition and only those k are sorted
+
+The scores are computed with the same operations in the same order as the pure Python
+scorer of search.py, so both return the same scores.
+"""
+
+import cache
+import doc_stats
+import rankings
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# number of values of the cached arrays, a posting has 1 value (4 for BM25F, one per field) of
+# 8 bytes, so at most 32 MB
+ARRAY_CACHE_SIZE = 1 << 22
+
+def available():
+    """Return True if NumPy is installed."""
+    return numpy is not None
+
+class VectorScorer:
+    """Exact top k scorer of the queries of @index. Its arrays are only read after \
+construction, so a single instance can serve concurrent queries."""
+
+    def __init__(self, index):
+        # the number of posts of the index (of the shard of a sharded index)
+        self.N = len(index.doc_norms)
+        # the tfs per field are read only to fill the cache
+        self.get_field_tfs = index.get_field_tfs
+        self.doc_norms = numpy.frombuffer(index.doc_norms, dtype=numpy.float64)
+        self.frac_inlinks = numpy.frombuffer(index.frac_inlinks, dtype=numpy.float64)
+        self.bm25_norms = numpy.frombuffer(index.bm25_norms, dtype=numpy.float64)
+        self.field_norms = [numpy.frombuffer(norms, dtype=numpy.float64) \
+            for norms in index.field_norms]
+        # type(arrays) == { (ranking name, term): (doc_ids, weights or normalized tfs per field) }
+        self.arrays = cache.LRUCache(ARRAY_CACHE_SIZE)
+
+    def posting_arrays(self, term, posting_list, ranking):
+        """Return (doc_ids, weights of @term for @ranking) of the entry (df, doc_ids, tfs) \
+@posting_list of @term as arrays."""
+        key = (ranking.name, term)
+        entry = self.arrays.get(key)
+        if entry is None:
+            (df, doc_ids, tfs) = posting_list
+            doc_ids = numpy.array(doc_ids, dtype=numpy.intp)
+            if ranking.name == "bm25f":
+                field_tfs = self.get_field_tfs([term])[term]
+                values = numpy.array([numpy.array(tfs, dtype=numpy.float64) * norms[doc_ids] \
+                    for tfs, norms in zip(field_tfs, self.field_norms)])
+            else:
+                tfs = numpy.array(tfs, dtype=numpy.float64)
+                if ranking.name == "bm25":
+                    values = tfs * (rankings.K1 + 1) / (tfs + self.bm25_norms[doc_ids])
+                else:
+                    values = (1 + numpy.log(tfs)) / self.doc_norms[doc_ids]
+            entry = (doc_ids, values)
+            self.arrays.put(key, entry, max(1, values.size))
+        if ranking.name == "bm25f":
+            (doc_ids, field_tfs) = entry
+            tf = numpy.zeros(len(doc_ids))
+            for i, field in enumerate(doc_stats.FIELDS):
+                tf += ranking.boosts[field] * field_tfs[i]
+            entry = (doc_ids, tf * (rankings.K1 + 1) / (tf + rankings.K1))
+        return entry
+
+    def top_k(self, weight_query, posting_list, k, ranking=None, matches=None):
+        """Return (doc_id, score) of the top @k documents for the query vector @weight_query \
+scored with @ranking (cosine by default), same scoring and order as search.get_top_k, \
+documents with equal scores by doc_id, only the documents in @matches if given."""
+        if ranking is None:
+            ranking = rankings.Cosine()
+        relevance = numpy.zeros(self.N)
+        matched = numpy.zeros(self.N, dtype=bool)
+        for term, query_weight in weight_query.items():
+            (doc_ids, weights) = self.posting_arrays(term, posting_list[term], ranking)
+            # a doc_id occurs once in a posting list, so the indexed add is a scatter-add
+            relevance[doc_ids] += weights * query_weight
+            matched[doc_ids] = True
+
+        candidates = numpy.flatnonzero(matched)
+        if matches is not None:
+            allowed = numpy.zeros(self.N, dtype=bool)
+            allowed[numpy.fromiter(matches, dtype=numpy.intp, count=len(matches))] = True
+            candidates = candidates[allowed[candidates]]
+        score = ranking.alpha * self.frac_inlinks[candidates] + \
+            (1 - ranking.alpha) * relevance[candidates]
+        if len(candidates) > k:
+            # keep every document tied with the k-th best score, the smallest doc_ids win
+            kth_score = score[numpy.argpartition(-score, k - 1)[k - 1]]
+            best = score >= kth_score
+            candidates = candidates[best]
+            score = score[best]
+        order = numpy.lexsort((candidates, -score))[ : k]
+        return [(int(doc_id), float(doc_score)) for (doc_id, doc_score) \
+            in zip(candidates[order], score[order])]